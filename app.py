@@ -1,53 +1,150 @@
+"""
+Командная строка код-ревьюера.
+
+    python app.py local --repo-path . --branch feature
+    python app.py local --repo-url https://github.com/owner/repo.git --branch feature
+    python app.py github --repo owner/repo --pr 12
+    python app.py batch --repo-path . --branch feature
+
+Бэкенды (OpenAI, GitHub, git, Azure) импортируются только выбранной подкомандой, поэтому
+`--help` и ошибки аргументов не платят за их загрузку, а локальный прогон не загружает GitHub.
+Время старта проверяет `python -m benchmarks.startup`.
+"""
+import argparse
 import logging
 import os
-from common.az_logger.global_logger import CustomLogger
-from git_hub.gh_client import git_hub_code_reviewer
-from git_local.local_client import local_code_reviewer
-from openai import OpenAI
-from open_ai.prompt.llm_prompt import SYSTEM, USER
+from typing import List, Optional
 
-# Настройка логгера
 AZURE_LOGGER_NAMES = ['azure.core.pipeline.policies.http_logging_policy', 'azure.storage']
-for logger_name in AZURE_LOGGER_NAMES:
-    logging.getLogger(logger_name).setLevel(logging.WARNING)
 
-# Инициализация клиентов
-completion_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-logger = CustomLogger(azure_connection_string=None, log_level_local="debug", log_level_azure="debug")
-
-# Константы
-REPO_PATH = "C:\\Users\\Genesis\\PycharmProjects\\codereviewer"
-BRANCH_NAME = "rel_01"
+# Значения по умолчанию
 OUTPUT_FILE_FOR_LOCAL = "code_review_comments.txt"
 OUTPUT_FILE_FOR_GITHUB = "code_review_comments_from github.txt"
+BATCH_FILE_FOR_LOCAL = "code_review_batch.jsonl"
 REPO_NAME = 'wideGenesis/codereviewer'
-
 MODEL_NAME = "gpt-4o-mini"
-REVIEW_ASSISTANT = SYSTEM["code_review_assistant"]
-USER_PROMPT = USER["code_review"]
 
 
-def get_review_params():
-    return logger, completion_client, REVIEW_ASSISTANT, USER_PROMPT, MODEL_NAME
+def get_logger(args: argparse.Namespace):
+    """
+    Настраивает логгер при первом вызове (CustomLogger — singleton).
+    :return: CustomLogger
+    """
+    from common.az_logger.global_logger import CustomLogger
+
+    for logger_name in AZURE_LOGGER_NAMES:
+        logging.getLogger(logger_name).setLevel(logging.WARNING)
+    return CustomLogger(azure_connection_string=None, log_level_local=args.log_level, log_level_azure=args.log_level)
+
+
+def get_review_params(args: argparse.Namespace) -> tuple:
+    """
+    Создаёт клиент OpenAI и возвращает общие параметры ревьюеров.
+    :return: logger, completion_client, system_prompt, user_prompt, gpt_model
+    """
+    from openai import OpenAI
+    from open_ai.prompt.llm_prompt import SYSTEM, USER
 
+    completion_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return get_logger(args), completion_client, SYSTEM["code_review_assistant"], USER["code_review"], args.model
 
-def run_local_code_reviewer():
+
+def run_local_code_reviewer(args: argparse.Namespace):
     """
-    Выполняет локальный код-ревью для указанного репозитория, ветки и выходного файла.
+    Выполняет код-ревью ветки локального репозитория или, с --repo-url, удалённого репозитория.
     :return: None
     """
-    local_code_reviewer(REPO_PATH, BRANCH_NAME, OUTPUT_FILE_FOR_LOCAL, *get_review_params())
+    options = {'base_branch': args.base_branch} if args.base_branch else {}
+    if args.repo_url:
+        from git_local.local_client import remote_code_reviewer
+        remote_code_reviewer(
+            args.repo_url, args.branch, args.output, *get_review_params(args), stream=args.stream, **options
+        )
+        return
+    from git_local.local_client import local_code_reviewer
+    local_code_reviewer(
+        args.repo_path, args.branch, args.output, *get_review_params(args),
+        stream=args.stream, checkpoint_file=args.checkpoint_file, **options
+    )
 
 
-def run_github_code_reviewer():
+def run_local_batch_code_reviewer(args: argparse.Namespace):
     """
-    Выполняет GitHub код-ревью для указанного репозитория.
+    Выполняет локальный код-ревью через OpenAI Batch API (для ночных прогонов).
     :return: None
     """
-    git_hub_code_reviewer(REPO_NAME, OUTPUT_FILE_FOR_GITHUB, *get_review_params())
+    options = {'base_branch': args.base_branch} if args.base_branch else {}
+    from git_local.local_client import local_batch_code_reviewer
+    local_batch_code_reviewer(
+        args.repo_path, args.branch, args.output, *get_review_params(args),
+        batch_file=args.batch_file, poll_interval=args.poll_interval, **options
+    )
 
 
-if __name__ == '__main__':
-    run_local_code_reviewer()
-    run_github_code_reviewer()
+def run_github_code_reviewer(args: argparse.Namespace):
+    """
+    Выполняет GitHub код-ревью pull request'а; без --pr номер запрашивается интерактивно.
+    :return: None
+    """
+    from git_hub.gh_client import git_hub_code_reviewer
+    git_hub_code_reviewer(
+        args.repo, args.output, *get_review_params(args),
+        incremental=not args.full, post_review=args.post_review, pr_number=args.pr
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=MODEL_NAME, help="Completion model")
+    parser.add_argument(
+        "--log-level", default="debug", choices=("debug", "info", "warning", "error"), help="Local log level"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    local = subparsers.add_parser("local", help="Review a branch against the base branch")
+    source = local.add_mutually_exclusive_group()
+    source.add_argument("--repo-path", default=".", help="Path of the local repository")
+    source.add_argument("--repo-url", help="URL of a remote repository, reviewed from a bare partial mirror")
+    local.add_argument("--branch", required=True, help="Branch to review")
+    local.add_argument("--base-branch", help="Base branch of the diff (main by default)")
+    local.add_argument("--output", default=OUTPUT_FILE_FOR_LOCAL, help="Output file of the review comments")
+    local.add_argument("--stream", action="store_true", help="Stream completions and write reviews as they finish")
+    local.add_argument("--checkpoint-file", help="Checkpoint of a streamed review, to resume an interrupted run")
+    local.set_defaults(handler=run_local_code_reviewer)
+
+    github = subparsers.add_parser("github", help="Review a GitHub pull request")
+    github.add_argument("--repo", default=REPO_NAME, help="Repository name (owner/repo)")
+    github.add_argument("--pr", type=int, help="Pull request number (asked interactively when omitted)")
+    github.add_argument("--output", default=OUTPUT_FILE_FOR_GITHUB, help="Output file of the review comments")
+    github.add_argument("--full", action="store_true", help="Review every file instead of the changes since the last run")
+    github.add_argument(
+        "--post-review", action="store_true", default=None,
+        help="Post the findings to the pull request (GITHUB_POST_REVIEW by default)"
+    )
+    github.set_defaults(handler=run_github_code_reviewer)
+
+    batch = subparsers.add_parser("batch", help="Review a local branch through the OpenAI Batch API")
+    batch.add_argument("--repo-path", default=".", help="Path of the local repository")
+    batch.add_argument("--branch", required=True, help="Branch to review")
+    batch.add_argument("--base-branch", help="Base branch of the diff (main by default)")
+    batch.add_argument("--output", default=OUTPUT_FILE_FOR_LOCAL, help="Output file of the review comments")
+    batch.add_argument("--batch-file", default=BATCH_FILE_FOR_LOCAL, help="JSONL file of the batch requests")
+    batch.add_argument("--poll-interval", type=float, default=60, help="Seconds between batch status checks")
+    batch.set_defaults(handler=run_local_batch_code_reviewer)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    from common.instrumentation import configure_tracing, get_run_report
+
+    configure_tracing()
+    args.handler(args)
+    logger = get_logger(args)
+    logger.info(f"Run report saved to {get_run_report().save()}")
     logger.info("Code review process completed successfully.")
+
+
+if __name__ == '__main__':
+    main()
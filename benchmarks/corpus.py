@@ -0,0 +1,150 @@
+import difflib
+import os
+import random
+from typing import Dict, List, Tuple
+
+import git
+
+BENCHMARK_BRANCH = "feature"
+
+
+def generate_module(rng: random.Random, name: str, lines: int) -> List[str]:
+    """
+    Generates the source lines of a synthetic Python module of roughly `lines` lines.
+
+    Args:
+    - rng: Seeded random generator, so the same seed always gives the same corpus.
+    - name: Module name, used in identifiers and docstrings.
+    - lines: Target number of lines.
+    """
+    source = [f'"""Synthetic module {name}."""', "import os", ""]
+    number = 0
+    while len(source) < lines:
+        number += 1
+        argument = rng.choice(["value", "items", "path", "count", "payload"])
+        source.extend([
+            "",
+            f"def {name}_function_{number}({argument}):",
+            f'    """Processes {argument} (step {number})."""',
+            "    result = []",
+            f"    for index in range({rng.randint(2, 50)}):",
+            f"        result.append(({argument}, index * {rng.randint(1, 9)}))",
+            f"    if len(result) > {rng.randint(5, 40)}:",
+            f"        return result[:{rng.randint(1, 10)}]",
+            "    return result",
+        ])
+    return source[:lines]
+
+
+def mutate_module(rng: random.Random, source: List[str], change_ratio: float) -> List[str]:
+    """Rewrites, inserts and deletes about `change_ratio` of the lines of a module."""
+    mutated = []
+    for line in source:
+        if not line.startswith("    ") or rng.random() >= change_ratio:
+            mutated.append(line)
+            continue
+        action = rng.random()
+        if action < 0.6:
+            mutated.append(f"{line}  # changed {rng.randint(1, 1000)}")
+        elif action < 0.8:
+            mutated.extend([line, f"    os.environ.get('SETTING_{rng.randint(1, 1000)}')"])
+        # Otherwise the line is deleted
+    return mutated
+
+
+def generate_changes(
+        files: int,
+        lines: int,
+        change_ratio: float,
+        seed: int = 0
+) -> List[Tuple[str, List[str], List[str]]]:
+    """
+    Generates the before and after versions of `files` synthetic modules.
+
+    Returns:
+    - List of (filename, base lines, changed lines).
+    """
+    rng = random.Random(seed)
+    changes = []
+    for number in range(files):
+        name = f"module_{number:04d}"
+        base = generate_module(rng, name, lines)
+        changes.append((f"src/pkg_{number % 10}/{name}.py", base, mutate_module(rng, base, change_ratio)))
+    return changes
+
+
+def create_repository(path: str, changes: List[Tuple[str, List[str], List[str]]]) -> str:
+    """
+    Creates a git repository at `path` with the base versions committed on `main`
+    and the changed versions committed on the `feature` branch.
+
+    Returns:
+    - Name of the branch with the changes.
+    """
+    repository = git.Repo.init(path, initial_branch="main")
+    with repository.config_writer() as config:
+        config.set_value("user", "name", "Benchmark")
+        config.set_value("user", "email", "benchmark@example.com")
+
+    def write_files(changed: bool) -> None:
+        for filename, base, changed_lines in changes:
+            file_path = os.path.join(path, filename)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as f:
+                f.write("\n".join(changed_lines if changed else base) + "\n")
+        repository.git.add(A=True)
+
+    write_files(changed=False)
+    repository.index.commit("Base version")
+    repository.git.checkout("-b", BENCHMARK_BRANCH)
+    write_files(changed=True)
+    repository.index.commit("Synthetic changes")
+    repository.git.checkout("main")
+    return BENCHMARK_BRANCH
+
+
+def make_patch(base: List[str], changed: List[str]) -> str:
+    """Builds a GitHub-style patch (hunks only, without file headers)."""
+    diff = difflib.unified_diff(base, changed, lineterm="", n=3)
+    return "\n".join(line for line in diff if not line.startswith(("---", "+++")))
+
+
+def generate_pull_requests(
+        count: int,
+        files: int,
+        lines: int,
+        change_ratio: float,
+        seed: int = 0
+) -> List[Dict]:
+    """
+    Generates pull requests in the shape of the GitHub REST API, each with `files` changed Python files.
+
+    Returns:
+    - List of pull request dictionaries with their changed files under the 'files' key.
+    """
+    pull_requests = []
+    for number in range(1, count + 1):
+        pr_files = []
+        for filename, base, changed in generate_changes(files, lines, change_ratio, seed + number):
+            patch = make_patch(base, changed)
+            additions = sum(line.startswith("+") for line in patch.splitlines())
+            deletions = sum(line.startswith("-") for line in patch.splitlines())
+            pr_files.append({
+                "filename": filename,
+                "status": "modified",
+                "additions": additions,
+                "deletions": deletions,
+                "changes": additions + deletions,
+                "patch": patch,
+            })
+        pull_requests.append({
+            "number": number,
+            "title": f"Synthetic pull request {number}",
+            "state": "open",
+            "user": {"login": "benchmark"},
+            "created_at": "2024-01-01T00:00:00Z",
+            "html_url": f"https://github.com/benchmark/repo/pull/{number}",
+            "head": {"sha": f"{seed:08x}{number:032x}"},
+            "files": pr_files,
+        })
+    return pull_requests
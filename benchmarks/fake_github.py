@@ -0,0 +1,145 @@
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+PULLS_PATTERN = re.compile(r"^/repos/(?P<repo>[^/]+/[^/]+)/pulls(?:/(?P<number>\d+)(?P<files>/files)?)?$")
+REVIEWS_PATTERN = re.compile(r"^/repos/(?P<repo>[^/]+/[^/]+)/pulls/(?P<number>\d+)/reviews$")
+
+
+class FakeGitHubServer:
+    """
+    Stub of the GitHub REST endpoints used by the reviewer: pull request list, pull request,
+    pull request files and review submission. Lists are paginated with Link headers and every
+    response has an ETag, so the fetch layer runs its real pagination and conditional request code.
+    Submitted reviews are recorded in `reviews`; an inline comment on a position outside the
+    file's patch is rejected with 422, like GitHub does.
+
+    Args:
+    - repo_name: Repository served by the stub, e.g. 'benchmark/repo'.
+    - pull_requests: Pull requests from benchmarks.corpus.generate_pull_requests.
+    """
+
+    def __init__(self, repo_name: str, pull_requests: List[Dict]):
+        self.repo_name = repo_name
+        self.pull_requests = {pr["number"]: pr for pr in pull_requests}
+        self.stats: Dict[str, int] = {"requests": 0, "not_modified": 0, "reviews": 0}
+        self.reviews: List[Dict] = []
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> "FakeGitHubServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeGitHubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def resolve(self, path: str) -> Optional[object]:
+        """Returns the full (unpaginated) body of a GET path, or None when it is unknown."""
+        match = PULLS_PATTERN.match(path)
+        if match is None or match.group("repo") != self.repo_name:
+            return None
+        if match.group("number") is None:
+            return [{key: value for key, value in pr.items() if key != "files"} for pr in self.pull_requests.values()]
+        pr = self.pull_requests.get(int(match.group("number")))
+        if pr is None:
+            return None
+        if match.group("files"):
+            return pr["files"]
+        return {key: value for key, value in pr.items() if key != "files"}
+
+    def submit_review(self, path: str, review: Dict) -> int:
+        """Records a submitted review and returns the HTTP status of the submission."""
+        match = REVIEWS_PATTERN.match(path)
+        if match is None or match.group("repo") != self.repo_name:
+            return 404
+        pr = self.pull_requests.get(int(match.group("number")))
+        if pr is None:
+            return 404
+        patches = {file["filename"]: file.get("patch", "") for file in pr["files"]}
+        for comment in review.get("comments", []):
+            patch = patches.get(comment["path"])
+            if patch is None or not 0 < comment["position"] < len(patch.rstrip("\n").split("\n")):
+                return 422
+        with self._lock:
+            self.stats["reviews"] += 1
+            self.reviews.append({"pr_number": pr["number"], **review})
+        return 200
+
+    def _handler_class(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                with server._lock:
+                    server.stats["requests"] += 1
+                url = urlsplit(self.path)
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                body = server.resolve(url.path)
+                if body is None:
+                    self._send(404, json.dumps({"message": "Not Found"}).encode(), {})
+                    return
+
+                headers = {}
+                if isinstance(body, list):
+                    per_page = int(query.get("per_page", 30))
+                    page = int(query.get("page", 1))
+                    if page * per_page < len(body):
+                        next_query = "&".join(f"{key}={value}" for key, value in {**query, "page": page + 1}.items())
+                        headers["Link"] = f'<{server.api_url}{url.path}?{next_query}>; rel="next"'
+                    body = body[(page - 1) * per_page:page * per_page]
+
+                data = json.dumps(body).encode()
+                etag = f'"{hashlib.sha1(data).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    with server._lock:
+                        server.stats["not_modified"] += 1
+                    self._send(304, b"", {"ETag": etag, **headers})
+                    return
+                self._send(200, data, {"ETag": etag, **headers})
+
+            def do_POST(self) -> None:
+                with server._lock:
+                    server.stats["requests"] += 1
+                review = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                status = server.submit_review(urlsplit(self.path).path, review)
+                if status != 200:
+                    message = "Unprocessable Entity" if status == 422 else "Not Found"
+                    self._send(status, json.dumps({"message": message}).encode(), {})
+                    return
+                self._send(200, json.dumps({"id": len(server.reviews), "state": "COMMENTED"}).encode(), {})
+
+            def _send(self, status: int, data: bytes, headers: Dict[str, str]) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
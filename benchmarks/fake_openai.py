@@ -0,0 +1,217 @@
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Set
+
+
+RATE_LIMIT_HEADERS = {
+    "x-ratelimit-limit-requests": "100000",
+    "x-ratelimit-remaining-requests": "99999",
+    "x-ratelimit-limit-tokens": "100000000",
+    "x-ratelimit-remaining-tokens": "99999999",
+}
+
+
+class FakeOpenAIServer:
+    """
+    Local OpenAI-compatible chat completions endpoint for benchmarks.
+
+    Answers `POST /v1/chat/completions` (plain, `stream=True` and JSON-schema structured output)
+    with a canned review after a simulated latency, and sends generous x-ratelimit-* headers
+    so the client-side limiter does not throttle. Every `rate_limit_every`-th request is answered with a 429 and a Retry-After.
+
+    Args:
+    - latency: Base seconds before the first byte of a response.
+    - jitter: Extra random seconds (uniform 0..jitter) added to the latency.
+    - token_latency: Seconds between streamed chunks.
+    - completion_words: Number of words in every review.
+    - rate_limit_every: Inject a 429 on every N-th request (0 disables injection).
+    - retry_after_ms: Retry-After of the injected 429 responses.
+    - major_ratio: Share of files whose structured review reports a major finding.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.2,
+            jitter: float = 0.05,
+            token_latency: float = 0.005,
+            completion_words: int = 60,
+            rate_limit_every: int = 0,
+            retry_after_ms: int = 200,
+            major_ratio: float = 0.0,
+            seed: int = 0
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.completion_words = completion_words
+        self.rate_limit_every = rate_limit_every
+        self.retry_after_ms = retry_after_ms
+        self.major_ratio = major_ratio
+        self.stats: Dict[str, int] = {"requests": 0, "rate_limited": 0, "streamed": 0}
+        self._random = random.Random(seed)
+        self._prefixes: Set[str] = set()
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _next_request(self, stream: bool) -> bool:
+        """Counts a request; returns True when it has to be rate limited."""
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["streamed"] += int(stream)
+            limited = bool(self.rate_limit_every) and self.stats["requests"] % self.rate_limit_every == 0
+            self.stats["rate_limited"] += int(limited)
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if not limited:
+            time.sleep(delay)
+        return limited
+
+    def _structured_review(self, body: dict) -> str:
+        """
+        One finding per file of the request, in the format of schema.completion.findings.
+        A stable `major_ratio` share of the files (by label) gets a major finding instead of a minor one.
+        """
+        content = body["messages"][-1]["content"]
+        labels = re.findall(r"^### File: (.+)$", content, re.MULTILINE)
+        # A single-file request has no label, so its diff decides the severity
+        keys = labels or [content]
+        return json.dumps({"findings": [
+            {"file": label, "start_line": 1, "end_line": 1,
+             "severity": "major" if zlib.crc32(key.encode()) % 1000 < self.major_ratio * 1000 else "minor",
+             "category": "style", "title": "Synthetic finding", "suggestion": " ".join(["note"] * self.completion_words)}
+            for label, key in zip(labels or ["file"], keys)
+        ]})
+
+    def _review_words(self, body: dict) -> list:
+        """Review text in words; a packed request gets one `### Review for <file>` section per file."""
+        content = body["messages"][-1]["content"]
+        labels = re.findall(r"^### File: (.+)$", content, re.MULTILINE)
+        if not labels:
+            words = [f"Reviewed {content.split(chr(10), 1)[0][:40]}:"]
+            words.extend(f"note{number}" for number in range(self.completion_words - 1))
+            return [word + " " for word in words]
+        words, per_file = [], max(self.completion_words // len(labels), 1)
+        for label in labels:
+            words.append(f"\n### Review for {label}\n")
+            words.extend(f"note{number} " for number in range(per_file))
+        return words
+
+    def _usage(self, body: dict) -> dict:
+        """
+        Token usage with a simulated prompt cache: like the real API, a repeated prefix of at least
+        1024 tokens (all messages before the last one) is reported as cached in 128-token steps.
+        """
+        prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4
+        prefix = "\0".join(message["content"] for message in body["messages"][:-1])
+        with self._lock:
+            cached = prefix in self._prefixes
+            self._prefixes.add(prefix)
+        prefix_tokens = len(prefix) // 4
+        cached_tokens = prefix_tokens // 128 * 128 if cached and prefix_tokens >= 1024 else 0
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": self.completion_words,
+            "total_tokens": prompt_tokens + self.completion_words,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+    def _handler_class(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send_json(self, status: int, payload: dict, headers: Optional[Dict[str, str]] = None) -> None:
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                if server._next_request(bool(body.get("stream"))):
+                    self._send_json(
+                        429,
+                        {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                        {"retry-after-ms": str(server.retry_after_ms)}
+                    )
+                    return
+                if body.get("stream"):
+                    self._stream(body)
+                else:
+                    self._complete(body)
+
+            def _complete(self, body: dict) -> None:
+                if body.get("response_format", {}).get("type") == "json_schema":
+                    content = server._structured_review(body)
+                else:
+                    content = "".join(server._review_words(body))
+                self._send_json(200, {
+                    "id": "chatcmpl-benchmark",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content, "refusal": None},
+                    }],
+                    "usage": server._usage(body),
+                }, RATE_LIMIT_HEADERS)
+
+            def _stream(self, body: dict) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                for name, value in RATE_LIMIT_HEADERS.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                chunk = {"id": "chatcmpl-benchmark", "object": "chat.completion.chunk",
+                         "created": int(time.time()), "model": body["model"]}
+                for word in server._review_words(body):
+                    delta = {"choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps({**chunk, **delta})}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(server.token_latency)
+                final = {**chunk, "choices": [], "usage": server._usage(body)}
+                self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
@@ -0,0 +1,181 @@
+"""
+Offline throughput benchmark of the review pipeline.
+
+Runs the local and GitHub reviewers against a fake OpenAI-compatible server and a stub GitHub API
+on a synthetic corpus, and reports files/sec, p50/p95 request latency and peak RSS per scenario.
+
+    python -m benchmarks.run --files 200 --latency 0.3 --rate-limit-every 20 --output bench.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+from benchmarks.corpus import create_repository, generate_changes, generate_pull_requests
+from benchmarks.fake_github import FakeGitHubServer
+from benchmarks.fake_openai import FakeOpenAIServer
+
+SCENARIOS = ("local", "local-stream", "github")
+BENCHMARK_REPO_NAME = "benchmark/repo"
+BENCHMARK_MODEL_NAME = "gpt-4o-mini"
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of the current process in MiB (None where it cannot be measured)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_scenario(scenario: str, environment: Dict[str, str], params: Dict) -> Dict:
+    """
+    Runs one scenario in the current (fresh) process and returns its measurements.
+
+    The environment is applied before the reviewer modules are imported, because the
+    settings classes read it at import time.
+    """
+    os.environ.update(environment)
+    import logging
+
+    from openai import OpenAI
+
+    from common.instrumentation import start_run
+    from git_hub.gh_client import review_pull_request
+    from git_local.local_client import local_code_reviewer
+    from open_ai.prompt.llm_prompt import SYSTEM, USER
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logger = logging.getLogger("benchmark")
+    client = OpenAI(api_key="benchmark", base_url=params["openai_url"], max_retries=0)
+    output_file = os.path.join(params["work_dir"], f"{scenario}.txt")
+    review_args = (logger, client, SYSTEM[params["system_prompt"]], USER["code_review"], BENCHMARK_MODEL_NAME)
+
+    report = start_run(scenario)
+    started = time.perf_counter()
+    if scenario == "github":
+        for pr_number in range(1, params["prs"] + 1):
+            review_pull_request(BENCHMARK_REPO_NAME, pr_number, output_file, *review_args, incremental=False)
+        files = params["prs"] * params["files"]
+    else:
+        local_code_reviewer(
+            params["repo_path"], params["branch"], output_file, *review_args,
+            stream=scenario == "local-stream", checkpoint_file=f"{output_file}.checkpoint.jsonl"
+        )
+        files = params["files"]
+    wall_seconds = time.perf_counter() - started
+
+    summary = report.to_dict()
+    llm_stage = "llm_stream" if scenario == "local-stream" else "llm"
+    latencies = report.stages.get(llm_stage, {}).get("durations", [])
+    usage = summary["models"].get(BENCHMARK_MODEL_NAME, {})
+    counters = summary["counters"]
+    return {
+        "scenario": scenario,
+        "files": files,
+        "wall_seconds": round(wall_seconds, 3),
+        "files_per_second": round(files / wall_seconds, 2),
+        "requests": len(latencies),
+        "p50_seconds": round(statistics.median(latencies), 4) if latencies else None,
+        "p95_seconds": round(percentile(latencies, 0.95), 4) if latencies else None,
+        "llm_retries": counters["llm_retries"],
+        "routes": {key: counters.get(f"route_{key}", 0) for key in ("small", "strong", "escalated")},
+        "route_cost_usd": counters.get("route_cost_microusd", 0) / 1e6,
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "cached_prompt_ratio": usage.get("cached_prompt_ratio", 0.0),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": summary["stages"],
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--files", type=int, default=50, help="Changed files per diff / pull request")
+    parser.add_argument("--lines", type=int, default=200, help="Lines per synthetic module")
+    parser.add_argument("--change-ratio", type=float, default=0.1, help="Share of changed lines per module")
+    parser.add_argument("--prs", type=int, default=2, help="Pull requests reviewed in the github scenario")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake completion latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Random extra latency in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Delay between streamed chunks")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every N-th request with a 429")
+    parser.add_argument("--concurrency", type=int, default=8, help="REVIEW_CONCURRENCY of the reviewer")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scenario")
+    parser.add_argument("--major-ratio", type=float, default=0.0, help="Share of files with a major finding")
+    parser.add_argument("--strong-model", help="Enable the model cascade with this ROUTER_STRONG_MODEL")
+    parser.add_argument("--system-prompt", default="code_review_assistant", help="Key of SYSTEM in llm_prompt.py")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> List[Dict]:
+    args = parse_args(argv)
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="codereviewer-bench-") as work_dir:
+        repo_path = os.path.join(work_dir, "repo")
+        branch = create_repository(repo_path, generate_changes(args.files, args.lines, args.change_ratio, args.seed))
+        pull_requests = generate_pull_requests(args.prs, args.files, args.lines, args.change_ratio, args.seed)
+
+        with FakeOpenAIServer(
+                latency=args.latency, jitter=args.jitter, token_latency=args.token_latency,
+                rate_limit_every=args.rate_limit_every, major_ratio=args.major_ratio, seed=args.seed
+        ) as openai_server, FakeGitHubServer(BENCHMARK_REPO_NAME, pull_requests) as github_server:
+            environment = {
+                "OPENAI_API_KEY": "benchmark",
+                "GITHUB_TOKEN": "benchmark",
+                "GITHUB_API_URL": github_server.api_url,
+                "GITHUB_ETAG_CACHE_PATH": "",
+                "REVIEW_CACHE_BACKEND": "none",
+                "REVIEW_CONCURRENCY": str(args.concurrency),
+                "REVIEW_STATE_PATH": os.path.join(work_dir, "state"),
+                "ROUTER_STRONG_MODEL": args.strong_model or "",
+                "ROUTER_LOG_PATH": "",
+            }
+            params = {
+                "openai_url": openai_server.base_url, "work_dir": work_dir, "repo_path": repo_path,
+                "branch": branch, "files": args.files, "prs": args.prs, "system_prompt": args.system_prompt,
+            }
+            for scenario in scenarios:
+                for _ in range(args.repeat):
+                    requests_before = dict(openai_server.stats)
+                    # A fresh interpreter per run keeps peak RSS and module state independent between runs
+                    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                        result = executor.submit(run_scenario, scenario, environment, params).result()
+                    result["rate_limited"] = openai_server.stats["rate_limited"] - requests_before["rate_limited"]
+                    results.append(result)
+                    print(
+                        f"{scenario:<13} files={result['files']:<5} files/s={result['files_per_second']:<8} "
+                        f"p50={result['p50_seconds']}s p95={result['p95_seconds']}s "
+                        f"requests={result['requests']} 429s={result['rate_limited']} "
+                        f"retries={result['llm_retries']} cached_prompt={result['cached_prompt_ratio']:.0%} "
+                        f"peak_rss={result['peak_rss_mb']}MiB"
+                        + (f" routes={result['routes']} cost=${result['route_cost_usd']:.4f}" if args.strong_model else "")
+                    )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Startup latency benchmark of the CLI entry points.
+
+Imports every entry point in a fresh interpreter with `python -X importtime` and reports the
+median import time, the wall time of the process and the heaviest packages. A run fails when
+an entry point imports a backend it must not load (e.g. `--help` loading openai, a local review
+loading the GitHub client) or exceeds its import time budget, so it can guard startup in CI.
+
+    python -m benchmarks.startup --repeat 5 --output startup.json
+    python -m benchmarks.startup --target cli --max-ms 80
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ("openai", "github", "git", "numpy", "sqlalchemy", "opencensus", "redis", "redisvl")
+
+# Entry point: module imported by it, backends it must not load, import time budget in ms (None: report only)
+TARGETS: Dict[str, Tuple[str, Tuple[str, ...], Optional[float]]] = {
+    "cli": ("app", BACKENDS + ("pydantic",), 100.0),
+    "local": ("git_local.local_client", ("github", "numpy", "sqlalchemy", "opencensus", "redis", "redisvl"), None),
+    "github": ("git_hub.gh_client", ("git", "numpy", "sqlalchemy", "opencensus", "redis", "redisvl"), None),
+}
+
+
+def parse_importtime(output: str) -> Dict[str, Tuple[int, int]]:
+    """Self and cumulative import time in microseconds per module of `-X importtime` output."""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure(module: str) -> Dict:
+    """Imports `module` in a fresh interpreter and returns its import timings."""
+    environment = {**os.environ, "PYTHONPATH": REPO_ROOT}
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, env=environment, capture_output=True, text=True
+    )
+    wall_seconds = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+    modules = parse_importtime(completed.stderr)
+    packages = defaultdict(int)
+    for name, (self_us, _) in modules.items():
+        packages[name.split(".")[0]] += self_us
+    return {
+        "import_ms": modules[module][1] / 1000,
+        "wall_ms": wall_seconds * 1000,
+        "packages": {name: self_us / 1000 for name, self_us in packages.items()},
+    }
+
+
+def run_target(name: str, repeat: int, max_ms: Optional[float]) -> Dict:
+    module, forbidden, budget = TARGETS[name]
+    budget = max_ms if max_ms is not None else budget
+    runs = [measure(module) for _ in range(repeat)]
+    packages = runs[-1]["packages"]
+    loaded = sorted(package for package in forbidden if package in packages)
+    import_ms = statistics.median(run["import_ms"] for run in runs)
+    return {
+        "target": name,
+        "module": module,
+        "import_ms": round(import_ms, 1),
+        "wall_ms": round(statistics.median(run["wall_ms"] for run in runs), 1),
+        "budget_ms": budget,
+        "heaviest": [
+            [package, round(ms, 1)] for package, ms in sorted(packages.items(), key=lambda item: -item[1])[:5]
+        ],
+        "forbidden_loaded": loaded,
+        "passed": not loaded and (budget is None or import_ms <= budget),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> List[Dict]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=tuple(TARGETS) + ("all",), default="all")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument("--max-ms", type=float, help="Import time budget of the selected targets")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    targets = tuple(TARGETS) if args.target == "all" else (args.target,)
+    results = []
+    for name in targets:
+        result = run_target(name, args.repeat, args.max_ms)
+        results.append(result)
+        print(
+            f"{name:<7} import={result['import_ms']}ms wall={result['wall_ms']}ms "
+            f"budget={result['budget_ms'] if result['budget_ms'] is not None else '-'} "
+            f"heaviest={', '.join(f'{package}:{ms}ms' for package, ms in result['heaviest'])}"
+            + (f" FORBIDDEN={','.join(result['forbidden_loaded'])}" if result['forbidden_loaded'] else "")
+        )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    sys.exit(0 if all(result["passed"] for result in main()) else 1)
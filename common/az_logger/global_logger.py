@@ -1,12 +1,17 @@
 import atexit
+import copy
 import logging
-import os
+import queue
+import sys
 
-from opencensus.ext.azure.log_exporter import AzureLogHandler
 from logging import StreamHandler
-from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
 from typing import Optional, Set, Any
 
+from settings.conf import LoggingConfig
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_new", "block")
+
 
 class SingletonMeta(type):
     """Метакласс для создания Singleton."""
@@ -19,38 +24,113 @@ class SingletonMeta(type):
         return cls._instances[cls]
 
 
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler над ограниченной очередью: в потоке вызывающего только кладёт запись в очередь,
+    при переполнении применяет overflow policy и обрезает слишком длинные сообщения.
+    """
+
+    def __init__(self, log_queue: queue.Queue, overflow_policy: str, max_message_length: int):
+        super().__init__(log_queue)
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow_policy}, expected one of {OVERFLOW_POLICIES}")
+        self.overflow_policy = overflow_policy
+        self.max_message_length = max_message_length
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Форматирование выполняется в потоке QueueListener; здесь только обрезка больших payload
+        message = record.getMessage()
+        if len(message) <= self.max_message_length:
+            return record
+        record = copy.copy(record)
+        record.msg = f"{message[:self.max_message_length]}... [truncated {len(message) - self.max_message_length} chars]"
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.overflow_policy == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.overflow_policy == "drop_oldest":
+                try:
+                    self.queue.get_nowait()
+                    self.queue.put_nowait(record)
+                except (queue.Empty, queue.Full):
+                    pass
+
+
+class BlockingSentinelQueueListener(QueueListener):
+    """QueueListener, который дожидается места в заполненной очереди для sentinel при остановке."""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
 class CustomLogger(metaclass=SingletonMeta):
-    def __init__(self, azure_connection_string: Optional[str], log_level_local: str, log_level_azure: str):
+    def __init__(
+            self,
+            azure_connection_string: Optional[str],
+            log_level_local: str,
+            log_level_azure: str,
+            config: Optional[LoggingConfig] = None
+    ):
         """
         Initializes the logger with AzureLogHandler if connection string is provided.
         Otherwise, defaults to a local logger.
 
+        Records are put into a bounded queue in the caller's thread and handled by a
+        QueueListener thread, so StreamHandler and the Azure export never block the caller.
+
         :param azure_connection_string: Azure connection string for logging to Azure.
         :param log_level_local: Logging level for local logger.
         :param log_level_azure: Logging level for Azure logger.
+        :param config: Queue size, overflow policy, message truncation and Azure batching settings.
         """
         if not hasattr(self, 'initialized'):
+            config = config or LoggingConfig()
             self.logger = logging.getLogger("custom_logger")
             self.logger.setLevel(logging.DEBUG)  # Установка уровня логирования на DEBUG
+            self.logger.propagate = False
 
             # StreamHandler для локального логирования (stdout)
             stream_handler = StreamHandler()
             stream_handler.setLevel(self._get_log_level(log_level_local))
             stream_handler.setFormatter(self._get_formatter())
-            self.logger.addHandler(stream_handler)
+            handlers = [stream_handler]
 
-            # Azure Handler (если указан connection string)
+            # Azure Handler (если указан connection string); экспорт пачками из собственной очереди
             if azure_connection_string:
-                azure_handler = AzureLogHandler(connection_string=azure_connection_string)
+                # Импорт OpenCensus (~0.3 с) только при включённом экспорте в Azure
+                from opencensus.ext.azure.log_exporter import AzureLogHandler
+
+                azure_handler = AzureLogHandler(
+                    connection_string=azure_connection_string,
+                    export_interval=config.AZURE_LOG_EXPORT_INTERVAL,
+                    max_batch_size=config.AZURE_LOG_MAX_BATCH_SIZE,
+                    queue_capacity=config.AZURE_LOG_QUEUE_CAPACITY
+                )
                 azure_handler.setLevel(self._get_log_level(log_level_azure))
                 azure_handler.setFormatter(self._get_formatter())
-                self.logger.addHandler(azure_handler)
+                handlers.append(azure_handler)
 
             else:
                 print("Warning: Azure connection string is not provided. Defaulting to local logger only.")
 
-            # Настройка пула потоков для асинхронного логирования
-            # self.executor = ThreadPoolExecutor(max_workers=1)
+            # Очередь и поток-обработчик для неблокирующего логирования
+            self.queue_handler = BoundedQueueHandler(
+                queue.Queue(maxsize=config.LOG_QUEUE_SIZE), config.LOG_OVERFLOW_POLICY, config.LOG_MAX_MESSAGE_LENGTH
+            )
+            self.queue_handler.setLevel(min(handler.level for handler in handlers))
+            self.logger.addHandler(self.queue_handler)
+            self.listener = BlockingSentinelQueueListener(
+                self.queue_handler.queue, *handlers, respect_handler_level=True
+            )
+            self.listener.start()
 
             # Регистрация метода shutdown при завершении программы
             atexit.register(self.shutdown)
@@ -90,49 +170,69 @@ class CustomLogger(metaclass=SingletonMeta):
     #     custom_dimensions["message"] = record.getMessage()
     #     return custom_dimensions
 
-    def _log_async(self, level: str, msg: str, kwargs):
+    def _log(
+            self, level: str, msg: str, exc_info, depth: int, extra: Optional[dict] = None, stack_info=False,
+            stacklevel: int = 1
+    ):
         log_level = self._get_log_level(level)
-
-        fn, lno, func, sinfo = self.logger.findCaller(stack_info=False)
+        if not self.logger.isEnabledFor(log_level):
+            return
+
+        # sys._getframe вместо Logger.findCaller: O(1) без обхода стека; depth — кадр вызывающего кода,
+        # stacklevel > 1, как у logging.Logger, сдвигает его к внешним вызовам
+        try:
+            frame = sys._getframe(depth + max(stacklevel, 1) - 1)
+        except ValueError:
+            frame = sys._getframe(depth)
+            while frame.f_back is not None:
+                frame = frame.f_back
+        if exc_info and not isinstance(exc_info, (tuple, BaseException)):
+            exc_info = sys.exc_info()
+        if isinstance(exc_info, BaseException):
+            exc_info = (type(exc_info), exc_info, exc_info.__traceback__)
 
         record = self.logger.makeRecord(
-            self.logger.name, log_level, fn, lno, msg, args=None, exc_info=None, func=func
+            self.logger.name, log_level, frame.f_code.co_filename, frame.f_lineno, msg, args=None,
+            exc_info=exc_info or None, func=frame.f_code.co_name, extra=extra,
+            sinfo=self._stack_info(frame) if stack_info else None
         )
-
         self.logger.handle(record)
 
-    def log(self, level: str, msg: str, exc_info=False, **kwargs):
-        log_level = self._get_log_level(level)
+    @staticmethod
+    def _stack_info(frame) -> str:
+        import traceback
+        return "Stack (most recent call last):\n" + "".join(traceback.format_stack(frame)).rstrip("\n")
 
-        # Создание записи лога с корректными значениями
-        self.logger.log(log_level, msg, exc_info=exc_info, **kwargs)
+    def log(self, level: str, msg: str, exc_info=False, **kwargs):
+        self._log(level, msg, exc_info, 2, **kwargs)
 
     def shutdown(self):
-        pass
-
-    # def log(self, level: str, msg: str, **kwargs):
-    #     """Логирование сообщения с использованием асинхронного вызова."""
-    #     self.executor.submit(self._log_async, level, msg, kwargs)
-
-    # def shutdown(self):
-    #     """Закрытие пула потоков при завершении работы программы."""
-    #     self.executor.shutdown()
+        """Останавливает поток-обработчик, дописав все записи из очереди, и сбрасывает буферы обработчиков."""
+        listener = getattr(self, 'listener', None)
+        if listener is None or listener._thread is None:
+            return
+        listener.stop()
+        if self.queue_handler.dropped:
+            print(f"Warning: {self.queue_handler.dropped} log records were dropped because the log queue was full.")
+        for handler in listener.handlers:
+            handler.flush()
+            handler.close()
 
     # Делегирование стандартных методов логирования на внутренний логгер
-    def debug(self, msg: str, **kwargs):
-        self.log("debug", msg, **kwargs)
+    def debug(self, msg: str, exc_info=False, **kwargs):
+        self._log("debug", msg, exc_info, 2, **kwargs)
 
-    def info(self, msg: str, **kwargs):
-        self.log("info", msg, **kwargs)
+    def info(self, msg: str, exc_info=False, **kwargs):
+        self._log("info", msg, exc_info, 2, **kwargs)
 
-    def warning(self, msg: str, **kwargs):
-        self.log("warning", msg, **kwargs)
+    def warning(self, msg: str, exc_info=False, **kwargs):
+        self._log("warning", msg, exc_info, 2, **kwargs)
 
     def error(self, msg: str, exc_info=True, **kwargs):
-        self.log("error", msg, exc_info=exc_info, **kwargs)
+        self._log("error", msg, exc_info, 2, **kwargs)
 
-    def exception(self, msg: str, **kwargs):
-        self.log("error", msg, exc_info=True, **kwargs)
+    def exception(self, msg: str, exc_info=True, **kwargs):
+        self._log("error", msg, exc_info, 2, **kwargs)
 
-    def critical(self, msg: str, **kwargs):
-        self.log("critical", msg, **kwargs)
+    def critical(self, msg: str, exc_info=False, **kwargs):
+        self._log("critical", msg, exc_info, 2, **kwargs)
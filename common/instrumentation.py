@@ -0,0 +1,240 @@
+import functools
+import inspect
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from settings.conf import AppInsightsConfig, InstrumentationConfig
+
+_tracer = None
+
+
+class RunReport:
+    """
+    Collects wall time per pipeline stage, LLM retries, token usage and cache hits of one review run.
+    All methods are thread-safe; the report is shared by the event loop and worker threads.
+    """
+
+    def __init__(self, name: str = "review"):
+        self.name = name
+        self.run_id = uuid.uuid4().hex
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.models: Dict[str, Dict[str, int]] = {}
+        self.counters: Dict[str, int] = {"llm_retries": 0, "cache_hits": 0, "cache_misses": 0}
+
+    def record_stage(self, stage: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            stats = self.stages.setdefault(stage, {"calls": 0, "errors": 0, "durations": []})
+            stats["calls"] += 1
+            stats["errors"] += int(error)
+            stats["durations"].append(seconds)
+
+    def record_usage(self, gpt_model: str, usage: Any) -> None:
+        """Adds the token counts of a completion `usage` object."""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        with self._lock:
+            stats = self.models.setdefault(
+                gpt_model, {"requests": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0}
+            )
+            stats["requests"] += 1
+            stats["prompt_tokens"] += usage.prompt_tokens or 0
+            stats["completion_tokens"] += usage.completion_tokens or 0
+            stats["cached_prompt_tokens"] += (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+    def increment(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def merge(self, stages: Dict[str, Dict[str, Any]], counters: Dict[str, int]) -> None:
+        """Adds the raw stages and counters of a report recorded in another process."""
+        with self._lock:
+            for stage, stats in stages.items():
+                own = self.stages.setdefault(stage, {"calls": 0, "errors": 0, "durations": []})
+                own["calls"] += stats["calls"]
+                own["errors"] += stats["errors"]
+                own["durations"].extend(stats["durations"])
+            for counter, amount in counters.items():
+                self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {}
+            for stage, stats in self.stages.items():
+                durations = sorted(stats["durations"])
+                stages[stage] = {
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "total_seconds": round(sum(durations), 6),
+                    "mean_seconds": round(sum(durations) / len(durations), 6),
+                    "p95_seconds": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 6),
+                    "max_seconds": round(durations[-1], 6),
+                }
+            return {
+                "run_id": self.run_id,
+                "name": self.name,
+                "started_at": self.started_at.isoformat(),
+                "wall_seconds": round(time.perf_counter() - self._started, 6),
+                "stages": stages,
+                "models": {
+                    model: {
+                        **stats,
+                        # Share of prompt tokens served from the provider-side prompt cache
+                        "cached_prompt_ratio": round(stats["cached_prompt_tokens"] / stats["prompt_tokens"], 4)
+                        if stats["prompt_tokens"] else 0.0,
+                    }
+                    for model, stats in self.models.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+    def save(self, path: Optional[str] = None) -> str:
+        path = path or InstrumentationConfig().RUN_REPORT_PATH
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return path
+
+
+_default_report = RunReport()
+_current_report: ContextVar[Optional[RunReport]] = ContextVar("run_report", default=None)
+_usage_sink: ContextVar[Optional[List[Tuple[str, Any]]]] = ContextVar("usage_sink", default=None)
+
+
+def get_run_report() -> RunReport:
+    """Returns the report of the current run (context-local when started with start_run)."""
+    return _current_report.get() or _default_report
+
+
+def start_run(name: str = "review") -> RunReport:
+    """Starts a new report for the current context; worker threads started with asyncio.to_thread inherit it."""
+    report = RunReport(name)
+    _current_report.set(report)
+    return report
+
+
+def configure_tracing(config: Optional[InstrumentationConfig] = None) -> bool:
+    """
+    Exports stages as OpenCensus spans to Application Insights when TRACING_ENABLED is set
+    and APPLICATIONINSIGHTS_CONNECTION_STRING is configured.
+    """
+    global _tracer
+    config = config or InstrumentationConfig()
+    connection_string = AppInsightsConfig().APPLICATIONINSIGHTS_CONNECTION_STRING
+    if not config.TRACING_ENABLED or not connection_string:
+        return False
+    from opencensus.ext.azure.trace_exporter import AzureExporter
+    from opencensus.trace.samplers import ProbabilitySampler
+    from opencensus.trace.tracer import Tracer
+
+    _tracer = Tracer(
+        exporter=AzureExporter(connection_string=connection_string),
+        sampler=ProbabilitySampler(config.TRACING_SAMPLING_RATE)
+    )
+    return True
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Measures the wall time of a block as pipeline stage `name`."""
+    report = get_run_report()
+    span = _tracer.span(name=name) if _tracer is not None else None
+    if span is not None:
+        span.__enter__()
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        report.record_stage(name, time.perf_counter() - started, error)
+        if span is not None:
+            span.__exit__(None, None, None)
+
+
+def instrumented(name: str) -> Callable:
+    """
+    Decorator recording every call of a function as pipeline stage `name`.
+    Works for plain functions, coroutines and generators (for generators, only the time spent
+    producing items is counted, not the time the consumer holds them).
+    """
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                report = get_run_report()
+                generator = func(*args, **kwargs)
+                busy, error = 0.0, False
+                try:
+                    while True:
+                        started = time.perf_counter()
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+                        finally:
+                            busy += time.perf_counter() - started
+                        yield item
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    generator.close()
+                    report.record_stage(name, busy, error)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def capture_usage() -> Iterator[List[Tuple[str, Any]]]:
+    """
+    Collects the (model, usage) of every completion made inside the block, in addition to the run report,
+    so the caller can attribute the cost of a request.
+    """
+    captured: List[Tuple[str, Any]] = []
+    token = _usage_sink.set(captured)
+    try:
+        yield captured
+    finally:
+        _usage_sink.reset(token)
+
+
+def record_usage(gpt_model: str, usage: Any) -> None:
+    get_run_report().record_usage(gpt_model, usage)
+    sink = _usage_sink.get()
+    if sink is not None and usage is not None:
+        sink.append((gpt_model, usage))
+
+
+def record_retry(retry_state: Any = None) -> None:
+    """tenacity `before_sleep` hook counting LLM retries."""
+    get_run_report().increment("llm_retries")
+
+
+def record_cache(hit: bool) -> None:
+    get_run_report().increment("cache_hits" if hit else "cache_misses")
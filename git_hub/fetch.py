@@ -0,0 +1,203 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from settings.conf import GitHubConfig
+
+
+class ETagStore:
+    """
+    Persists ETags and response bodies per request URL, so repeated fetches can be sent
+    as conditional requests. A `304 Not Modified` answer does not count against the rate limit.
+
+    Entries live in SQLite and are read one URL at a time; the least recently used ones are
+    evicted when the stored bodies exceed `max_bytes`. Without a path the store is kept in memory.
+    """
+
+    def __init__(self, path: Optional[str], max_bytes: int):
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS etags ("
+            "url TEXT PRIMARY KEY, etag TEXT NOT NULL, body TEXT NOT NULL, link TEXT, "
+            "size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS etags_accessed ON etags (accessed)")
+        self._evict()
+        self._connection.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute("SELECT etag, body, link FROM etags WHERE url = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE etags SET accessed = ? WHERE url = ?", (time.time(), key))
+            self._connection.commit()
+        etag, body, link = row
+        return {"etag": etag, "body": json.loads(body), "link": link}
+
+    def set(self, key: str, etag: str, body: Any, link: Optional[str]) -> None:
+        payload = json.dumps(body)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO etags (url, etag, body, link, size, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, etag, payload, link, len(payload), time.time())
+            )
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self) -> None:
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM etags").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for url, size in self._connection.execute("SELECT url, size FROM etags ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            stale.append((url,))
+            total -= size
+        self._connection.executemany("DELETE FROM etags WHERE url = ?", stale)
+
+
+class GitHubFetcher:
+    """
+    Thin GitHub REST client with a pooled keep-alive session, bulk pagination and
+    conditional requests backed by an ETagStore.
+    """
+
+    def __init__(self, config: Optional[GitHubConfig] = None):
+        config = config or GitHubConfig()
+        if not config.GITHUB_TOKEN:
+            raise ValueError("GitHub token not found. Please set the GITHUB_TOKEN environment variable.")
+        self.api_url = config.GITHUB_API_URL.rstrip('/')
+        self.per_page = config.GITHUB_PER_PAGE
+        self.etags = ETagStore(config.GITHUB_ETAG_CACHE_PATH, config.GITHUB_ETAG_CACHE_MAX_BYTES)
+
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=None)
+        adapter = HTTPAdapter(
+            pool_connections=config.GITHUB_POOL_SIZE, pool_maxsize=config.GITHUB_POOL_SIZE, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {config.GITHUB_TOKEN}",
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        })
+
+    def _get(self, url: str) -> Tuple[Any, Optional[str]]:
+        """
+        Performs a conditional GET.
+
+        Returns:
+        - Decoded JSON body and the URL of the next page (if any).
+        """
+        cached = self.etags.get(url)
+        headers = {"If-None-Match": cached["etag"]} if cached else {}
+        response = self.session.get(url, headers=headers, timeout=30)
+        if response.status_code == 304 and cached:
+            return cached["body"], cached["link"]
+        response.raise_for_status()
+        body = response.json()
+        next_url = response.links.get('next', {}).get('url')
+        etag = response.headers.get('ETag')
+        if etag:
+            self.etags.set(url, etag, body, next_url)
+        return body, next_url
+
+    def get(self, path: str) -> Any:
+        body, _ = self._get(f"{self.api_url}{path}")
+        return body
+
+    def post(self, path: str, body: Dict[str, Any], attempts: int = 3) -> Any:
+        """
+        Sends a JSON POST. Secondary rate limit answers (403/429 with Retry-After) are retried
+        after the requested delay; POSTs are not retried by the session adapter.
+
+        Raises:
+        - requests.HTTPError: When the request fails.
+        """
+        for attempt in range(attempts):
+            response = self.session.post(f"{self.api_url}{path}", json=body, timeout=60)
+            retry_after = response.headers.get('Retry-After')
+            if response.status_code in (403, 429) and retry_after and attempt + 1 < attempts:
+                time.sleep(float(retry_after))
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def get_paginated(self, path: str, items_key: Optional[str] = None) -> List[Any]:
+        """
+        Collects every page of a list endpoint.
+
+        Args:
+        - path: API path, e.g. '/repos/owner/repo/pulls'.
+        - items_key: Key of the list in object responses (e.g. 'files' for compare), None for list responses.
+        """
+        separator = '&' if '?' in path else '?'
+        url = f"{self.api_url}{path}{separator}per_page={self.per_page}"
+        items = []
+        while url:
+            body, url = self._get(url)
+            items.extend(body.get(items_key, []) if items_key else body)
+        return items
+
+    def list_pull_requests(self, repo_name: str, state: str = 'open') -> List[Dict[str, Any]]:
+        return self.get_paginated(f"/repos/{repo_name}/pulls?state={state}")
+
+    def get_pull_request(self, repo_name: str, pr_number: int) -> Dict[str, Any]:
+        return self.get(f"/repos/{repo_name}/pulls/{pr_number}")
+
+    def get_pull_request_files(self, repo_name: str, pr_number: int) -> List[Dict[str, Any]]:
+        """Files changed by the whole pull request, one entry per file."""
+        return self.get_paginated(f"/repos/{repo_name}/pulls/{pr_number}/files")
+
+    def create_review(
+            self,
+            repo_name: str,
+            pr_number: int,
+            commit_id: str,
+            body: str,
+            comments: List[Dict[str, Any]],
+            event: str = "COMMENT"
+    ) -> Dict[str, Any]:
+        """Submits a pull request review with all its inline comments in one request."""
+        return self.post(f"/repos/{repo_name}/pulls/{pr_number}/reviews", {
+            "commit_id": commit_id, "body": body, "event": event, "comments": comments,
+        })
+
+    def compare(self, repo_name: str, base: str, head: str) -> Dict[str, Any]:
+        """
+        Compares two commits with the compare endpoint.
+
+        Returns:
+        - Dictionary with 'status' ('ahead', 'behind', 'identical' or 'diverged') and the changed 'files'.
+        """
+        url = f"{self.api_url}/repos/{repo_name}/compare/{base}...{head}?per_page={self.per_page}"
+        status, files = None, {}
+        while url:
+            body, url = self._get(url)
+            status = status or body.get('status')
+            # Paged compare responses may repeat the file list, keep one entry per file
+            files.update((file['filename'], file) for file in body.get('files', []))
+        return {'status': status, 'files': list(files.values())}
+
+
+@lru_cache(maxsize=1)
+def get_github_fetcher() -> GitHubFetcher:
+    """Returns the process-wide fetcher, so every call reuses one connection pool and ETag store."""
+    return GitHubFetcher()
@@ -1,31 +1,41 @@
 import os
 import logging
 import re
-from typing import Union, List, Dict
+from typing import TYPE_CHECKING, Union, List, Dict, Optional, Tuple
 
-from dotenv import load_dotenv
-from github import Github
 from openai import OpenAI, AsyncOpenAI
 
 from common.az_logger.global_logger import CustomLogger
-from open_ai.completion import create_completion
-
-logging.basicConfig(level=logging.INFO)
-
-load_dotenv(dotenv_path='settings/.env')
-
-
-def get_github_client() -> Github:
+from common.instrumentation import instrumented
+from git_hub.fetch import get_github_fetcher
+from git_hub.pr_review import post_pull_request_review
+from git_hub.review_state import ReviewStateStore
+from review.cache import get_review_cache
+from review.diff import parse_file_diff, path_filter
+from review.engine import REVIEW_CONF, review_files
+from review.triage import triage_files
+from settings.conf import GitHubConfig
+from storage.history import pull_request_run, save_review_run
+
+if TYPE_CHECKING:
+    # PyGithub is imported by get_github_client on first use
+    from github import Github
+
+
+def get_github_client() -> "Github":
     """
     Initialize the GitHub client using a Personal Access Token.
     The token should be stored as an environment variable for security.
     """
+    from github import Github
+
     access_token = os.getenv('GITHUB_TOKEN')  # Store your token in environment variables
     if not access_token:
         raise ValueError("GitHub token not found. Please set the GITHUB_TOKEN environment variable.")
     return Github(access_token)
 
 
+@instrumented("github_fetch")
 def list_pull_requests(repo_name: str):
     """
     List all open pull requests for the specified repository.
@@ -34,24 +44,17 @@ def list_pull_requests(repo_name: str):
     - repo_name: The name of the repository in the format 'owner/repo'.
 
     Returns:
-    - List of pull requests.
+    - List of pull requests as returned by the GitHub REST API.
     """
-    github_client = get_github_client()
-
     try:
-        # Get the repository object
-        repo = github_client.get_repo(repo_name)
+        # Fetch all open pull requests page by page over the shared session
+        pr_list = get_github_fetcher().list_pull_requests(repo_name, state='open')
 
-        # Fetch all open pull requests
-        pull_requests = repo.get_pulls(state='open')
-
-        pr_list = []
-        for pr in pull_requests:
-            logging.info(f"PR #{pr.number}: {pr.title} by {pr.user.login} (State: {pr.state})")
-            logging.info(f"Created at: {pr.created_at}")
-            logging.info(f"URL: {pr.html_url}")
+        for pr in pr_list:
+            logging.info(f"PR #{pr['number']}: {pr['title']} by {pr['user']['login']} (State: {pr['state']})")
+            logging.info(f"Created at: {pr['created_at']}")
+            logging.info(f"URL: {pr['html_url']}")
             logging.info("-" * 50)
-            pr_list.append(pr)
 
         if len(pr_list) == 0:
             logging.info("No open pull requests found. Exiting.")
@@ -64,99 +67,79 @@ def list_pull_requests(repo_name: str):
         return None
 
 
-def get_pull_request_commit_files(repo_name: str, pr_number: int) -> Dict[str, List[Dict[str, Union[str, int]]]]:
+@instrumented("github_fetch")
+def get_pull_request_files(repo_name: str, pr_number: int) -> List[Dict[str, Union[str, int]]]:
     """
-    Retrieve the changed files and content for each commit in a specified pull request.
+    Retrieve the changed files of a pull request from the PR-level files endpoint.
+
+    Every file appears once with its cumulative patch, so a file touched by several
+    commits is reviewed once, and the number of API calls depends on pages, not commits.
 
     Args:
     - repo_name: The name of the repository in the format 'owner/repo'.
-    - pr_number: The pull request number to fetch commits and files from.
+    - pr_number: The pull request number to fetch files from.
 
     Returns:
-    - A dictionary with commit SHAs as keys and lists of file details as values.
+    - List of file details.
     """
-    github_client = get_github_client()
-
     try:
-        repo = github_client.get_repo(repo_name)
-        pull_request = repo.get_pull(pr_number)
-        logging.info(f"Fetching commits and files for PR #{pr_number}: {pull_request.title}")
-
-        commits = pull_request.get_commits()
-        commit_files = {}
-
-        for commit in commits:
-            sha = commit.sha
-            logging.info(f"Fetching files for commit SHA: {sha}")
-            files = commit.files
-            changed_files = []
-
-            for file in files:
-                file_info = {
-                    "filename": file.filename,
-                    "additions": file.additions,
-                    "deletions": file.deletions,
-                    "changes": file.changes,
-                    "status": file.status,
-                    "patch": file.patch  # Contains the diff of changes
-                }
-                changed_files.append(file_info)
-                logging.info(f"File: {file.filename}, Additions: {file.additions}, Deletions: {file.deletions}")
-                logging.info(f"Patch: {file.patch}")
-                logging.info("-" * 50)
-
-            commit_files[sha] = changed_files
-
-        return commit_files
+        files = get_github_fetcher().get_pull_request_files(repo_name, pr_number)
+        logging.info(f"Fetched {len(files)} changed files for PR #{pr_number}")
+
+        changed_files = []
+        for file in files:
+            file_info = {
+                "filename": file["filename"],
+                "additions": file["additions"],
+                "deletions": file["deletions"],
+                "changes": file["changes"],
+                "status": file["status"],
+                "patch": file.get("patch", "")  # Contains the diff of changes, absent for binary files
+            }
+            changed_files.append(file_info)
+            logging.info(f"File: {file['filename']}, Additions: {file['additions']}, Deletions: {file['deletions']}")
+
+        return changed_files
 
     except Exception as e:
-        logging.error(f"Error fetching commit files for PR #{pr_number}: {e}")
-        return {}
+        logging.error(f"Error fetching files for PR #{pr_number}: {e}")
+        return []
+
+
+def review_path_filter(config: Optional[GitHubConfig] = None):
+    """Path predicate of the files to review (GITHUB_REVIEW_LANGUAGES and GITHUB_REVIEW_GLOBS)."""
+    config = config or GitHubConfig()
+    return path_filter(config.GITHUB_REVIEW_LANGUAGES, config.GITHUB_REVIEW_GLOBS)
 
 
-def extract_python_files_from_commit(commit_data: Dict[str, List[Dict[str, Union[str, int]]]]) -> List[Dict[str, str]]:
+def extract_python_files(files: List[Dict[str, Union[str, int]]]) -> List[Dict[str, str]]:
     """
-    Extracts changes of Python files from commit data.
+    Extracts changes of the reviewed files (Python by default) from pull request file data.
 
     Args:
-    - commit_data: The commit data in dictionary format.
+    - files: The file details returned by get_pull_request_files.
 
     Returns:
-    - List of dictionaries with 'filename' and 'changes' for each Python file.
+    - List of dictionaries with 'filename', 'changes' and the parsed 'diff' (review.diff) for each file.
     """
     python_files = []
+    accept = review_path_filter()
 
-    # Iterate over commits
-    for sha, files in commit_data.items():
-        for file_info in files:
-            filename = file_info.get('filename')
-            patch = file_info.get('patch', '')
+    for file_info in files:
+        filename = file_info.get('filename')
+        patch = file_info.get('patch', '')
 
-            if filename and filename.endswith('.py'):
-                python_files.append({
-                    'filename': filename,
-                    'changes': patch
-                })
+        if filename and accept(filename) and patch:
+            python_files.append({
+                'filename': filename,
+                'changes': patch,
+                'diff': parse_file_diff(patch, filename)
+            })
 
     return python_files
 
 
-def format_changes_for_llm(python_files: List[Dict[str, str]]) -> str:
-    """
-    Formats the changes of Python files for LLM input.
-
-    Args:
-    - python_files: List of dictionaries with 'filename' and 'changes'.
-
-    Returns:
-    - Formatted string to be sent to the LLM.
-    """
-    formatted_output = ""
-    for file_data in python_files:
-        formatted_output += f"### Changes in {file_data['filename']}:\n\n"
-        formatted_output += f"{file_data['changes']}\n\n"
-    return formatted_output
-
+@instrumented("write_output")
 def save_review_comments(comments: str, output_file: str, logger: logging.Logger) -> None:
     """
     Save the review comments to a specified file.
@@ -173,53 +156,239 @@ def save_review_comments(comments: str, output_file: str, logger: logging.Logger
         logger.error(f"Error saving review comments to {output_file}: {e}")
 
 
-def git_hub_code_reviewer(
-        repo_name: str,
-    output_file: str,
-        logger: Union[logging.Logger, CustomLogger],
-        completion_client: Union[OpenAI, AsyncOpenAI],
-        system_prompt: str,
-        user_prompt: str,
-        gpt_model: str
-):
-    logger.info(f"Starting code review for repo {repo_name}")
-    pr_list = list_pull_requests(repo_name)
+@instrumented("github_fetch")
+def get_python_changes_since(repo_name: str, base_sha: str, head_sha: str) -> Optional[Dict[str, str]]:
+    """
+    Retrieve the patches of Python files changed between the last reviewed commit and the current head.
 
-    try:
-        pr_number = int(input("Enter number of PR:\n"))
-    except Exception as e:
-        logger.exception(e)
-        exit(1)
+    Args:
+    - repo_name: The name of the repository in the format 'owner/repo'.
+    - base_sha: The last reviewed head SHA.
+    - head_sha: The current head SHA of the pull request.
 
+    Returns:
+    - A dictionary with filenames as keys and range patches as values, or None when the range
+      cannot be used (e.g. after a force-push the old head is no longer an ancestor).
+    """
+    if base_sha == head_sha:
+        return {}
     try:
-        commit_data = get_pull_request_commit_files(repo_name, pr_number)
+        comparison = get_github_fetcher().compare(repo_name, base_sha, head_sha)
     except Exception as e:
-        logger.exception(e)
-        exit(1)
+        logging.warning(f"Error comparing {base_sha}...{head_sha}, falling back to a full review: {e}")
+        return None
+    if comparison['status'] not in ('ahead', 'identical'):
+        logging.info(f"Head {head_sha} is {comparison['status']} from {base_sha}, falling back to a full review")
+        return None
+    accept = review_path_filter()
+    return {file['filename']: file.get('patch', '') for file in comparison['files'] if accept(file['filename'])}
 
-    python_files = extract_python_files_from_commit(commit_data)
 
-    # Initialize an empty string to hold all comments
-    all_comments = ""
+def build_pull_request_context(repo_name: str, pull_request: Dict) -> str:
+    """
+    Builds the context shared by every review request of a pull request: its title and description.
+
+    It is identical for all files, so it is sent before the diffs as part of the cached prompt prefix.
+
+    Args:
+    - repo_name: The name of the repository in the format 'owner/repo'.
+    - pull_request: The pull request as returned by the GitHub REST API.
+
+    Returns:
+    - Context text, at most REVIEW_CONTEXT_MAX_CHARS long.
+    """
+    context = (
+        f"Repository: {repo_name}\n"
+        f"Pull request #{pull_request['number']}: {pull_request['title']}\n\n"
+        f"{pull_request.get('body') or ''}"
+    )
+    return context.strip()[:REVIEW_CONF.REVIEW_CONTEXT_MAX_CHARS]
+
+
+def format_review_entries(filename: str, entries: List[Dict[str, str]]) -> str:
+    """
+    Formats the review comments collected for a file over one or more runs.
 
-    # Loop through each Python file and send its content to OpenAI
+    Args:
+    - filename: The reviewed file.
+    - entries: Review comments with the head SHA they were made at, oldest first.
+
+    Returns:
+    - Formatted review section of the file.
+    """
+    if len(entries) == 1:
+        return f"### Review for {filename}:\n\n{entries[0]['comments']}\n\n"
+    sections = "\n\n".join(
+        f"#### Changes up to {entry['sha'][:7]}:\n\n{entry['comments']}" for entry in entries
+    )
+    return f"### Review for {filename}:\n\n{sections}\n\n"
+
+
+def prepare_pull_request_review(
+        repo_name: str,
+        pr_number: int,
+        logger: Union[logging.Logger, CustomLogger],
+        incremental: bool = True
+) -> Dict:
+    """
+    Fetches a pull request and decides which of its Python files need a review.
+
+    With `incremental` enabled, only the range diff since the last reviewed SHA is reviewed
+    for files that were reviewed before.
+
+    Returns:
+    - Review plan with 'files_to_review' (triaged), 'context' and the state needed by
+      finish_pull_request_review.
+
+    Raises:
+    - Exception: When the pull request cannot be fetched.
+    """
+    pull_request = get_github_fetcher().get_pull_request(repo_name, pr_number)
+    head_sha = pull_request['head']['sha']
+    pr_files = get_pull_request_files(repo_name, pr_number)
+
+    python_files = extract_python_files(pr_files)
+
+    state = ReviewStateStore().load(repo_name, pr_number) if incremental else None
+    range_changes = get_python_changes_since(repo_name, state['head_sha'], head_sha) if state else None
+    previous_files = state['files'] if range_changes is not None else {}
+    previous_pending = set(state['pending']) if range_changes is not None else set()
+
+    files_to_review = []
     for file_data in python_files:
-        file_diff = file_data['changes']
         filename = file_data['filename']
+        if filename not in previous_files or filename in previous_pending:
+            files_to_review.append({**file_data, 'full': True})
+        elif range_changes.get(filename):
+            files_to_review.append({'filename': filename, 'changes': range_changes[filename], 'full': False})
+    files_to_review = list(triage_files(files_to_review, logger))
+    logger.info(f"Reviewing {len(files_to_review)} of {len(python_files)} Python files of PR #{pr_number}")
+    return {
+        'repo_name': repo_name,
+        'pr_number': pr_number,
+        'head_sha': head_sha,
+        'incremental': incremental,
+        'python_files': python_files,
+        'previous_files': previous_files,
+        'files_to_review': files_to_review,
+        'context': build_pull_request_context(repo_name, pull_request),
+    }
+
+
+def finish_pull_request_review(
+        plan: Dict,
+        reviews: List[Dict],
+        output_file: str,
+        logger: Union[logging.Logger, CustomLogger],
+        post_review: Optional[bool] = None
+) -> None:
+    """
+    Merges the new reviews with the comments carried forward from earlier runs,
+    saves them and, for incremental reviews, persists the review state.
 
-        try:
-            # Send the diff to OpenAI for review
-            file_comments = create_completion(
-                openai_client=completion_client,
-                system_prompt=system_prompt,
-                user_prompt=user_prompt.format(file_diff),
-                gpt_model=gpt_model
-            )
-            # Append the comments for this file to the overall comments
-            all_comments += f"### Review for {filename}:\n\n"
-            all_comments += f"{file_comments}\n\n"
-        except Exception as e:
-            logger.error(f"Error during GPT completion for file {filename}: {e}")
+    With `post_review` (GITHUB_POST_REVIEW by default), the findings of this run are also
+    posted to the pull request as inline comments of a single GitHub review.
+    """
+    reviewed = {review['filename']: review for review in reviews}
+
+    all_comments = ""
+    files_state, pending = {}, []
+    for file_data in plan['python_files']:
+        filename = file_data['filename']
+        entries = list(plan['previous_files'].get(filename, []))
+        review = reviewed.get(filename)
+        if review is not None:
+            if review['full']:
+                entries = []
+            if review['comments'] is None:
+                pending.append(filename)
+            else:
+                entries.append({'sha': plan['head_sha'], 'comments': review['comments']})
+        if entries:
+            files_state[filename] = entries
+            all_comments += format_review_entries(filename, entries)
 
     # Save all the review comments to a file
     save_review_comments(all_comments, output_file, logger)
+    if plan['incremental']:
+        ReviewStateStore().save(plan['repo_name'], plan['pr_number'], plan['head_sha'], files_state, pending)
+    if GitHubConfig().GITHUB_POST_REVIEW if post_review is None else post_review:
+        try:
+            post_pull_request_review(plan, reviews, logger)
+        except Exception as e:
+            logger.error(f"Error posting the review of PR #{plan['pr_number']}: {e}")
+
+
+def review_pull_request(
+        repo_name: str,
+        pr_number: int,
+        output_file: str,
+        logger: Union[logging.Logger, CustomLogger],
+        completion_client: Union[OpenAI, AsyncOpenAI],
+        system_prompt: str,
+        user_prompt: str,
+        gpt_model: str,
+        incremental: bool = True,
+        persist: bool = True,
+        post_review: Optional[bool] = None
+) -> Tuple[Dict, List[Dict]]:
+    """
+    Reviews the Python files of a pull request and saves the comments.
+
+    With `incremental` enabled, the head SHA and the comments of every run are persisted.
+    The next run reviews only the range diff since the last reviewed SHA and carries
+    the comments of unchanged files forward. With `persist`, the run is also saved to the
+    review history (storage), when it is enabled. With `post_review` (GITHUB_POST_REVIEW by
+    default), the findings are posted to the pull request as one review.
+
+    Returns:
+    - The review plan and the reviews of the files.
+
+    Raises:
+    - Exception: When the pull request cannot be fetched.
+    """
+    plan = prepare_pull_request_review(repo_name, pr_number, logger, incremental)
+    # Review all Python files concurrently; results keep the file order
+    reviews = review_files(
+        plan['files_to_review'], completion_client, system_prompt, user_prompt, gpt_model, logger,
+        cache=get_review_cache(), context=plan['context']
+    )
+    finish_pull_request_review(plan, reviews, output_file, logger, post_review)
+    if persist:
+        save_review_run(pull_request_run(plan, gpt_model), reviews, logger)
+    return plan, reviews
+
+
+def git_hub_code_reviewer(
+        repo_name: str,
+        output_file: str,
+        logger: Union[logging.Logger, CustomLogger],
+        completion_client: Union[OpenAI, AsyncOpenAI],
+        system_prompt: str,
+        user_prompt: str,
+        gpt_model: str,
+        incremental: bool = True,
+        post_review: Optional[bool] = None,
+        pr_number: Optional[int] = None
+):
+    """
+    Reviews a pull request of the repository. Without `pr_number`, the open pull requests are
+    listed and the number is asked interactively.
+    """
+    logger.info(f"Starting code review for repo {repo_name}")
+    if pr_number is None:
+        list_pull_requests(repo_name)
+        try:
+            pr_number = int(input("Enter number of PR:\n"))
+        except Exception as e:
+            logger.exception(e)
+            exit(1)
+
+    try:
+        review_pull_request(
+            repo_name, pr_number, output_file, logger, completion_client, system_prompt, user_prompt, gpt_model,
+            incremental, post_review=post_review
+        )
+    except Exception as e:
+        logger.exception(e)
+        exit(1)
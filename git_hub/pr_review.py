@@ -0,0 +1,125 @@
+"""
+Posts the findings of a pull request review as inline comments of one GitHub review.
+
+Findings reference lines of the new version of a file. GitHub anchors review comments to diff
+positions: the number of lines below the first hunk header of the file's patch. The patches are
+parsed once (review.diff), and a finding is anchored to the last line of its range that appears
+in the patch. Findings outside the patch are listed in the review body instead.
+"""
+import logging
+from typing import Dict, List, Optional, Tuple, Union
+
+import requests
+
+from common.az_logger.global_logger import CustomLogger
+from common.instrumentation import instrumented
+from git_hub.fetch import get_github_fetcher
+from review.diff import file_diff, parse_file_diff
+from schema.completion.findings import SEVERITY_ORDER, ReviewFinding
+from settings.conf import GitHubConfig
+
+# GitHub rejects review bodies longer than 65536 characters
+MAX_BODY_LENGTH = 60000
+REVIEW_TITLE = "Automated code review"
+
+
+def format_inline_comment(finding: ReviewFinding) -> str:
+    location = "" if finding.start_line == finding.end_line else f" (lines {finding.start_line}-{finding.end_line})"
+    return (
+        f"**{finding.severity.value} / {finding.category.value}**{location}: {finding.title}\n\n"
+        f"{finding.suggestion}"
+    )
+
+
+def build_review_comments(
+        plan: Dict,
+        reviews: List[Dict]
+) -> Tuple[List[Dict[str, Union[str, int]]], List[str]]:
+    """
+    Maps the findings of the reviewed files to inline comments.
+
+    Args:
+    - plan: Review plan of prepare_pull_request_review; its 'python_files' carry the PR patches.
+    - reviews: Reviews of the files (review.engine.review_files).
+
+    Returns:
+    - Inline comments ('path', 'position', 'body'), most severe first per file, and the
+      notes that cannot be anchored to the diff (findings outside the patch, free-text reviews).
+    """
+    python_files = {file_data['filename']: file_data for file_data in plan['python_files']}
+    comments, notes = [], []
+    for review in reviews:
+        filename = review['filename']
+        if review['comments'] is None:
+            continue
+        if review.get('findings') is None:
+            notes.append(f"### {filename}\n\n{review['comments']}")
+            continue
+        file_data = python_files.get(filename)
+        diff = file_diff(file_data) if file_data is not None else parse_file_diff('', filename)
+        for finding in sorted(review['findings'], key=lambda item: (SEVERITY_ORDER[item.severity], item.start_line)):
+            position = diff.position(finding.start_line, finding.end_line)
+            if position is None:
+                notes.append(f"- `{filename}` line {finding.start_line}: {format_inline_comment(finding)}")
+            else:
+                comments.append({'path': filename, 'position': position, 'body': format_inline_comment(finding)})
+    return comments, notes
+
+
+def build_review_body(notes: List[str], part: int, parts: int, comments: int) -> str:
+    title = REVIEW_TITLE if parts == 1 else f"{REVIEW_TITLE} (part {part} of {parts})"
+    body = f"{title}: {comments} inline comment(s)."
+    if notes and part == 1:
+        body += "\n\nComments outside the changed lines:\n\n" + "\n\n".join(notes)
+    if len(body) > MAX_BODY_LENGTH:
+        body = body[:MAX_BODY_LENGTH] + "\n\n(truncated)"
+    return body
+
+
+@instrumented("github_post")
+def post_pull_request_review(
+        plan: Dict,
+        reviews: List[Dict],
+        logger: Union[logging.Logger, CustomLogger],
+        config: Optional[GitHubConfig] = None
+) -> List[int]:
+    """
+    Submits the findings of a pull request review as GitHub reviews on the reviewed head commit:
+    one submission per GITHUB_REVIEW_MAX_COMMENTS inline comments, so a pull request normally
+    costs a single API call instead of one call per comment.
+
+    A submission rejected as unprocessable (e.g. a position outdated by a new push) is repeated
+    with its comments moved to the review body, so no finding is lost.
+
+    Returns:
+    - Ids of the submitted reviews.
+    """
+    config = config or GitHubConfig()
+    comments, notes = build_review_comments(plan, reviews)
+    if not comments and not notes:
+        logger.info(f"No review comments to post for PR #{plan['pr_number']}")
+        return []
+    size = max(1, config.GITHUB_REVIEW_MAX_COMMENTS)
+    chunks = [comments[start:start + size] for start in range(0, len(comments), size)] or [[]]
+    fetcher = get_github_fetcher()
+    review_ids = []
+    for part, chunk in enumerate(chunks, start=1):
+        body = build_review_body(notes, part, len(chunks), len(chunk))
+        try:
+            review = fetcher.create_review(
+                plan['repo_name'], plan['pr_number'], plan['head_sha'], body, chunk, config.GITHUB_REVIEW_EVENT
+            )
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 422 or not chunk:
+                raise
+            logger.warning(f"Inline comments of PR #{plan['pr_number']} were rejected, posting them in the body: {e}")
+            fallback = [f"- `{comment['path']}`: {comment['body']}" for comment in chunk]
+            review = fetcher.create_review(
+                plan['repo_name'], plan['pr_number'], plan['head_sha'],
+                build_review_body(fallback + (notes if part == 1 else []), 1, 1, 0), [], config.GITHUB_REVIEW_EVENT
+            )
+        review_ids.append(review['id'])
+    logger.info(
+        f"Posted {len(comments)} inline comment(s) to PR #{plan['pr_number']} in {len(review_ids)} review(s)"
+    )
+    return review_ids
@@ -0,0 +1,50 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from settings.conf import ReviewConfig
+
+
+class ReviewStateStore:
+    """
+    Keeps the last reviewed head SHA and the per-file review comments of every pull request
+    as one JSON file per PR, so the next run only reviews what changed since then.
+
+    State layout:
+    {
+        "head_sha": "<sha>",
+        "files": {"<filename>": [{"sha": "<sha>", "comments": "<text>"}, ...]},
+        "pending": ["<filename>", ...]   # files whose review failed and must be redone
+    }
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or ReviewConfig().REVIEW_STATE_PATH
+
+    def _state_file(self, repo_name: str, pr_number: int) -> str:
+        return os.path.join(self.path, f"{repo_name.replace('/', '__')}__pr{pr_number}.json")
+
+    def load(self, repo_name: str, pr_number: int) -> Optional[Dict[str, Any]]:
+        state_file = self._state_file(repo_name, pr_number)
+        if not os.path.exists(state_file):
+            return None
+        try:
+            with open(state_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(
+            self,
+            repo_name: str,
+            pr_number: int,
+            head_sha: str,
+            files: Dict[str, List[Dict[str, str]]],
+            pending: List[str]
+    ) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        state_file = self._state_file(repo_name, pr_number)
+        tmp_file = f"{state_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({"head_sha": head_sha, "files": files, "pending": pending}, f)
+        os.replace(tmp_file, state_file)
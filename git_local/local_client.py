@@ -1,9 +1,25 @@
 import logging
-from typing import Union
+import os
+from contextlib import ExitStack
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple, Union
 import git
 from openai import OpenAI, AsyncOpenAI
 from common.az_logger.global_logger import CustomLogger
-from open_ai.completion import create_completion
+from common.instrumentation import instrumented
+from review.cache import get_review_cache
+from review.diff import FILE_MARKER, file_diff, parse_file_diff
+from review.engine import REVIEW_CONF, review_files
+from review.triage import SourceLoader, triage_files
+from schema.completion.findings import dump_findings
+from settings.conf import SymbolIndexConfig
+
+if TYPE_CHECKING:
+    # Batch, streaming, symbol index, workspace and history modules are imported by the code paths that use them
+    from git_local.workspace import WorkspaceManager
+    from review.batch import BatchBackend
+    from review.symbols import BlobReader, SymbolIndex
+
+SYMBOL_CONF = SymbolIndexConfig()
 
 MAIN_BRANCH = 'main'
 
@@ -14,26 +30,192 @@ def check_branch_exists(repository, branch_name):
         raise ValueError(f"Branch {branch_name} not found in the repository")
 
 
-def get_git_diff(repo_path: str, branch_name: str, logger: logging.Logger) -> dict:
+def _file_difference_entry(file_difference: str) -> Dict[str, str]:
+    diff = parse_file_diff(file_difference)
+    return {'filename': diff.path, 'changes': file_difference, 'diff': diff}
+
+
+@instrumented("git_diff")
+def iter_git_diff(repo_path: str, branch_name: str, base_branch: str = MAIN_BRANCH) -> Iterator[Dict[str, str]]:
     """
-    Получает различия между указанной веткой и основной веткой (main) в виде словаря.
+    Потоково выдаёт изменения по файлам по мере того, как их печатает git diff.
+    Рабочее дерево не меняется (без checkout), в памяти держится только текущий файл.
     Args:
     - repo_path: Путь к локальному репозиторию.
     - branch_name: Имя ветки, которая будет проанализирована.
+    - base_branch: Ветка, с которой сравниваются изменения.
     Returns:
-    - Словарь с именами файлов и их изменениями.
+    - Итератор словарей с 'filename' и 'changes' для каждого файла.
     """
+    repository = git.Repo(repo_path)
+    check_branch_exists(repository, branch_name)
+    process = repository.git.diff(base_branch, branch_name, unified=0, as_process=True)
     try:
-        repository = git.Repo(repo_path)
-        check_branch_exists(repository, branch_name)
-        repository.git.checkout(branch_name)
-        differences = repository.git.diff(MAIN_BRANCH, branch_name, unified=0)
-        return differences
+        lines = []
+        for raw_line in process.stdout:
+            line = raw_line.decode('utf-8', errors='replace')
+            if line.startswith(FILE_MARKER):
+                if lines:
+                    yield _file_difference_entry(''.join(lines))
+                lines = [line[len(FILE_MARKER):]]
+            else:
+                lines.append(line)
+        if lines:
+            yield _file_difference_entry(''.join(lines))
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.terminate()
+
+
+def make_source_loader(repo_path: str, branch_name: str, base_branch: str = MAIN_BRANCH) -> SourceLoader:
+    """
+    Создаёт загрузчик полных версий файла в базовой и анализируемой ветке
+    для AST-сравнения в review.triage.
+    Args:
+    - repo_path: Путь к локальному репозиторию.
+    - branch_name: Имя ветки, которая будет проанализирована.
+    - base_branch: Ветка, с которой сравниваются изменения.
+    Returns:
+    - Функция, возвращающая пару (база, изменённая версия) или None, если файла нет в одной из веток.
+    """
+    repository = git.Repo(repo_path)
+
+    def load_sources(filename: str) -> Optional[Tuple[str, str]]:
+        try:
+            return (
+                repository.git.show(f"{base_branch}:{filename}"),
+                repository.git.show(f"{branch_name}:{filename}")
+            )
+        except git.GitCommandError:
+            return None
+
+    return load_sources
+
+
+@instrumented("symbol_index")
+def open_symbol_index(
+        repo_path: str,
+        branch_name: str
+) -> Tuple["SymbolIndex", "BlobReader", Callable[[List[str]], None]]:
+    """
+    Открывает индекс символов репозитория и обновляет его до последнего коммита ветки.
+    Индекс хранится в каталоге .git и обновляется инкрементально: разбираются только
+    версии Python-файлов, которых ещё нет в индексе (в частичном клоне они догружаются одним запросом).
+    В индексе остаются несколько последних коммитов, поэтому параллельные ревью разных веток
+    одного репозитория не мешают друг другу.
+    В частичном клоне (зеркале WorkspaceManager) индекс заполняется лениво: записываются только
+    пути коммита, а разбираются изменённые файлы и модули, которые они используют, так что
+    содержимое остальных файлов репозитория не загружается.
+    Args:
+    - repo_path: Путь к локальному репозиторию.
+    - branch_name: Имя ветки, которая будет проанализирована.
+    Returns:
+    - Индекс, функция чтения содержимого файлов по идентификатору blob и функция догрузки
+      blob одним запросом (для review.symbols.enrich_files).
+    """
+    from git_local.workspace import fetch_objects, is_partial_clone
+    from review.symbols import SymbolIndex, python_entries
+
+    repository = git.Repo(repo_path)
+    commit = repository.commit(branch_name).hexsha
+    index = SymbolIndex(
+        os.path.join(repository.git_dir, SYMBOL_CONF.SYMBOL_INDEX_PATH), SYMBOL_CONF.SYMBOL_INDEX_MAX_FILE_BYTES,
+        SYMBOL_CONF.SYMBOL_INDEX_MAX_COMMITS
+    )
+
+    def read_blob(blob: str) -> bytes:
+        return repository.odb.stream(bytes.fromhex(blob)).read()
+
+    def prefetch(blobs: List[str]) -> None:
+        fetch_objects(repository, blobs)
+
+    if not index.select(commit):
+        # ls-tree reads only tree objects, which a blob:none clone has locally
+        index.update(
+            commit, python_entries(repository.git.ls_tree('-r', '-z', commit)), read_blob,
+            prefetch=prefetch, lazy=is_partial_clone(repository)
+        )
+    return index, read_blob, prefetch
+
+
+def iter_review_files(
+        repo_path: str,
+        branch_name: str,
+        logger: Union[logging.Logger, CustomLogger],
+        gpt_model: Optional[str] = None,
+        base_branch: str = MAIN_BRANCH
+) -> Iterator[Dict[str, str]]:
+    """
+    Потоково выдаёт изменения по файлам, уже прошедшие триаж (тривиальные изменения отброшены).
+    Если указана модель и индекс символов включён, к Python-файлам добавляется связанный код
+    ('context': объемлющие функции, используемые символы, места вызова) в пределах SYMBOL_CONTEXT_MAX_TOKENS.
+    """
+    files = triage_files(
+        iter_git_diff(repo_path, branch_name, base_branch), logger,
+        make_source_loader(repo_path, branch_name, base_branch)
+    )
+    if gpt_model is None or not SYMBOL_CONF.SYMBOL_INDEX_ENABLED:
+        return files
+    from review.symbols import enrich_files
+
+    try:
+        index, read_blob, prefetch = open_symbol_index(repo_path, branch_name)
     except Exception as e:
-        logger.error(f"Error getting git diff: {e}")
-        return {}
+        logger.warning(f"Symbol index is not available, reviewing without related code: {e}")
+        return files
+    return enrich_files(files, index, read_blob, SYMBOL_CONF.SYMBOL_CONTEXT_MAX_TOKENS, gpt_model, prefetch)
 
 
+def build_branch_context(repo_path: str, branch_name: str, base_branch: str = MAIN_BRANCH) -> str:
+    """
+    Общий контекст всех запросов запуска: репозиторий, ветка и сообщения её коммитов.
+    Он одинаков для всех файлов и отправляется перед diff, поэтому входит в кэшируемый префикс промпта.
+    Args:
+    - repo_path: Путь к локальному репозиторию.
+    - branch_name: Имя ветки, которая будет проанализирована.
+    - base_branch: Ветка, с которой сравниваются изменения.
+    Returns:
+    - Текст контекста (не длиннее REVIEW_CONTEXT_MAX_CHARS).
+    """
+    repository = git.Repo(repo_path)
+    commits = repository.git.log(f"{base_branch}..{branch_name}", format="- %s", no_merges=True)
+    context = (
+        f"Repository: {os.path.basename(os.path.abspath(repo_path))}\n"
+        f"The diffs below are the changes of branch {branch_name} compared with {base_branch}.\n"
+        f"Commits of the branch:\n{commits or '- (none)'}"
+    )
+    return context[:REVIEW_CONF.REVIEW_CONTEXT_MAX_CHARS]
+
+
+def get_head_sha(repo_path: str, branch_name: str) -> Optional[str]:
+    """SHA последнего коммита ветки или None, если ветка не найдена."""
+    try:
+        return git.Repo(repo_path).commit(branch_name).hexsha
+    except (git.GitCommandError, git.BadName, ValueError):
+        return None
+
+
+def format_file_header(file_data: Dict[str, str]) -> str:
+    """Заголовок комментариев к файлу: заголовок его diff (до первого hunk)."""
+    return f"Changes in file:\n{file_diff(file_data).header}\n\n"
+
+
+def format_review_comments(reviews: List[Dict[str, Optional[str]]]) -> str:
+    """
+    Собирает комментарии по файлам в один текст для сохранения.
+    Args:
+    - reviews: Результаты ревью по файлам (review.engine.review_files).
+    Returns:
+    - Текст с комментариями.
+    """
+    return "".join(
+        f"{format_file_header(review)}{review['comments']}\n\n"
+        for review in reviews if review['comments'] is not None
+    )
+
+
+@instrumented("write_output")
 def save_review_comments(comments: str, output_file: str, logger: logging.Logger):
     """
     Сохраняет предложенные изменения в текстовый файл.
@@ -49,6 +231,27 @@ def save_review_comments(comments: str, output_file: str, logger: logging.Logger
         logger.error(f"Error writing to file {output_file}: {e}")
 
 
+@instrumented("write_output")
+def save_review_findings(reviews: List[Dict], output_file: str, logger: logging.Logger):
+    """
+    Сохраняет структурированные замечания всех файлов в компактный JSON рядом с текстовым файлом
+    ('<output_file без расширения>.findings.json'). Для текстовых ревью ничего не сохраняется.
+    Args:
+    - reviews: Результаты ревью по файлам (review.engine.review_files).
+    - output_file: Путь к текстовому файлу с комментариями.
+    """
+    if not any(review.get('findings') is not None for review in reviews):
+        return
+    findings = [finding for review in reviews for finding in review.get('findings') or []]
+    findings_file = f"{os.path.splitext(output_file)[0]}.findings.json"
+    try:
+        with open(findings_file, 'w') as f:
+            f.write(dump_findings(findings))
+        logger.info(f"Findings successfully saved to {findings_file}")
+    except Exception as e:
+        logger.error(f"Error writing to file {findings_file}: {e}")
+
+
 def local_code_reviewer(
         repo_path: str,
         branch_name: str,
@@ -57,29 +260,159 @@ def local_code_reviewer(
         completion_client: Union[OpenAI, AsyncOpenAI],
         system_prompt: str,
         user_prompt: str,
-        gpt_model: str
+        gpt_model: str,
+        stream: bool = False,
+        checkpoint_file: Optional[str] = None,
+        base_branch: str = MAIN_BRANCH,
+        repository: Optional[str] = None
 ):
     """
-    Основная функция агента. Получает изменения между веткой и main,
+    Основная функция агента. Получает изменения между веткой и базовой веткой (main),
     анализирует их с помощью GPT и сохраняет результат.
     Args:
     - repo_path: Путь к локальному репозиторию.
     - branch_name: Имя ветки для анализа.
     - output_file: Путь к файлу для сохранения результатов.
+    - stream: Потоковый режим: комментарии пишутся в файл по мере генерации,
+      а прерванный запуск продолжается с первого незавершённого файла. Кэш ревью,
+      лёгкий уровень триажа и история ревью поддерживаются; каскад моделей (review.router)
+      и структурированные замечания в этом режиме не используются.
+    - checkpoint_file: Журнал завершённых файлов для потокового режима
+      (по умолчанию '<output_file>.checkpoint.jsonl').
+    - base_branch: Ветка, с которой сравниваются изменения.
+    - repository: Имя репозитория в истории ревью (storage), по умолчанию repo_path.
     """
+    from storage.history import local_run, save_review_run
+
     logger.info(f"Starting code review for branch {branch_name} in repo {repo_path}")
-    differences = get_git_diff(repo_path, branch_name, logger)
-    if not differences:
+    if stream:
+        from review.streaming import stream_review_files
+
+        try:
+            completed, reviews = stream_review_files(
+                iter_review_files(repo_path, branch_name, logger, gpt_model, base_branch), completion_client, system_prompt, user_prompt,
+                gpt_model, logger, output_file, checkpoint_file or f"{output_file}.checkpoint.jsonl",
+                format_file_header, context=build_branch_context(repo_path, branch_name, base_branch), cache=get_review_cache()
+            )
+        except Exception as e:
+            logger.error(f"Error during streaming code review: {e}")
+            return
+        if not completed:
+            logger.error(f"Some files were not reviewed, rerun to resume from the checkpoint. Output: {output_file}")
+            return
+        logger.info(f"Comments successfully saved to {output_file}")
+        save_review_run(
+            local_run(repository or repo_path, branch_name, base_branch, get_head_sha(repo_path, branch_name), gpt_model),
+            reviews, logger
+        )
+        return
+    try:
+        reviews = review_files(
+            iter_review_files(repo_path, branch_name, logger, gpt_model, base_branch), completion_client, system_prompt, user_prompt,
+            gpt_model, logger, cache=get_review_cache(), context=build_branch_context(repo_path, branch_name, base_branch)
+        )
+    except Exception as e:
+        logger.error(f"Error getting git diff: {e}")
+        return
+    if not reviews:
+        logger.error("No changes found or error occurred while getting the diff.")
+        return
+    save_review_comments(format_review_comments(reviews), output_file, logger)
+    save_review_findings(reviews, output_file, logger)
+    save_review_run(
+        local_run(repository or repo_path, branch_name, base_branch, get_head_sha(repo_path, branch_name), gpt_model),
+        reviews, logger
+    )
+
+
+def local_batch_code_reviewer(
+        repo_path: str,
+        branch_name: str,
+        output_file: str,
+        logger: Union[logging.Logger, CustomLogger],
+        completion_client: OpenAI,
+        system_prompt: str,
+        user_prompt: str,
+        gpt_model: str,
+        batch_file: str,
+        backend: Optional["BatchBackend"] = None,
+        poll_interval: float = 60,
+        base_branch: str = MAIN_BRANCH
+):
+    """
+    Вариант local_code_reviewer для ночных прогонов: все запросы отправляются одним
+    пакетом через OpenAI Batch API, результат сохраняется в том же формате.
+    Args:
+    - repo_path: Путь к локальному репозиторию.
+    - branch_name: Имя ветки для анализа.
+    - output_file: Путь к файлу для сохранения результатов.
+    - batch_file: Путь к JSONL-файлу с запросами пакета.
+    - backend: Backend пакетной обработки (по умолчанию OpenAIBatchBackend).
+    - poll_interval: Интервал опроса статуса пакета в секундах.
+    - base_branch: Ветка, с которой сравниваются изменения.
+    """
+    from review.batch import OpenAIBatchBackend, run_batch_review
+    from storage.history import local_run, save_review_run
+
+    logger.info(f"Starting batch code review for branch {branch_name} in repo {repo_path}")
+    backend = backend or OpenAIBatchBackend(completion_client)
+    try:
+        reviews = run_batch_review(
+            iter_review_files(repo_path, branch_name, logger, gpt_model, base_branch), backend, system_prompt, user_prompt,
+            gpt_model, logger, batch_file, cache=get_review_cache(), poll_interval=poll_interval,
+            context=build_branch_context(repo_path, branch_name, base_branch)
+        )
+    except Exception as e:
+        logger.error(f"Error during batch code review: {e}")
+        return
+    if not reviews:
         logger.error("No changes found or error occurred while getting the diff.")
         return
-    comments = ""
-    for file_difference in differences.split('diff --git'):
-        if file_difference.strip():
-            file_comments = create_completion(
-                openai_client=completion_client,
-                system_prompt=system_prompt,
-                user_prompt=user_prompt.format(file_difference),
-                gpt_model=gpt_model
+    save_review_comments(format_review_comments(reviews), output_file, logger)
+    save_review_findings(reviews, output_file, logger)
+    save_review_run(
+        local_run(repo_path, branch_name, base_branch, get_head_sha(repo_path, branch_name), gpt_model),
+        reviews, logger
+    )
+
+
+def remote_code_reviewer(
+        repo_url: str,
+        branch_name: str,
+        output_file: str,
+        logger: Union[logging.Logger, CustomLogger],
+        completion_client: Union[OpenAI, AsyncOpenAI],
+        system_prompt: str,
+        user_prompt: str,
+        gpt_model: str,
+        base_branch: str = MAIN_BRANCH,
+        stream: bool = False,
+        workspace: Optional["WorkspaceManager"] = None
+):
+    """
+    Ревью ветки удалённого репозитория без полного клона: в bare-зеркало WorkspaceManager
+    загружаются только базовая и анализируемая ветки (без содержимого файлов), diff считается
+    по зеркалу без рабочего дерева.
+    Args:
+    - repo_url: URL удалённого репозитория.
+    - branch_name: Ветка или ссылка для анализа (например 'refs/pull/12/head').
+    - output_file: Путь к файлу для сохранения результатов.
+    - base_branch: Ветка, с которой сравниваются изменения.
+    - stream: Потоковый режим local_code_reviewer.
+    - workspace: Пул зеркал (по умолчанию настроенный через WorkspaceConfig).
+    """
+    from git_local.workspace import WorkspaceManager, local_ref_name
+
+    with ExitStack() as stack:
+        try:
+            repo_path = stack.enter_context(
+                (workspace or WorkspaceManager()).open_mirror(repo_url, [base_branch, branch_name])
             )
-            comments += f"Changes in file:\n{file_difference[:100]}\n\n{file_comments}\n\n"
-    save_review_comments(comments, output_file, logger)
+        except Exception as e:
+            logger.error(f"Error fetching {repo_url}: {e}")
+            return
+        # Зеркало арендовано до конца ревью, evict других процессов его не удалит
+        local_code_reviewer(
+            repo_path, local_ref_name(branch_name), output_file, logger, completion_client, system_prompt, user_prompt,
+            gpt_model, stream=stream, base_branch=local_ref_name(base_branch), repository=repo_url
+        )
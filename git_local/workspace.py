@@ -0,0 +1,279 @@
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import git
+
+from common.instrumentation import instrumented
+from settings.conf import WorkspaceConfig
+
+LAST_USED_FILE = "codereviewer-last-used"
+LEASES_DIRECTORY = "codereviewer-leases"
+LOCK_FILE_SUFFIX = ".lock"
+
+
+def local_ref_name(ref: str) -> str:
+    """
+    Имя локальной ветки зеркала для удалённой ссылки:
+    'main' и 'refs/heads/main' -> 'main', 'refs/pull/12/head' -> 'pull/12/head'.
+    """
+    if ref.startswith('refs/heads/'):
+        return ref[len('refs/heads/'):]
+    if ref.startswith('refs/'):
+        return ref[len('refs/'):]
+    return ref
+
+
+def _remote_ref(ref: str) -> str:
+    return ref if ref.startswith('refs/') else f"refs/heads/{ref}"
+
+
+def directory_size(path: str) -> int:
+    """Суммарный размер файлов каталога в байтах."""
+    total = 0
+    for directory, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(directory, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def is_partial_clone(repository: git.Repo) -> bool:
+    return repository.git.config('--get', 'remote.origin.promisor', with_exceptions=False) == 'true'
+
+
+def fetch_objects(repository: git.Repo, object_ids: Iterable[str]) -> None:
+    """
+    Догружает объекты (обычно blob) частичного клона одним запросом к удалённому репозиторию
+    вместо отдельного запроса на каждый объект при ленивой загрузке.
+    Для полных клонов ничего не делает.
+    Args:
+    - repository: Репозиторий (зеркало WorkspaceManager).
+    - object_ids: Идентификаторы объектов.
+    """
+    object_ids = list(object_ids)
+    if not object_ids or not is_partial_clone(repository):
+        return
+    subprocess.run(
+        ['git', '-c', 'fetch.negotiationAlgorithm=noop', 'fetch', '--quiet', '--no-tags', '--no-write-fetch-head',
+         '--recurse-submodules=no', '--filter=blob:none', '--stdin', 'origin'],
+        cwd=repository.git_dir, input='\n'.join(object_ids) + '\n', text=True, capture_output=True, check=True
+    )
+
+
+class _MirrorLock:
+    """
+    Межпроцессная блокировка зеркала через эксклюзивное создание файла (работает и в Windows).
+    Блокировка старше `timeout` секунд считается брошенной упавшим процессом и снимается.
+    """
+
+    def __init__(self, path: str, timeout: float):
+        self.path = path
+        self.timeout = timeout
+
+    def acquire(self, blocking: bool = True) -> bool:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.timeout:
+                        os.remove(self.path)
+                        continue
+                except OSError:
+                    continue
+                if not blocking:
+                    return False
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Workspace lock {self.path} is held by another process")
+                time.sleep(0.2)
+
+    def release(self) -> None:
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self) -> "_MirrorLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class _MirrorLease:
+    """
+    Разделяемая аренда зеркала на время ревью: файл в каталоге LEASES_DIRECTORY зеркала.
+    Пока аренда держится, её файл обновляется каждую треть `timeout`; файл старше `timeout`
+    остался от упавшего процесса. Аренда создаётся под блокировкой зеркала, поэтому evict,
+    взявший эту блокировку, видит все действующие аренды.
+    """
+
+    def __init__(self, mirror: str, timeout: float):
+        directory = os.path.join(mirror, LEASES_DIRECTORY)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, uuid.uuid4().hex)
+        self.timeout = timeout
+        open(self.path, 'w').close()
+        self._released = threading.Event()
+        self._renewal = threading.Thread(target=self._renew, daemon=True)
+        self._renewal.start()
+
+    def _renew(self) -> None:
+        while not self._released.wait(self.timeout / 3):
+            try:
+                os.utime(self.path)
+            except OSError:
+                return
+
+    def release(self) -> None:
+        self._released.set()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def active(mirror: str, timeout: float) -> bool:
+        """Есть ли у зеркала действующие аренды; брошенные удаляются."""
+        directory = os.path.join(mirror, LEASES_DIRECTORY)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return False
+        held = False
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                if time.time() - os.path.getmtime(path) <= timeout:
+                    held = True
+                else:
+                    os.remove(path)
+            except OSError:
+                pass
+        return held
+
+
+class WorkspaceManager:
+    """
+    Пул bare-зеркал удалённых репозиториев на локальном диске.
+
+    Для ревью из зеркала загружаются только нужные ссылки (база и анализируемая ветка),
+    по умолчанию без содержимого файлов (--filter=blob:none): git diff догружает только blob
+    изменённых файлов. Рабочее дерево не создаётся, diff считается по объектам зеркала, поэтому
+    зеркало можно передать в local_code_reviewer как путь к репозиторию. Когда зеркала занимают
+    больше квоты, удаляются давно не использовавшиеся; зеркала, арендованные open_mirror
+    в любом процессе, не удаляются до конца ревью.
+    """
+
+    def __init__(self, config: Optional[WorkspaceConfig] = None):
+        self.config = config or WorkspaceConfig()
+        self.root = self.config.WORKSPACE_ROOT
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._mirror_locks: Dict[str, threading.Lock] = {}
+
+    def mirror_path(self, repo_url: str) -> str:
+        """Путь зеркала: читаемое имя репозитория и хэш URL (разные URL не пересекаются)."""
+        name = re.sub(r'[^A-Za-z0-9._-]+', '_', re.sub(r'\.git$', '', repo_url.rstrip('/').rsplit('/', 1)[-1]))
+        digest = hashlib.sha1(repo_url.encode()).hexdigest()[:12]
+        return os.path.join(self.root, f"{name}-{digest}.git")
+
+    def _thread_lock(self, path: str) -> threading.Lock:
+        with self._lock:
+            return self._mirror_locks.setdefault(path, threading.Lock())
+
+    @contextmanager
+    def open_mirror(self, repo_url: str, refs: List[str]) -> Iterator[str]:
+        """
+        Создаёт или обновляет зеркало репозитория, загружает в него указанные ссылки и держит
+        разделяемую аренду зеркала, пока открыт контекст: на всё время ревью (diff, чтение blob)
+        evict других процессов его не удалит.
+        Args:
+        - repo_url: URL удалённого репозитория (https, ssh или file://).
+        - refs: Ветки или полные ссылки (например 'main', 'refs/pull/12/head'); в зеркале они
+          доступны как ветки с именами local_ref_name.
+        Returns:
+        - Путь к зеркалу.
+        """
+        path = self.mirror_path(repo_url)
+        lease = self._fetch(path, repo_url, refs)
+        try:
+            self.evict()
+            yield path
+        finally:
+            lease.release()
+
+    @instrumented("workspace_fetch")
+    def _fetch(self, path: str, repo_url: str, refs: List[str]) -> _MirrorLease:
+        with self._thread_lock(path), _MirrorLock(path + LOCK_FILE_SUFFIX, self.config.WORKSPACE_LOCK_TIMEOUT):
+            if not os.path.isdir(path):
+                repository = git.Repo.init(path, bare=True)
+                # Без стандартного refspec: загружаются только запрошенные ссылки
+                repository.git.config('remote.origin.url', repo_url)
+            else:
+                repository = git.Repo(path)
+            options = ['--quiet', '--no-tags', '--force', '--prune']
+            if self.config.WORKSPACE_FETCH_FILTER:
+                options.append(f"--filter={self.config.WORKSPACE_FETCH_FILTER}")
+            if self.config.WORKSPACE_FETCH_DEPTH:
+                options.append(f"--depth={self.config.WORKSPACE_FETCH_DEPTH}")
+            refspecs = [f"+{_remote_ref(ref)}:refs/heads/{local_ref_name(ref)}" for ref in refs]
+            repository.git.fetch(*options, 'origin', *refspecs)
+            self.touch(path)
+            return _MirrorLease(path, self.config.WORKSPACE_LOCK_TIMEOUT)
+
+    def touch(self, path: str) -> None:
+        with open(os.path.join(path, LAST_USED_FILE), 'w') as f:
+            f.write(str(time.time()))
+
+    def mirrors(self) -> List[str]:
+        return [
+            os.path.join(self.root, name) for name in os.listdir(self.root)
+            if name.endswith('.git') and os.path.isdir(os.path.join(self.root, name))
+        ]
+
+    def _last_used(self, path: str) -> float:
+        try:
+            return os.path.getmtime(os.path.join(path, LAST_USED_FILE))
+        except OSError:
+            return 0.0
+
+    def evict(self) -> List[str]:
+        """
+        Удаляет давно не использовавшиеся зеркала, пока их суммарный размер больше WORKSPACE_QUOTA_BYTES.
+        Зеркало удаляется только под его блокировкой (без ожидания) и без действующих аренд,
+        поэтому зеркала, которые сейчас загружаются или проверяются, не удаляются.
+        Returns:
+        - Пути удалённых зеркал.
+        """
+        sizes = {path: directory_size(path) for path in self.mirrors()}
+        total = sum(sizes.values())
+        evicted = []
+        for path in sorted(sizes, key=self._last_used):
+            if total <= self.config.WORKSPACE_QUOTA_BYTES:
+                break
+            lock = _MirrorLock(path + LOCK_FILE_SUFFIX, self.config.WORKSPACE_LOCK_TIMEOUT)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                if _MirrorLease.active(path, self.config.WORKSPACE_LOCK_TIMEOUT):
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+            finally:
+                lock.release()
+            total -= sizes[path]
+            evicted.append(path)
+        return evicted
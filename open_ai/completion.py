@@ -1,28 +1,59 @@
-from typing import Awaitable, Optional, Union
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Dict, List, Optional, Union
 from openai.types.chat import ChatCompletion
-from tenacity import retry, stop_after_attempt, retry_if_exception_type
+from tenacity import retry, stop_after_attempt, retry_if_exception
 from openai import AsyncOpenAI, APIStatusError, OpenAIError, OpenAI
 
+from common.instrumentation import instrumented, record_retry, record_usage, stage
+from open_ai.rate_limit import (
+    OPENAI_CONF,
+    get_rate_limiter,
+    get_retry_after,
+    is_retryable,
+    wait_with_backoff,
+)
+from open_ai.tokens import count_tokens
+
+
+@lru_cache(maxsize=64)
+def _count_prefix_tokens(gpt_model: str, system_prompt: str, context: Optional[str]) -> int:
+    # The system prompt and context are the same for every request of a run, so they are counted once
+    return count_tokens(system_prompt, gpt_model) + (count_tokens(context, gpt_model) if context else 0)
+
 
-def custom_wait(e):
-    if isinstance(e, APIStatusError):
-        retry_after = e.response.headers.get("Retry-After")
-        if retry_after:
-            retry_after_seconds = int(retry_after)
-            print(f"Received Retry-After header, retrying after {retry_after_seconds} seconds...")
-            return retry_after_seconds
-        else:
-            # Если Retry-After не указан, используем фиксированное ожидание
-            return 4
-    else:
-        # Ожидание по умолчанию для других типов ошибок
-        return 4
+def _estimate_tokens(system_prompt: str, user_prompt: str, gpt_model: str, context: Optional[str] = None) -> int:
+    return (_count_prefix_tokens(gpt_model, system_prompt, context) + count_tokens(user_prompt, gpt_model)
+            + OPENAI_CONF.OPENAI_EXPECTED_COMPLETION_TOKENS)
 
 
+def build_messages(system_prompt: str, user_prompt: str, context: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    Lays out the chat messages for provider-side prompt caching: the stable system prompt first,
+    then the context shared by all requests of a run, and the variable user prompt (the diff) last.
+    Requests of one run then share the longest possible identical prefix.
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    if context:
+        messages.append({"role": "user", "content": context})
+    messages.append({"role": "user", "content": user_prompt})
+    return messages
+
+
+def _on_status_error(e: APIStatusError, gpt_model: str) -> None:
+    rate_limiter = get_rate_limiter(gpt_model)
+    rate_limiter.update(e.response.headers)
+    if e.status_code == 429:
+        # Pause every concurrent caller, not only the one that received the 429
+        rate_limiter.block(get_retry_after(e.response.headers) or OPENAI_CONF.OPENAI_BACKOFF_BASE)
+
+
+@instrumented("llm")
 @retry(
-    stop=stop_after_attempt(3),
-    retry=retry_if_exception_type((APIStatusError, OpenAIError)),
-    wait=custom_wait
+    stop=stop_after_attempt(OPENAI_CONF.OPENAI_MAX_ATTEMPTS),
+    retry=retry_if_exception(is_retryable),
+    wait=wait_with_backoff,
+    before_sleep=record_retry,
+    reraise=True
 )
 async def create_completion_async(
         openai_client: AsyncOpenAI,
@@ -32,9 +63,11 @@ async def create_completion_async(
         gpt_model: str = "gpt-4o-mini",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
-        response_format: Optional[dict] = None
+        response_format: Optional[dict] = None,
+        context: Optional[str] = None
 ) -> Awaitable[ChatCompletion]:
     """
+    :param context: Context shared by all requests of a run, sent between the system and user prompts
     :param response_format: json_schema
     :param top_p: 0 - random, 1 - deterministic
     :param temperature: 0 - deterministic, 1 - random
@@ -47,10 +80,7 @@ async def create_completion_async(
 
     completion_params = {
         "model": gpt_model,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"{user_prompt}"}
-        ],
+        "messages": build_messages(system_prompt, user_prompt, context),
     }
 
     if temperature is not None:
@@ -62,18 +92,29 @@ async def create_completion_async(
     if response_format is not None:
         completion_params["response_format"] = response_format
 
+    rate_limiter = get_rate_limiter(gpt_model)
+    estimated_tokens = _estimate_tokens(system_prompt, user_prompt, gpt_model, context)
+    await rate_limiter.acquire_async(estimated_tokens)
+    # Every attempt reserves its tokens; a failed attempt returns them before the retry reserves again
+    settled = False
+
     try:
-        completion = await openai_client.chat.completions.create(**completion_params)
+        raw_response = await openai_client.chat.completions.with_raw_response.create(**completion_params)
+        rate_limiter.update(raw_response.headers)
+        completion = raw_response.parse()
+        rate_limiter.settle(estimated_tokens, completion.usage.total_tokens if completion.usage else None)
+        settled = True
+        record_usage(gpt_model, completion.usage)
 
         content = completion.choices[0].message.content
         refusal = completion.choices[0].message.refusal
 
         if refusal is not None:
-            print(refusal)
-            raise APIStatusError
+            raise ValueError(f"Completion refused: {refusal}")
         return content
 
     except APIStatusError as e:
+        _on_status_error(e, gpt_model)
         print(f"An error occurred: {str(e)}")
         raise
     except OpenAIError as e:
@@ -82,8 +123,19 @@ async def create_completion_async(
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         raise
+    finally:
+        if not settled:
+            rate_limiter.release(estimated_tokens)
 
 
+@instrumented("llm")
+@retry(
+    stop=stop_after_attempt(OPENAI_CONF.OPENAI_MAX_ATTEMPTS),
+    retry=retry_if_exception(is_retryable),
+    wait=wait_with_backoff,
+    before_sleep=record_retry,
+    reraise=True
+)
 def create_completion(
         openai_client: OpenAI,
         *,
@@ -92,9 +144,11 @@ def create_completion(
         gpt_model: str = "gpt-4o-mini",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
-        response_format: Optional[dict] = None
+        response_format: Optional[dict] = None,
+        context: Optional[str] = None
 ) -> Union[ChatCompletion, str]:
     """
+    :param context: Context shared by all requests of a run, sent between the system and user prompts
     :param response_format: json_schema
     :param top_p: 0 - random, 1 - deterministic
     :param temperature: 0 - deterministic, 1 - random
@@ -107,10 +161,7 @@ def create_completion(
 
     completion_params = {
         "model": gpt_model,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"{user_prompt}"}
-        ],
+        "messages": build_messages(system_prompt, user_prompt, context),
     }
 
     if temperature is not None:
@@ -122,18 +173,29 @@ def create_completion(
     if response_format is not None:
         completion_params["response_format"] = response_format
 
+    rate_limiter = get_rate_limiter(gpt_model)
+    estimated_tokens = _estimate_tokens(system_prompt, user_prompt, gpt_model, context)
+    rate_limiter.acquire(estimated_tokens)
+    # Every attempt reserves its tokens; a failed attempt returns them before the retry reserves again
+    settled = False
+
     try:
-        completion = openai_client.chat.completions.create(**completion_params)
+        raw_response = openai_client.chat.completions.with_raw_response.create(**completion_params)
+        rate_limiter.update(raw_response.headers)
+        completion = raw_response.parse()
+        rate_limiter.settle(estimated_tokens, completion.usage.total_tokens if completion.usage else None)
+        settled = True
+        record_usage(gpt_model, completion.usage)
 
         content = completion.choices[0].message.content
         refusal = completion.choices[0].message.refusal
 
         if refusal is not None:
-            print(refusal)
-            raise APIStatusError
+            raise ValueError(f"Completion refused: {refusal}")
         return content
 
     except APIStatusError as e:
+        _on_status_error(e, gpt_model)
         print(f"An error occurred: {str(e)}")
         raise
     except OpenAIError as e:
@@ -141,4 +203,86 @@ def create_completion(
         raise
     except Exception as e:
         print(f"An error occurred: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        if not settled:
+            rate_limiter.release(estimated_tokens)
+
+@retry(
+    stop=stop_after_attempt(OPENAI_CONF.OPENAI_MAX_ATTEMPTS),
+    retry=retry_if_exception(is_retryable),
+    wait=wait_with_backoff,
+    before_sleep=record_retry,
+    reraise=True
+)
+async def _open_completion_stream(openai_client: AsyncOpenAI, completion_params: dict, gpt_model: str):
+    try:
+        raw_response = await openai_client.chat.completions.with_raw_response.create(**completion_params)
+    except APIStatusError as e:
+        _on_status_error(e, gpt_model)
+        raise
+    get_rate_limiter(gpt_model).update(raw_response.headers)
+    return raw_response.parse()
+
+
+async def create_completion_stream_async(
+        openai_client: AsyncOpenAI,
+        *,
+        system_prompt: str,
+        user_prompt: str,
+        gpt_model: str = "gpt-4o-mini",
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        context: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Streams the completion (stream=True) and yields content deltas as they arrive.
+    Only opening the stream is retried; an error in the middle of the stream is raised to the caller.
+
+    :param context: Context shared by all requests of a run, sent between the system and user prompts
+    :param top_p: 0 - random, 1 - deterministic
+    :param temperature: 0 - deterministic, 1 - random
+    :param openai_client: AsyncOpenAI client
+    :param system_prompt: System prompt for chatGPT
+    :param user_prompt: User prompt for chatGPT
+    :param gpt_model:
+    :return: Асинхронный итератор фрагментов ответа
+    """
+
+    completion_params = {
+        "model": gpt_model,
+        "messages": build_messages(system_prompt, user_prompt, context),
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+
+    if temperature is not None:
+        completion_params["temperature"] = temperature
+
+    if top_p is not None:
+        completion_params["top_p"] = top_p
+
+    rate_limiter = get_rate_limiter(gpt_model)
+    estimated_tokens = _estimate_tokens(system_prompt, user_prompt, gpt_model, context)
+    await rate_limiter.acquire_async(estimated_tokens)
+    # Released on a failed open, a refusal, an error or cancellation mid-stream and a stream without usage
+    settled = False
+
+    with stage("llm_stream"):
+        try:
+            stream = await _open_completion_stream(openai_client, completion_params, gpt_model)
+            async for chunk in stream:
+                if chunk.usage is not None and not settled:
+                    rate_limiter.settle(estimated_tokens, chunk.usage.total_tokens)
+                    settled = True
+                    record_usage(gpt_model, chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.refusal:
+                    raise ValueError(f"Completion refused: {delta.refusal}")
+                if delta.content:
+                    yield delta.content
+        finally:
+            if not settled:
+                rate_limiter.release(estimated_tokens)
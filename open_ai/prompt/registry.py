@@ -0,0 +1,45 @@
+import textwrap
+from functools import lru_cache
+
+DIFF_PLACEHOLDER = "{}"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Removes the source-code indentation and trailing whitespace of a prompt literal.
+    The multi-line prompts in llm_prompt.py are indented to the code level, which costs
+    tokens on every request without changing the meaning.
+    """
+    lines = textwrap.dedent(prompt).split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+
+class CompiledPrompt:
+    """
+    A system prompt and a user template prepared once per run.
+
+    The system prompt is normalized once, and the user template is split around its diff
+    placeholder, so rendering a request is a concatenation instead of a `str.format` call.
+    Because the system prompt and the template prefix are identical for every request of a run,
+    they form a stable prefix that the provider can serve from its prompt cache.
+    """
+
+    def __init__(self, system_prompt: str, user_template: str):
+        self.system_prompt = normalize_prompt(system_prompt)
+        self.user_template = user_template
+        prefix, placeholder, suffix = user_template.partition(DIFF_PLACEHOLDER)
+        # Other format fields or escaped braces keep the str.format behaviour
+        self._simple = bool(placeholder) and not any(brace in prefix + suffix for brace in '{}')
+        self._prefix, self._suffix = prefix, suffix
+
+    def render(self, changes: str) -> str:
+        """Renders the user prompt of one request, with the diff last."""
+        if self._simple:
+            return f"{self._prefix}{changes}{self._suffix}"
+        return self.user_template.format(changes)
+
+
+@lru_cache(maxsize=32)
+def compile_prompt(system_prompt: str, user_template: str) -> CompiledPrompt:
+    """Returns the compiled prompt for the pair, compiling it only on first use."""
+    return CompiledPrompt(system_prompt, user_template)
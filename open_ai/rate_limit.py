@@ -0,0 +1,169 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from typing import Dict, Mapping, Optional
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+from tenacity import RetryCallState
+
+from settings.conf import OpenAIConfig
+
+OPENAI_CONF = OpenAIConfig()
+
+DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parses durations of the x-ratelimit-reset-* headers ('20ms', '1s', '6m0s') into seconds.
+    """
+    if not value:
+        return None
+    matches = DURATION_PATTERN.findall(value)
+    if not matches:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in matches)
+
+
+def get_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return None
+
+
+class _Bucket:
+    """Token bucket refilled continuously at `capacity` units per minute."""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        return max(0.0, (amount - self.level) * 60 / self.capacity)
+
+
+class RateLimitScheduler:
+    """
+    Client-side admission control shared by every completion call of a model.
+
+    Requests and tokens are tracked in two token buckets. Their size is learned from the
+    x-ratelimit-limit-* headers and their level is corrected from x-ratelimit-remaining-*,
+    so calls are delayed before the provider would answer with 429. A 429 pauses all callers
+    for the Retry-After interval.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self._lock = threading.Lock()
+        self._requests = _Bucket(requests_per_minute)
+        self._tokens = _Bucket(tokens_per_minute)
+        self._blocked_until = 0.0
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            tokens = min(tokens, self._tokens.capacity)
+            wait = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            self._requests.level -= 1
+            self._tokens.level -= tokens
+            return 0.0
+
+    def acquire(self, tokens: int) -> None:
+        """Blocks until a request of `tokens` tokens can be sent."""
+        while (wait := self._reserve(tokens)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int) -> None:
+        """Waits without blocking the event loop until a request of `tokens` tokens can be sent."""
+        while (wait := self._reserve(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated_tokens: int, used_tokens: Optional[int]) -> None:
+        """Returns over-reserved tokens (or charges the missing ones) once the usage is known."""
+        if used_tokens is None:
+            return
+        with self._lock:
+            self._tokens.level = min(self._tokens.capacity, self._tokens.level + estimated_tokens - used_tokens)
+
+    def release(self, tokens: int) -> None:
+        """Returns the tokens reserved for a request that failed before its usage was known."""
+        self.settle(tokens, 0)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Adjusts the buckets from the x-ratelimit-* headers of a response."""
+        with self._lock:
+            now = time.monotonic()
+            for bucket, kind in ((self._requests, "requests"), (self._tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                bucket.refill(now)
+                if limit and limit.isdigit() and int(limit) > 0:
+                    bucket.capacity = float(limit)
+                if remaining and remaining.isdigit():
+                    bucket.level = min(bucket.level, float(remaining))
+
+    def block(self, seconds: float) -> None:
+        """Pauses every caller for `seconds`, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+_schedulers: Dict[str, RateLimitScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_rate_limiter(gpt_model: str) -> RateLimitScheduler:
+    """Returns the scheduler shared by all calls to `gpt_model` in this process."""
+    with _schedulers_lock:
+        if gpt_model not in _schedulers:
+            _schedulers[gpt_model] = RateLimitScheduler(OPENAI_CONF.OPENAI_RPM_LIMIT, OPENAI_CONF.OPENAI_TPM_LIMIT)
+        return _schedulers[gpt_model]
+
+
+def is_retryable(e: BaseException) -> bool:
+    """Retries rate limits, server errors, timeouts and connection failures, but not other 4xx errors."""
+    if isinstance(e, (APITimeoutError, APIConnectionError)):
+        return True
+    if isinstance(e, APIStatusError):
+        return e.status_code in (408, 409, 429) or e.status_code >= 500
+    return False
+
+
+def wait_with_backoff(retry_state: RetryCallState) -> float:
+    """
+    Waits for Retry-After when the provider sends it, otherwise uses exponential backoff
+    with full jitter.
+    """
+    e = retry_state.outcome.exception() if retry_state.outcome else None
+    if isinstance(e, APIStatusError):
+        retry_after = get_retry_after(e.response.headers)
+        if retry_after is not None:
+            return retry_after
+    ceiling = min(OPENAI_CONF.OPENAI_BACKOFF_MAX, OPENAI_CONF.OPENAI_BACKOFF_BASE * 2 ** retry_state.attempt_number)
+    return random.uniform(0, ceiling)
@@ -0,0 +1,29 @@
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(gpt_model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(gpt_model)
+        except KeyError:
+            # Unknown or custom model names use the encoding of the current OpenAI models
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # The encoding files are downloaded on first use, which fails on offline workers
+        return None
+
+
+def count_tokens(text: str, gpt_model: str) -> int:
+    """
+    Counts tokens of `text` with the tokenizer of `gpt_model`.
+    Falls back to a 4-characters-per-token estimate when tiktoken or its encoding is unavailable.
+    """
+    encoding = _get_encoding(gpt_model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,255 @@
+import json
+import logging
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from openai import OpenAI
+
+from common.az_logger.global_logger import CustomLogger
+from common.instrumentation import record_cache
+from open_ai.completion import build_messages
+from open_ai.prompt.registry import compile_prompt
+from review.cache import ReviewCache, make_cache_key
+from review.chunker import (
+    RequestPacker,
+    assign_review,
+    build_request_changes,
+    iter_file_pieces,
+    merge_piece_reviews,
+    piece_label,
+    piece_text,
+    restore_cached_review,
+)
+from schema.completion.findings import REVIEW_RESPONSE_FORMAT
+from settings.conf import ReviewConfig
+
+REVIEW_CONF = ReviewConfig()
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchBackend(ABC):
+    """Interface of a batch execution backend."""
+
+    @abstractmethod
+    def submit(self, batch_file: str) -> str:
+        """Uploads the JSONL request file and returns the batch id."""
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def results(self, batch_id: str) -> Dict[str, Optional[str]]:
+        """Returns the completion content for every custom_id (None for failed requests)."""
+
+
+def _parse_result_line(line: str) -> Tuple[str, Optional[str]]:
+    result = json.loads(line)
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        return result["custom_id"], None
+    message = response["body"]["choices"][0]["message"]
+    return result["custom_id"], message.get("content")
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Runs the batch through the OpenAI Batch API (24h completion window, half the price)."""
+
+    def __init__(self, openai_client: OpenAI, completion_window: str = "24h"):
+        self.openai_client = openai_client
+        self.completion_window = completion_window
+
+    def submit(self, batch_file: str) -> str:
+        with open(batch_file, 'rb') as f:
+            input_file = self.openai_client.files.create(file=f, purpose="batch")
+        batch = self.openai_client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.openai_client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> Dict[str, Optional[str]]:
+        batch = self.openai_client.batches.retrieve(batch_id)
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.openai_client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    custom_id, content = _parse_result_line(line)
+                    results.setdefault(custom_id, content)
+        return results
+
+
+def _default_responder(body: dict) -> str:
+    if "response_format" in body:
+        return json.dumps({"findings": []})
+    labels = re.findall(r'^### File: (.+)$', body['messages'][-1]['content'], re.MULTILINE)
+    if labels:
+        return "\n\n".join(f"### Review for {label}\nReviewed." for label in labels)
+    return f"Reviewed {len(body['messages'])} messages."
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Offline backend that answers every request of the batch file immediately.
+
+    Args:
+    - responder: Callable receiving the request body and returning the completion content.
+      By default it echoes the number of messages, with one section per file of a packed request
+      (or returns no findings for structured requests), which is enough to exercise the pipeline.
+    """
+
+    def __init__(self, responder: Optional[Callable[[dict], str]] = None):
+        self.responder = responder or _default_responder
+        self._batches: Dict[str, Dict[str, Optional[str]]] = {}
+
+    def submit(self, batch_file: str) -> str:
+        results = {}
+        with open(batch_file) as f:
+            for line in f:
+                if line.strip():
+                    request = json.loads(line)
+                    results[request["custom_id"]] = self.responder(request["body"])
+        batch_id = f"local-batch-{len(self._batches) + 1}"
+        self._batches[batch_id] = results
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        return "completed"
+
+    def results(self, batch_id: str) -> Dict[str, Optional[str]]:
+        return self._batches[batch_id]
+
+
+def build_batch_request(
+        custom_id: str,
+        system_prompt: str,
+        user_prompt: str,
+        gpt_model: str,
+        response_format: Optional[dict] = None,
+        context: Optional[str] = None
+) -> dict:
+    request = {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": gpt_model,
+            "messages": build_messages(system_prompt, user_prompt, context),
+        },
+    }
+    if response_format is not None:
+        request["body"]["response_format"] = response_format
+    return request
+
+
+def wait_for_batch(backend: BatchBackend, batch_id: str, poll_interval: float, timeout: Optional[float]) -> str:
+    """Polls the batch until it reaches a terminal status or `timeout` seconds pass."""
+    started = time.monotonic()
+    while (status := backend.status(batch_id)) not in BATCH_TERMINAL_STATUSES:
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise TimeoutError(f"Batch {batch_id} is still {status} after {timeout} seconds")
+        time.sleep(poll_interval)
+    return status
+
+
+def run_batch_review(
+        files: Iterable[Dict[str, str]],
+        backend: BatchBackend,
+        system_prompt: str,
+        user_prompt: str,
+        gpt_model: str,
+        logger: Union[logging.Logger, CustomLogger],
+        batch_file: str,
+        cache: Optional[ReviewCache] = None,
+        max_tokens: Optional[int] = None,
+        poll_interval: float = 60,
+        timeout: Optional[float] = None,
+        structured: Optional[bool] = None,
+        context: Optional[str] = None
+) -> List[Dict[str, Optional[str]]]:
+    """
+    Reviews all file diffs through a batch job instead of interactive completions.
+
+    Diffs are chunked and packed exactly like in review.engine, every request is written to
+    `batch_file` as one JSONL line, the batch is submitted and polled, and the results are
+    mapped back to the files. Pieces of a packed review that cannot be attributed to them
+    are reviewed alone in a follow-up batch.
+
+    Returns:
+    - The same per-file list as review.engine.review_files, so the output is formatted identically.
+    """
+    max_tokens = max_tokens or REVIEW_CONF.REVIEW_MAX_REQUEST_TOKENS
+    structured = REVIEW_CONF.REVIEW_STRUCTURED_OUTPUT if structured is None else structured
+    response_format = REVIEW_RESPONSE_FORMAT if structured else None
+    prompt = compile_prompt(system_prompt, user_prompt)
+    packer = RequestPacker(max_tokens, REVIEW_CONF.REVIEW_MAX_FILES_PER_REQUEST)
+    pieces, requests = [], []
+
+    for piece in iter_file_pieces(files, max_tokens, gpt_model):
+        pieces.append(piece)
+        piece['comments'], piece['cached'] = None, False
+        if cache is not None:
+            piece['cache_key'] = make_cache_key(
+                gpt_model, prompt.system_prompt, user_prompt, piece_text(piece), response_format
+            )
+            cached_review = cache.get(piece['cache_key'])
+            record_cache(cached_review is not None)
+            if cached_review is not None:
+                restore_cached_review(piece, cached_review, structured)
+                piece['cached'] = True
+                continue
+        requests.extend(packer.add(piece))
+    requests.extend(packer.flush())
+
+    # Pieces a packed review cannot be attributed to are sent again alone in a second batch
+    while requests:
+        with open(batch_file, 'w') as f:
+            for number, request in enumerate(requests):
+                line = build_batch_request(
+                    f"request-{number}", prompt.system_prompt, prompt.render(build_request_changes(request, structured)),
+                    gpt_model, response_format, context
+                )
+                f.write(json.dumps(line) + "\n")
+
+        batch_id = backend.submit(batch_file)
+        logger.info(f"Submitted batch {batch_id} with {len(requests)} requests from {batch_file}")
+        status = wait_for_batch(backend, batch_id, poll_interval, timeout)
+        if status != "completed":
+            logger.error(f"Batch {batch_id} finished with status {status}")
+        results = backend.results(batch_id)
+
+        unassigned = []
+        for number, request in enumerate(requests):
+            review = results.get(f"request-{number}")
+            labels = ", ".join(piece_label(piece) for piece in request)
+            if review is None:
+                logger.error(f"No batch result for file {labels}")
+                continue
+            try:
+                cache_values = assign_review(request, review, structured)
+            except ValueError as e:
+                logger.error(f"Invalid batch result for file {labels}: {e}")
+                continue
+            for piece, value in zip(request, cache_values):
+                if value is None:
+                    unassigned.append(piece)
+                elif cache is not None:
+                    cache.set(piece['cache_key'], value)
+        if unassigned:
+            logger.warning(
+                f"Batch {batch_id} reviews could not be split by file, "
+                f"reviewing {', '.join(piece_label(piece) for piece in unassigned)} separately"
+            )
+        requests = [[piece] for piece in unassigned]
+
+    return merge_piece_reviews(pieces)
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from settings.conf import RedisConfig, ReviewCacheConfig
+
+
+def normalize_diff(diff: str) -> str:
+    """
+    Normalizes a diff chunk so that cosmetic differences do not change its cache key.
+
+    Line endings are unified, trailing whitespace is stripped and `index <sha>..<sha>` lines,
+    which change on every rebase or force-push, are dropped.
+    """
+    lines = []
+    for line in diff.replace('\r\n', '\n').split('\n'):
+        if line.startswith('index '):
+            continue
+        lines.append(line.rstrip())
+    return '\n'.join(lines).strip('\n')
+
+
+def make_cache_key(
+        gpt_model: str,
+        system_prompt: str,
+        user_prompt: str,
+        diff: str,
+        response_format: Optional[dict] = None
+) -> str:
+    """
+    Builds a content-addressed key for a review request.
+
+    Args:
+    - gpt_model: Model name.
+    - system_prompt: System prompt text.
+    - user_prompt: User prompt template (before the diff is substituted).
+    - diff: Diff chunk under review.
+    - response_format: Structured output format, so text and JSON reviews are cached apart.
+
+    Returns:
+    - Hex SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    output_format = json.dumps(response_format, sort_keys=True) if response_format else "text"
+    for part in (gpt_model, system_prompt, user_prompt, normalize_diff(diff), output_format):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ReviewCache(ABC):
+    """Interface of a review cache backend."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: str) -> None:
+        ...
+
+
+class DiskReviewCache(ReviewCache):
+    """
+    SQLite-backed cache with TTL expiry and LRU eviction by total stored size.
+    """
+
+    def __init__(self, path: str, ttl: int, max_bytes: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS reviews ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS reviews_accessed ON reviews (accessed)")
+        self._connection.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, created FROM reviews WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if created + self.ttl < now:
+                self._connection.execute("DELETE FROM reviews WHERE key = ?", (key,))
+                self._connection.commit()
+                return None
+            self._connection.execute("UPDATE reviews SET accessed = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO reviews (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._evict(now)
+            self._connection.commit()
+
+    def _evict(self, now: float) -> None:
+        self._connection.execute("DELETE FROM reviews WHERE created < ?", (now - self.ttl,))
+        total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM reviews").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._connection.execute("SELECT key, size FROM reviews ORDER BY accessed").fetchall()
+        stale = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._connection.executemany("DELETE FROM reviews WHERE key = ?", stale)
+
+
+class RedisReviewCache(ReviewCache):
+    """
+    Redis-backed cache. Entries expire through the key TTL, and a sorted set of access
+    times keeps the number of entries under `max_entries` in LRU order.
+    """
+    PREFIX = "review_cache:"
+    LRU_KEY = "review_cache:__lru__"
+
+    def __init__(self, redis_config: RedisConfig, ttl: int, max_entries: int):
+        import redis
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._client = redis.Redis(
+            host=redis_config.REDIS_HOST,
+            port=int(redis_config.REDIS_PORT),
+            db=int(redis_config.REDIS_DB),
+            decode_responses=True
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._client.get(self.PREFIX + key)
+        if value is None:
+            self._client.zrem(self.LRU_KEY, key)
+            return None
+        self._client.zadd(self.LRU_KEY, {key: time.time()})
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        pipeline = self._client.pipeline()
+        pipeline.set(self.PREFIX + key, value, ex=self.ttl)
+        pipeline.zadd(self.LRU_KEY, {key: time.time()})
+        pipeline.zcard(self.LRU_KEY)
+        overflow = pipeline.execute()[-1] - self.max_entries
+        if overflow > 0:
+            evicted = [member for member, _ in self._client.zpopmin(self.LRU_KEY, overflow)]
+            self._client.delete(*(self.PREFIX + member for member in evicted))
+
+
+def get_review_cache(config: Optional[ReviewCacheConfig] = None) -> Optional[ReviewCache]:
+    """
+    Creates the cache backend selected by REVIEW_CACHE_BACKEND, or None when caching is disabled.
+    """
+    config = config or ReviewCacheConfig()
+    backend = config.REVIEW_CACHE_BACKEND.lower()
+    if backend == "disk":
+        return DiskReviewCache(config.REVIEW_CACHE_PATH, config.REVIEW_CACHE_TTL, config.REVIEW_CACHE_MAX_BYTES)
+    if backend == "redis":
+        return RedisReviewCache(RedisConfig(), config.REVIEW_CACHE_TTL, config.REVIEW_CACHE_MAX_ENTRIES)
+    return None
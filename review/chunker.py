@@ -0,0 +1,310 @@
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from open_ai.tokens import count_tokens
+from review.diff import ADDED, CONTEXT, REMOVED, DiffFile, Hunk, file_diff
+from schema.completion.findings import (
+    CodeReview,
+    ReviewFinding,
+    dump_findings,
+    load_findings,
+    parse_review,
+    render_findings,
+)
+
+PACKED_REVIEW_INSTRUCTION = (
+    "The changes below belong to several files. Review each file separately and start the review "
+    "of every file with a line `### Review for <file>`, using the file label exactly as given.\n\n"
+)
+STRUCTURED_PACKED_REVIEW_INSTRUCTION = (
+    "The changes below belong to several files. Set the `file` of every finding to the label "
+    "of its file exactly as given.\n\n"
+)
+RELATED_CODE_HEADER = "Related code from the repository (for reference, not part of the change):\n\n"
+CHANGES_HEADER = "Changes:\n\n"
+REVIEW_HEADER_PATTERN = re.compile(r'^#+\s*Review for\s+`?(?P<label>.+?)`?\s*:?\s*$', re.MULTILINE)
+
+
+def _split_lines(diff: DiffFile, first: int, last: int, max_tokens: int, gpt_model: str) -> Iterator[Tuple[int, int]]:
+    """Line ranges of at most `max_tokens` of the lines `first`..`last - 1`."""
+    start, part_tokens = first, 0
+    for index in range(first, last):
+        line_tokens = count_tokens(diff.line(index), gpt_model) + 1
+        if index > start and part_tokens + line_tokens > max_tokens:
+            yield start, index
+            start, part_tokens = index, 0
+        part_tokens += line_tokens
+    if start < last:
+        yield start, last
+
+
+def _split_hunk(
+        diff: DiffFile, hunk: Hunk, max_tokens: int, gpt_model: str
+) -> Iterator[Tuple[int, int, Optional[str]]]:
+    """
+    Splits a hunk that does not fit into `max_tokens` by lines. Every part gets its own hunk header
+    with the old and new line ranges of its lines, so the line numbers of every part stay known.
+    """
+    section = diff.line(hunk.first).split('@@', 2)[-1]
+    budget = max(max_tokens - count_tokens(diff.line(hunk.first), gpt_model) - 1, 1)
+    kinds, old_line, new_line = diff.kinds, hunk.old_start, hunk.new_start
+    for first, last in _split_lines(diff, hunk.first + 1, hunk.last, budget, gpt_model):
+        old_length = sum(kinds[index] in (CONTEXT, REMOVED) for index in range(first, last))
+        new_length = sum(kinds[index] in (CONTEXT, ADDED) for index in range(first, last))
+        # An empty range starts at the line before it, like in git's own hunk headers
+        yield first, last, (
+            f"@@ -{old_line if old_length else old_line - 1},{old_length} "
+            f"+{new_line if new_length else new_line - 1},{new_length} @@{section}"
+        )
+        old_line, new_line = old_line + old_length, new_line + new_length
+
+
+def split_file_diff(file_data: Dict[str, str], max_tokens: int, gpt_model: str) -> List[Dict]:
+    """
+    Splits a file diff that exceeds `max_tokens` at hunk boundaries.
+
+    The file header (everything before the first `@@` line) is repeated in every part.
+    A single hunk that does not fit on its own is split by lines, and every part of it starts
+    with a hunk header of its own line ranges. Hunks are taken from the parsed
+    diff (review.diff) and sliced by offset, so a part costs one copy of its text. The related code of the file
+    ('context', see review.symbols) is attached to every part and counts against the budget;
+    it is dropped when it leaves less than half of the budget for the diff.
+
+    Args:
+    - file_data: Dictionary with 'filename', 'changes' and optionally 'context'.
+    - max_tokens: Token budget of one part.
+    - gpt_model: Model whose tokenizer is used.
+
+    Returns:
+    - List of pieces with 'filename', 'changes', 'context', 'part', 'parts', 'tokens' and the source 'file'.
+    """
+    changes = file_data['changes']
+    diff = file_diff(file_data)
+    context = file_data.get('context')
+    context_tokens = count_tokens(context, gpt_model) if context else 0
+    if context_tokens * 2 > max_tokens:
+        context, context_tokens = None, 0
+    max_tokens -= context_tokens
+    tokens = count_tokens(changes, gpt_model)
+    if tokens <= max_tokens:
+        return [{'filename': file_data['filename'], 'changes': changes, 'diff': diff, 'context': context, 'part': 1,
+                 'parts': 1, 'tokens': tokens + context_tokens, 'file': file_data}]
+
+    header = diff.header if diff.body > diff.start else ''
+    header_tokens = count_tokens(header, gpt_model) if header else 0
+    budget = max(max_tokens - header_tokens, 1)
+
+    # Parts are contiguous line ranges: whole hunks, or the lines of a hunk that does not fit alone
+    # together with their own hunk header
+    bodies, body, body_tokens = [], None, 0
+    for hunk in diff.hunks:
+        hunk_tokens = count_tokens(diff.slice(hunk.first, hunk.last), gpt_model) + 1
+        if hunk_tokens > budget:
+            if body:
+                bodies.append(body)
+                body, body_tokens = None, 0
+            bodies.extend(_split_hunk(diff, hunk, budget, gpt_model))
+            continue
+        if body and body_tokens + hunk_tokens > budget:
+            bodies.append(body)
+            body, body_tokens = None, 0
+        body = (body[0] if body else hunk.first, hunk.last, None)
+        body_tokens += hunk_tokens
+    if body:
+        bodies.append(body)
+
+    pieces = []
+    for number, (first, last, hunk_header) in enumerate(bodies, start=1):
+        text = diff.slice(first, last)
+        if hunk_header:
+            text = f"{hunk_header}\n{text}"
+        if header:
+            text = f"{header}\n{text}"
+        pieces.append({'filename': file_data['filename'], 'changes': text, 'context': context, 'part': number,
+                       'parts': len(bodies), 'tokens': count_tokens(text, gpt_model) + context_tokens,
+                       'file': file_data})
+    return pieces
+
+
+def iter_file_pieces(files: Iterable[Dict[str, str]], max_tokens: int, gpt_model: str) -> Iterator[Dict]:
+    """Lazily yields the pieces of every file diff, in file order."""
+    for file_data in files:
+        yield from split_file_diff(file_data, max_tokens, gpt_model)
+
+
+def piece_label(piece: Dict) -> str:
+    if piece['parts'] == 1:
+        return piece['filename']
+    return f"{piece['filename']} (part {piece['part']}/{piece['parts']})"
+
+
+def piece_text(piece: Dict) -> str:
+    """The diff of a piece, preceded by its related code when there is any."""
+    if not piece.get('context'):
+        return piece['changes']
+    return f"{RELATED_CODE_HEADER}{piece['context']}\n\n{CHANGES_HEADER}{piece['changes']}"
+
+
+def build_request_changes(pieces: List[Dict], structured: bool = False) -> str:
+    """
+    Builds the diff text of one request. A single piece is sent as is,
+    several pieces are sent as labelled sections.
+    """
+    if len(pieces) == 1:
+        return piece_text(pieces[0])
+    sections = (f"### File: {piece_label(piece)}\n\n{piece_text(piece)}" for piece in pieces)
+    instruction = STRUCTURED_PACKED_REVIEW_INSTRUCTION if structured else PACKED_REVIEW_INSTRUCTION
+    return instruction + "\n\n".join(sections)
+
+
+class RequestPacker:
+    """
+    Greedily packs consecutive pieces into requests of at most `max_tokens` tokens
+    and `max_files` pieces.
+    """
+
+    def __init__(self, max_tokens: int, max_files: int):
+        self.max_tokens = max_tokens
+        self.max_files = max_files
+        self._pieces: List[Dict] = []
+        self._tokens = 0
+
+    def add(self, piece: Dict) -> List[List[Dict]]:
+        """Adds a piece and returns the requests that became complete."""
+        ready = []
+        if self._pieces and (self._tokens + piece['tokens'] > self.max_tokens
+                             or len(self._pieces) >= self.max_files):
+            ready.append(self._pieces)
+            self._pieces, self._tokens = [], 0
+        self._pieces.append(piece)
+        self._tokens += piece['tokens']
+        return ready
+
+    def flush(self) -> List[List[Dict]]:
+        ready = [self._pieces] if self._pieces else []
+        self._pieces, self._tokens = [], 0
+        return ready
+
+
+def split_packed_review(review: str, pieces: List[Dict]) -> List[Optional[str]]:
+    """
+    Maps the review of a packed request back to its pieces.
+
+    Sections are matched by the `### Review for <label>` headers. A piece without a matching
+    section gets None: the review cannot be attributed to it (e.g. the model ignored the format),
+    so the caller reviews it again on its own instead of giving it the reviews of other files.
+
+    Returns:
+    - Review text for every piece (None when unmatched), in the order of `pieces`.
+    """
+    if len(pieces) == 1:
+        return [review]
+
+    labels = {piece_label(piece): index for index, piece in enumerate(pieces)}
+    sections: List[Optional[str]] = [None] * len(pieces)
+    matches = list(REVIEW_HEADER_PATTERN.finditer(review))
+    for number, match in enumerate(matches):
+        label = match.group('label')
+        index = labels.get(label)
+        if index is None:
+            index = next((i for name, i in labels.items() if name in label or label in name), None)
+        if index is None:
+            continue
+        end = matches[number + 1].start() if number + 1 < len(matches) else len(review)
+        section = review[match.end():end].strip()
+        sections[index] = section if sections[index] is None else f"{sections[index]}\n\n{section}"
+
+    return sections
+
+
+def split_structured_review(review: CodeReview, pieces: List[Dict]) -> Optional[List[List[ReviewFinding]]]:
+    """
+    Maps the findings of a structured review back to the pieces of the request.
+
+    Findings are matched by their `file` label, and the `file` of every finding is set to the
+    real filename. When a finding of a packed request has an unknown label, the findings cannot
+    be attributed reliably and None is returned.
+
+    Returns:
+    - Findings of every piece, in the order of `pieces`, or None.
+    """
+    findings: List[List[ReviewFinding]] = [[] for _ in pieces]
+    labels = {piece_label(piece): index for index, piece in enumerate(pieces)}
+    for finding in review.findings:
+        index = 0
+        if len(pieces) > 1:
+            index = labels.get(finding.file)
+            if index is None:
+                index = next((i for name, i in labels.items() if name in finding.file or finding.file in name), None)
+            if index is None:
+                return None
+        finding.file = pieces[index]['filename']
+        findings[index].append(finding)
+    return findings
+
+
+def assign_review(pieces: List[Dict], review: str, structured: bool) -> List[Optional[str]]:
+    """
+    Stores the review of one request on its pieces: 'comments' always, and 'findings' in structured mode.
+
+    Pieces the review cannot be attributed to are left unreviewed and get None; they must be
+    reviewed again one by one and their value must not be cached.
+
+    Raises:
+    - pydantic.ValidationError: When a structured review does not match the schema.
+
+    Returns:
+    - The cache value of every piece (review text, or compact findings JSON in structured mode), or None.
+    """
+    if not structured:
+        sections = split_packed_review(review, pieces)
+        for piece, section in zip(pieces, sections):
+            if section is not None:
+                piece['comments'] = section
+        return sections
+
+    piece_findings = split_structured_review(parse_review(review), pieces)
+    if piece_findings is None:
+        return [None] * len(pieces)
+    values = []
+    for piece, findings in zip(pieces, piece_findings):
+        piece['findings'], piece['comments'] = findings, render_findings(findings)
+        values.append(dump_findings(findings))
+    return values
+
+
+def restore_cached_review(piece: Dict, value: str, structured: bool) -> None:
+    """Restores a piece review from a cache value written by assign_review."""
+    if structured:
+        piece['findings'] = load_findings(value)
+        piece['comments'] = render_findings(piece['findings'])
+    else:
+        piece['comments'] = value
+
+
+def merge_piece_reviews(pieces: List[Dict]) -> List[Dict]:
+    """
+    Joins the reviewed pieces back into one result per source file, in file order.
+
+    Returns:
+    - List of the source file dictionaries extended with 'comments', 'findings' and 'cached'.
+      'comments' is None when every piece of the file failed; 'findings' is None for text reviews.
+    """
+    results = []
+    for piece in pieces:
+        if results and results[-1]['source'] is piece['file']:
+            current = results[-1]
+        else:
+            current = {'source': piece['file'], 'comments': [], 'findings': None, 'cached': True}
+            results.append(current)
+        if piece.get('comments') is not None:
+            current['comments'].append(piece['comments'])
+        if piece.get('findings') is not None:
+            current['findings'] = (current['findings'] or []) + piece['findings']
+        current['cached'] = current['cached'] and piece.get('cached', False)
+
+    return [
+        {**result['source'], 'comments': "\n\n".join(result['comments']) or None, 'findings': result['findings'],
+         'cached': result['cached']}
+        for result in results
+    ]
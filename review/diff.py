@@ -0,0 +1,256 @@
+"""
+Unified diff model shared by the local (git diff) and GitHub (patch) paths.
+
+A diff is parsed once into one DiffFile per file. Line texts are not copied: a DiffFile keeps
+the text it was parsed from and per line only its start offset, kind and new-file line number,
+in compact arrays. Hunks are slotted records with their old and new ranges and the index range
+of their lines.
+
+The producers attach the parsed file to the file dictionary as 'diff', and later stages read it
+through `file_diff` instead of splitting 'changes' again: triage and routing use the added and
+removed lines, chunking slices hunks by offset, the semantic cache uses the first new line and
+inline posting the GitHub diff position of a new-file line.
+"""
+import fnmatch
+import re
+from array import array
+from bisect import bisect_right
+from itertools import islice
+from typing import Callable, Dict, List, Optional, Tuple
+
+FILE_MARKER = 'diff --git'
+HUNK_HEADER_PATTERN = re.compile(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+# Line kinds
+HUNK = 0
+CONTEXT = 1
+ADDED = 2
+REMOVED = 3
+NO_NEWLINE = 4  # "\ No newline at end of file"
+
+LINE_KINDS = {' ': CONTEXT, '+': ADDED, '-': REMOVED, '\\': NO_NEWLINE}
+
+# Path globs of the languages accepted by `path_filter`
+LANGUAGE_GLOBS = {
+    'python': ('*.py',),
+    'javascript': ('*.js', '*.jsx', '*.mjs', '*.cjs'),
+    'typescript': ('*.ts', '*.tsx'),
+    'go': ('*.go',),
+    'java': ('*.java',),
+    'kotlin': ('*.kt', '*.kts'),
+    'csharp': ('*.cs',),
+    'c': ('*.c', '*.h'),
+    'cpp': ('*.cc', '*.cpp', '*.cxx', '*.hh', '*.hpp'),
+    'rust': ('*.rs',),
+    'ruby': ('*.rb',),
+    'php': ('*.php',),
+    'shell': ('*.sh', '*.bash'),
+    'sql': ('*.sql',),
+}
+
+
+class Hunk:
+    """One hunk: its ranges in the old and new file and the index range of its lines (header included)."""
+    __slots__ = ('old_start', 'old_length', 'new_start', 'new_length', 'first', 'last')
+
+    def __init__(self, old_start: int, old_length: int, new_start: int, new_length: int, first: int):
+        self.old_start = old_start
+        self.old_length = old_length
+        self.new_start = new_start
+        self.new_length = new_length
+        self.first = first
+        self.last = first + 1
+
+    def __repr__(self) -> str:
+        return f"Hunk(-{self.old_start},{self.old_length} +{self.new_start},{self.new_length})"
+
+
+class DiffFile:
+    """
+    Parsed diff of one file.
+
+    Lines are numbered from the first hunk header (line 0), which is also how GitHub counts
+    diff positions. Line `i` spans text[offsets[i]:offsets[i + 1] - 1]; the last offset points
+    one character past the final newline (or past the end of the file's text). `new_lines` and
+    `positions` hold the new-file line number and the line index of every context and added line,
+    in ascending order.
+    """
+    __slots__ = ('path', 'text', 'start', 'end', 'body', 'offsets', 'kinds', 'new_lines', 'positions', 'hunks',
+                 '_changes')
+
+    def __init__(self, text: str, start: int = 0, end: Optional[int] = None, path: Optional[str] = None):
+        self.text = text
+        self.start = start
+        self.end = len(text) if end is None else end
+        self.path = path
+        self.offsets = array('l')
+        self.kinds = array('b')
+        self.new_lines = array('l')
+        self.positions = array('l')
+        self.hunks: List[Hunk] = []
+        self._changes: Optional[str] = None
+        self._parse()
+
+    def _parse(self) -> None:
+        text, end = self.text, self.end
+        if text.startswith('@@', self.start):
+            self.body = self.start
+        else:
+            found = text.find('\n@@', self.start, end)
+            self.body = end if found < 0 else found + 1
+        find, hunks = text.find, self.hunks
+        add_offset, add_kind = self.offsets.append, self.kinds.append
+        add_new_line, add_position = self.new_lines.append, self.positions.append
+        position, index, new_line, hunk = self.body, 0, 0, None
+        while position < end:
+            newline = find('\n', position, end)
+            if newline < 0:
+                newline = end
+            # Empty lines are context lines whose leading space was stripped
+            marker = text[position] if position < newline else ' '
+            if marker == '+' or marker == ' ':
+                add_kind(ADDED if marker == '+' else CONTEXT)
+                add_new_line(new_line)
+                add_position(index)
+                new_line += 1
+            elif marker == '-':
+                add_kind(REMOVED)
+            elif marker == '@':
+                match = HUNK_HEADER_PATTERN.match(text, position, newline)
+                if match:
+                    if hunk is not None:
+                        hunk.last = index
+                    old_start, old_length, new_start, new_length = match.groups()
+                    hunk = Hunk(int(old_start), int(old_length or 1), int(new_start), int(new_length or 1), index)
+                    hunks.append(hunk)
+                    new_line = hunk.new_start
+                add_kind(HUNK)
+            elif marker == '\\':
+                add_kind(NO_NEWLINE)
+            else:
+                add_kind(CONTEXT)
+                add_new_line(new_line)
+                add_position(index)
+                new_line += 1
+            add_offset(position)
+            index += 1
+            position = newline + 1
+        if hunk is not None:
+            hunk.last = index
+        add_offset(max(position, self.body))
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    @property
+    def changes(self) -> str:
+        """Text of the whole file diff (the same object on every call)."""
+        if self._changes is None:
+            self._changes = self.text[self.start:self.end]
+        return self._changes
+
+    @property
+    def header(self) -> str:
+        """Text before the first hunk header, without the trailing newline."""
+        if self.body < self.end:
+            return self.text[self.start:max(self.start, self.body - 1)]
+        return self.text[self.start:self.end]
+
+    def header_lines(self) -> List[str]:
+        header = self.header
+        return header.split('\n') if header else []
+
+    def line(self, index: int) -> str:
+        """Text of line `index`, marker included."""
+        return self.text[self.offsets[index]:min(self.offsets[index + 1] - 1, self.end)]
+
+    def slice(self, first: int, last: int) -> str:
+        """Text of lines `first`..`last - 1`; the final line keeps the trailing newline of the diff."""
+        if last >= len(self.kinds):
+            return self.text[self.offsets[first]:self.end]
+        return self.text[self.offsets[first]:self.offsets[last] - 1]
+
+    def lines_of(self, kind: int) -> List[str]:
+        """Texts of the lines of one kind, without their marker."""
+        text, offsets = self.text, self.offsets
+        return [
+            text[start + 1:following - 1]
+            for start, following, line_kind in zip(offsets, islice(offsets, 1, None), self.kinds) if line_kind == kind
+        ]
+
+    def added_lines(self) -> List[str]:
+        return self.lines_of(ADDED)
+
+    def removed_lines(self) -> List[str]:
+        return self.lines_of(REMOVED)
+
+    def hunk_ranges(self) -> List[Tuple[int, int]]:
+        """(start, length) of every hunk in the new file."""
+        return [(hunk.new_start, hunk.new_length) for hunk in self.hunks]
+
+    @property
+    def first_new_line(self) -> int:
+        """Line number of the first hunk in the new file (0 without hunks)."""
+        return self.hunks[0].new_start if self.hunks else 0
+
+    def position(self, start_line: int, end_line: int) -> Optional[int]:
+        """
+        GitHub diff position of the last line of `start_line`..`end_line` of the new file that is
+        a context or added line of the diff, or None. The lookup is one binary search.
+        """
+        index = bisect_right(self.new_lines, max(start_line, end_line)) - 1
+        if index < 0 or self.new_lines[index] < min(start_line, end_line):
+            return None
+        return self.positions[index]
+
+    def __getstate__(self) -> Dict:
+        # Files sent to worker processes carry their own text instead of the shared buffer
+        return {'text': self.changes, 'path': self.path}
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__init__(state['text'], path=state['path'])
+
+
+def git_header_path(header_line: str) -> str:
+    """Path of the new file from the first line of a git file diff (` a/x b/y` or `diff --git a/x b/y`)."""
+    return header_line.rsplit(' b/', 1)[-1].strip()
+
+
+def parse_file_diff(changes: str, path: Optional[str] = None) -> DiffFile:
+    """Parses the diff of one file: a git file diff with its header or a GitHub patch."""
+    if path is None and not changes.startswith('@@'):
+        path = git_header_path(changes[:changes.find('\n')] if '\n' in changes else changes)
+    return DiffFile(changes, path=path)
+
+
+def file_diff(file_data: Dict) -> DiffFile:
+    """
+    The parsed diff of a file or review piece: its 'diff', or 'changes' parsed on first use.
+    A 'diff' that does not belong to the current 'changes' (e.g. a copied dictionary with
+    new changes) is replaced.
+    """
+    diff = file_data.get('diff')
+    if diff is None or diff.changes is not file_data['changes']:
+        diff = parse_file_diff(file_data['changes'], file_data.get('filename'))
+        file_data['diff'] = diff
+    return diff
+
+
+def path_filter(languages: str = "", globs: str = "") -> Callable[[str], bool]:
+    """
+    Path predicate of comma-separated language names (see LANGUAGE_GLOBS) and path globs.
+    A path passes when it matches any of them; without languages and globs every path passes.
+
+    Raises:
+    - ValueError: When a language is unknown.
+    """
+    patterns: List[str] = [glob.strip() for glob in globs.split(',') if glob.strip()]
+    for language in (name.strip().lower() for name in languages.split(',')):
+        if not language:
+            continue
+        if language not in LANGUAGE_GLOBS:
+            raise ValueError(f"Unknown language {language}, expected one of {tuple(LANGUAGE_GLOBS)}")
+        patterns.extend(LANGUAGE_GLOBS[language])
+    if not patterns:
+        return lambda path: True
+    return lambda path: any(fnmatch.fnmatchcase(path, pattern) for pattern in patterns)
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from openai import AsyncOpenAI, OpenAI
+
+from common.az_logger.global_logger import CustomLogger
+from common.instrumentation import capture_usage, get_run_report, record_cache, stage
+from open_ai.completion import create_completion_async
+from open_ai.prompt.registry import CompiledPrompt, compile_prompt
+from review.cache import ReviewCache, make_cache_key
+from review.chunker import (
+    RequestPacker,
+    assign_review,
+    build_request_changes,
+    iter_file_pieces,
+    merge_piece_reviews,
+    piece_label,
+    piece_text,
+    restore_cached_review,
+)
+from review.router import ModelRouter, get_model_router
+from review.semantic import InFlightReviews, SemanticCache, adapt_review, get_semantic_cache, review_entry
+from review.triage import LIGHT
+from schema.completion.findings import REVIEW_RESPONSE_FORMAT
+from settings.conf import ReviewConfig, TriageConfig
+
+REVIEW_CONF = ReviewConfig()
+TRIAGE_CONF = TriageConfig()
+
+
+def as_async_client(completion_client: Union[OpenAI, AsyncOpenAI]) -> AsyncOpenAI:
+    """
+    Returns an AsyncOpenAI client bound to the current event loop.
+
+    A sync OpenAI client is converted by copying its connection settings, so callers
+    can keep passing the client they already build in app.py. The SDK's own retries are
+    disabled, because create_completion_async retries under the shared rate limiter.
+    """
+    if isinstance(completion_client, AsyncOpenAI):
+        return completion_client
+    return AsyncOpenAI(
+        api_key=completion_client.api_key,
+        organization=completion_client.organization,
+        base_url=completion_client.base_url,
+        timeout=completion_client.timeout,
+        max_retries=0,
+    )
+
+
+def _cache_key(prompt: CompiledPrompt, gpt_model: str, piece: Dict, structured: bool) -> str:
+    # Keyed by the model of the request, so first-pass and escalated reviews are cached apart
+    return make_cache_key(
+        gpt_model, prompt.system_prompt, prompt.user_template, piece_text(piece),
+        REVIEW_RESPONSE_FORMAT if structured else None
+    )
+
+
+def _semantic_namespace(prompt: CompiledPrompt, gpt_model: str, structured: bool) -> str:
+    # Reviews are only reused between requests that differ in nothing but the diff
+    return make_cache_key(
+        gpt_model, prompt.system_prompt, prompt.user_template, "", REVIEW_RESPONSE_FORMAT if structured else None
+    )
+
+
+async def _review_request(
+        pieces: List[Dict],
+        completion_client: AsyncOpenAI,
+        prompt: CompiledPrompt,
+        gpt_model: str,
+        logger: Union[logging.Logger, CustomLogger],
+        cache: Optional[ReviewCache] = None,
+        structured: bool = False,
+        context: Optional[str] = None,
+        router: Optional[ModelRouter] = None,
+        semantic: Optional[SemanticCache] = None
+) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Reviews one packed request and assigns the review to its pieces.
+
+    Returns:
+    - The pieces the router escalates to its strong model (empty without a router), and the
+      pieces the review could not be attributed to; those are not cached and must be reviewed alone.
+    """
+    filenames = ", ".join(piece_label(piece) for piece in pieces)
+    with stage("prompt_build"):
+        request_prompt = prompt.render(build_request_changes(pieces, structured))
+    try:
+        with capture_usage() as usages:
+            review = await create_completion_async(
+                completion_client,
+                system_prompt=prompt.system_prompt,
+                user_prompt=request_prompt,
+                gpt_model=gpt_model,
+                response_format=REVIEW_RESPONSE_FORMAT if structured else None,
+                context=context
+            )
+        cache_values = assign_review(pieces, review, structured)
+    except Exception as e:
+        logger.error(f"Error during GPT completion for file {filenames}: {e}")
+        return [], []
+
+    reviewed = [(piece, value) for piece, value in zip(pieces, cache_values) if value is not None]
+    unassigned = [piece for piece, value in zip(pieces, cache_values) if value is None]
+    if unassigned:
+        logger.warning(
+            f"Review of {filenames} could not be split by file, "
+            f"reviewing {', '.join(piece_label(piece) for piece in unassigned)} separately"
+        )
+        get_run_report().increment("packed_review_retries", len(unassigned))
+    if cache is not None:
+        for piece, value in reviewed:
+            await asyncio.to_thread(cache.set, _cache_key(prompt, gpt_model, piece, structured), value)
+    if semantic is not None:
+        namespace = _semantic_namespace(prompt, gpt_model, structured)
+        for piece, value in reviewed:
+            await asyncio.to_thread(semantic.add, namespace, piece, value)
+    if router is None:
+        return [], unassigned
+    router.record_request(pieces, gpt_model, usages)
+    return [piece for piece, _ in reviewed if router.needs_escalation(piece)], unassigned
+
+
+async def review_files_async(
+        files: Iterable[Dict[str, str]],
+        completion_client: Union[OpenAI, AsyncOpenAI],
+        system_prompt: str,
+        user_prompt: str,
+        gpt_model: str,
+        logger: Union[logging.Logger, CustomLogger],
+        concurrency: Optional[int] = None,
+        cache: Optional[ReviewCache] = None,
+        max_tokens: Optional[int] = None,
+        light_model: Optional[str] = None,
+        structured: Optional[bool] = None,
+        context: Optional[str] = None,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        router: Optional[ModelRouter] = None,
+        semantic: Optional[SemanticCache] = None
+) -> List[Dict[str, Optional[str]]]:
+    """
+    Reviews every file diff concurrently, with at most `concurrency` requests in flight.
+
+    File diffs larger than `max_tokens` are split at hunk boundaries, and small diffs are packed
+    together into one request up to the same budget; the review is mapped back to each file.
+
+    Args:
+    - files: Iterable of dictionaries with 'filename' and 'changes'. It is consumed lazily in a worker
+      thread, so reviews start while a streaming source is still producing later files, and no more
+      than `concurrency` requests are prepared ahead of the running reviews.
+    - completion_client: OpenAI or AsyncOpenAI client.
+    - concurrency: Maximum number of simultaneous completions (REVIEW_CONCURRENCY by default).
+    - cache: Optional review cache, looked up per piece; hits skip the completion entirely.
+    - max_tokens: Diff token budget of one request (REVIEW_MAX_REQUEST_TOKENS by default).
+    - light_model: Model for files down-tiered by review.triage (TRIAGE_LIGHT_MODEL by default);
+      without it every file is reviewed by `gpt_model`.
+    - structured: Request JSON findings (REVIEW_STRUCTURED_OUTPUT by default). The findings are
+      validated once and also rendered as markdown 'comments'.
+    - context: Context shared by every request of the run (repository, pull request description).
+      It is sent after the system prompt and before the diff, so it is part of the cached prompt
+      prefix; it is not part of the review cache key.
+    - semaphore: Limit of in-flight completions shared with other reviews running on the same event loop
+      (e.g. service.orchestrator); `concurrency` is ignored when it is given.
+    - router: Model cascade for fully reviewed pieces (review.router, configured by RouterConfig by default):
+      low-risk pieces go to the small model and are re-reviewed by the strong model when they are flagged.
+    - semantic: Embedding cache consulted after `cache` misses (review.semantic, configured by
+      SemanticCacheConfig by default); a nearly identical reviewed chunk lends its review. Pieces
+      similar to a piece already requested in this run wait for its review instead of a request.
+
+    Returns:
+    - List of the input dictionaries extended with 'comments', 'findings' and 'cached', in input order.
+      'comments' is None when the completion failed, 'findings' is None for free-text reviews.
+    """
+    concurrency = concurrency or REVIEW_CONF.REVIEW_CONCURRENCY
+    max_tokens = max_tokens or REVIEW_CONF.REVIEW_MAX_REQUEST_TOKENS
+    light_model = light_model or TRIAGE_CONF.TRIAGE_LIGHT_MODEL
+    structured = REVIEW_CONF.REVIEW_STRUCTURED_OUTPUT if structured is None else structured
+    prompt = compile_prompt(system_prompt, user_prompt)
+    router = router or get_model_router(gpt_model)
+    semantic = semantic or get_semantic_cache()
+    semaphore = semaphore or asyncio.Semaphore(concurrency)
+    # Requests are packed per model, so light files never share a request with fully reviewed ones
+    packers: Dict[str, RequestPacker] = {}
+    async_client = as_async_client(completion_client)
+    inflight = InFlightReviews(semantic) if semantic is not None else None
+    # Set when the first review of a requested piece has arrived (or failed), keyed by id(piece)
+    reviewed: Dict[int, asyncio.Event] = {}
+
+    async def worker(request: List[Dict], model: str) -> None:
+        escalated, unassigned = [], []
+        try:
+            escalated, unassigned = await _review_request(
+                request, async_client, prompt, model, logger, cache, structured, context, router, semantic
+            )
+        finally:
+            semaphore.release()
+            retried = {id(piece) for piece in unassigned}
+            for piece in request:
+                if id(piece) in reviewed and id(piece) not in retried:
+                    reviewed[id(piece)].set()
+        if unassigned:
+            await submit([[piece] for piece in unassigned], model)
+        if escalated:
+            # Flagged pieces keep their first-pass review until the strong model's review replaces it
+            logger.debug(f"Escalating {', '.join(piece_label(piece) for piece in escalated)} to {router.strong_model}")
+            await submit([escalated], router.strong_model)
+
+    async def lookup(piece: Dict, model: str) -> bool:
+        """Restores the cached or a semantically similar review of a piece; returns whether there was one."""
+        if cache is not None:
+            cached_review = await asyncio.to_thread(cache.get, _cache_key(prompt, model, piece, structured))
+            record_cache(cached_review is not None)
+            if cached_review is not None:
+                logger.debug(f"Review cache hit for file {piece_label(piece)}")
+                restore_cached_review(piece, cached_review, structured)
+                piece['cached'] = True
+                return True
+        if semantic is None:
+            return False
+        match = await asyncio.to_thread(semantic.lookup, _semantic_namespace(prompt, model, structured), piece)
+        if match is None:
+            return False
+        logger.debug(f"Semantic cache hit for file {piece_label(piece)} (similarity {match[0]:.3f})")
+        adapt_review(piece, match[1], structured)
+        piece['cached'] = True
+        return True
+
+    async def follow(piece: Dict, leader: Dict, similarity: float, model: str) -> None:
+        """Reuses the review of a similar piece of this run once it arrives."""
+        await reviewed[id(leader)].wait()
+        if leader['comments'] is None or (structured and leader.get('findings') is None):
+            await submit([[piece]], model)
+            return
+        logger.debug(f"Reusing the review of {piece_label(leader)} for {piece_label(piece)} (similarity {similarity:.3f})")
+        adapt_review(piece, review_entry(leader, structured), structured)
+        piece['cached'] = True
+        get_run_report().increment("semantic_inflight_hits")
+        if router is not None and router.needs_escalation(piece):
+            await submit([[piece]], router.strong_model)
+
+    async def submit(requests: List[List[Dict]], model: str) -> None:
+        for request in requests:
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(worker(request, model)))
+
+    pieces, tasks = [], []
+    piece_iterator = iter_file_pieces(files, max_tokens, gpt_model)
+    try:
+        # The source may block (e.g. a streaming git diff), so it is advanced in a worker thread
+        while (piece := await asyncio.to_thread(next, piece_iterator, None)) is not None:
+            pieces.append(piece)
+            piece['comments'], piece['cached'] = None, False
+            if piece['file'].get('tier') == LIGHT:
+                model = light_model or gpt_model
+            else:
+                model = router.route(piece) if router is not None else gpt_model
+            if await lookup(piece, model):
+                if router is None or not router.needs_escalation(piece):
+                    continue
+                model = router.strong_model
+                if await lookup(piece, model):
+                    continue
+            if inflight is not None:
+                namespace = _semantic_namespace(prompt, model, structured)
+                match = inflight.leader(namespace, piece)
+                if match is not None:
+                    tasks.append(asyncio.create_task(follow(piece, match[1], match[0], model)))
+                    continue
+                inflight.add(namespace, piece)
+                reviewed[id(piece)] = asyncio.Event()
+            packer = packers.setdefault(
+                model, RequestPacker(max_tokens, REVIEW_CONF.REVIEW_MAX_FILES_PER_REQUEST)
+            )
+            await submit(packer.add(piece), model)
+        for model, packer in packers.items():
+            await submit(packer.flush(), model)
+        # Escalations add tasks while the first-pass tasks finish
+        waited = 0
+        while waited < len(tasks):
+            batch, waited = tasks[waited:], len(tasks)
+            await asyncio.gather(*batch)
+    finally:
+        if async_client is not completion_client:
+            await async_client.close()
+        if semantic is not None:
+            await asyncio.to_thread(semantic.flush)
+
+    if router is not None:
+        router.finish(pieces)
+    return merge_piece_reviews(pieces)
+
+
+def review_files(
+        files: Iterable[Dict[str, str]],
+        completion_client: Union[OpenAI, AsyncOpenAI],
+        system_prompt: str,
+        user_prompt: str,
+        gpt_model: str,
+        logger: Union[logging.Logger, CustomLogger],
+        concurrency: Optional[int] = None,
+        cache: Optional[ReviewCache] = None,
+        max_tokens: Optional[int] = None,
+        light_model: Optional[str] = None,
+        structured: Optional[bool] = None,
+        context: Optional[str] = None
+) -> List[Dict[str, Optional[str]]]:
+    """
+    Synchronous entry point for review_files_async, used by the local and GitHub reviewers.
+    """
+    return asyncio.run(
+        review_files_async(
+            files, completion_client, system_prompt, user_prompt, gpt_model, logger, concurrency, cache, max_tokens,
+            light_model, structured, context
+        )
+    )
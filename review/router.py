@@ -0,0 +1,166 @@
+import json
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from common.instrumentation import get_run_report
+from review.chunker import piece_label
+from review.symbols import CALL_SITES_HEADER
+from review.diff import file_diff
+from review.triage import matches_any, parse_globs
+from schema.completion.findings import Severity
+from settings.conf import RouterConfig
+
+SMALL = "small"
+STRONG = "strong"
+
+# Weights of the risk signals; every signal is in 0..1, so the score is too
+RISK_WEIGHTS = {
+    "size": 0.25,
+    "churn": 0.15,
+    "risky_calls": 0.2,
+    "sensitive_names": 0.15,
+    "public_api": 0.1,
+    "risky_path": 0.1,
+    "callers": 0.05,
+}
+RISKY_CALL_PATTERN = re.compile(
+    r'\b(?:eval|exec|pickle\.loads?|marshal\.loads|yaml\.load|subprocess\.\w+|os\.system|os\.popen'
+    r'|execute(?:many)?|requests\.\w+|urlopen|hashlib\.\w+|hmac\.\w+|jwt\.\w+|random\.\w+'
+    r'|threading\.\w+|multiprocessing\.\w+|asyncio\.\w+|setattr|__import__|importlib\.\w+)\s*\('
+    r'|\bshell\s*=\s*True|\bverify\s*=\s*False'
+)
+SENSITIVE_NAME_PATTERN = re.compile(r'password|passwd|secret|token|api_?key|credential|private_?key|permission', re.I)
+PUBLIC_DEFINITION_PATTERN = re.compile(r'^\s*(?:async\s+def|def|class)\s+(?!_)\w+')
+
+
+@lru_cache(maxsize=8)
+def parse_prices(prices: str) -> Dict[str, Tuple[float, float]]:
+    """Parses 'model=input/output,...' (USD per million tokens)."""
+    result = {}
+    for item in prices.split(','):
+        if '=' not in item:
+            continue
+        model, price = item.split('=', 1)
+        input_price, output_price = price.split('/', 1)
+        result[model.strip()] = (float(input_price), float(output_price))
+    return result
+
+
+def risk_signals(piece: Dict, config: RouterConfig) -> Dict[str, float]:
+    """
+    Static risk signals of a diff piece, each in 0..1.
+
+    - size: changed lines, saturating at ROUTER_SIZE_LINES.
+    - churn: share of removed lines; rewriting existing code is riskier than adding new code.
+    - risky_calls: calls of process, network, serialization, crypto and concurrency APIs.
+    - sensitive_names: passwords, tokens, keys or permissions in the changed lines.
+    - public_api: a public function or class definition was changed or removed.
+    - risky_path: the path matches ROUTER_RISKY_GLOBS.
+    - callers: the symbol index found call sites of the changed functions in other files.
+    """
+    diff = file_diff(piece)
+    removed, added = diff.removed_lines(), diff.added_lines()
+    changed = removed + added
+    calls = sum(len(RISKY_CALL_PATTERN.findall(line)) for line in changed)
+    return {
+        "size": min(len(changed) / config.ROUTER_SIZE_LINES, 1.0),
+        "churn": len(removed) / len(changed) if changed else 0.0,
+        "risky_calls": min(calls / 3, 1.0),
+        "sensitive_names": float(any(SENSITIVE_NAME_PATTERN.search(line) for line in changed)),
+        "public_api": float(any(PUBLIC_DEFINITION_PATTERN.match(line) for line in removed)),
+        "risky_path": float(matches_any(piece['filename'], parse_globs(config.ROUTER_RISKY_GLOBS))),
+        "callers": float(CALL_SITES_HEADER in (piece.get('context') or "")),
+    }
+
+
+class ModelRouter:
+    """
+    Cascade of a small and a strong model.
+
+    Every piece is scored by risk_signals. Pieces scoring at least ROUTER_STRONG_SCORE are reviewed
+    by the strong model; the others by the small model, and are escalated to the strong model when
+    the first pass reports findings of ROUTER_ESCALATE_SEVERITIES (structured reviews only).
+    The decision, the models used and their token cost are kept in piece['route'] and written
+    to ROUTER_LOG_PATH by `finish`, one JSON line per piece, so thresholds and weights can be tuned.
+    """
+
+    def __init__(self, small_model: str, strong_model: str, config: Optional[RouterConfig] = None):
+        self.config = config or RouterConfig()
+        self.small_model = small_model
+        self.strong_model = strong_model
+        self.escalate_severities = {
+            Severity(value.strip()) for value in self.config.ROUTER_ESCALATE_SEVERITIES.split(',') if value.strip()
+        }
+        self.prices = parse_prices(self.config.ROUTER_MODEL_PRICES)
+        self._lock = threading.Lock()
+
+    def route(self, piece: Dict) -> str:
+        """Scores a piece, records the decision in piece['route'] and returns the first-pass model."""
+        signals = risk_signals(piece, self.config)
+        score = round(sum(RISK_WEIGHTS[name] * value for name, value in signals.items()), 4)
+        decision = STRONG if score >= self.config.ROUTER_STRONG_SCORE else SMALL
+        piece['route'] = {
+            'file': piece_label(piece), 'score': score, 'signals': signals, 'route': decision,
+            'escalated': False, 'models': [], 'prompt_tokens': 0, 'completion_tokens': 0, 'cost': 0.0,
+        }
+        return self.strong_model if decision == STRONG else self.small_model
+
+    def needs_escalation(self, piece: Dict) -> bool:
+        """
+        Whether the small-model review of a piece flagged issues that need a second opinion.
+        Marks the piece as escalated, so it is escalated at most once.
+        """
+        route = piece.get('route')
+        if route is None or route['route'] == STRONG or route['escalated'] or piece.get('comments') is None:
+            return False
+        if not any(finding.severity in self.escalate_severities for finding in piece.get('findings') or []):
+            return False
+        route['escalated'] = True
+        return True
+
+    def cost(self, gpt_model: str, usage: Any) -> float:
+        input_price, output_price = self.prices.get(gpt_model, (0.0, 0.0))
+        return ((usage.prompt_tokens or 0) * input_price + (usage.completion_tokens or 0) * output_price) / 1e6
+
+    def record_request(self, pieces: List[Dict], gpt_model: str, usages: List[Tuple[str, Any]]) -> None:
+        """Attributes the usage of one (packed) request to its pieces in proportion to their tokens."""
+        total = sum(piece['tokens'] for piece in pieces) or 1
+        for piece in pieces:
+            route = piece.get('route')
+            if route is None:
+                continue
+            share = piece['tokens'] / total
+            route['models'].append(gpt_model)
+            for model, usage in usages:
+                route['prompt_tokens'] += round((usage.prompt_tokens or 0) * share)
+                route['completion_tokens'] += round((usage.completion_tokens or 0) * share)
+                route['cost'] += self.cost(model, usage) * share
+
+    def finish(self, pieces: List[Dict]) -> None:
+        """Adds the decisions to the run report counters and appends them to ROUTER_LOG_PATH."""
+        decisions = [piece['route'] for piece in pieces if 'route' in piece]
+        if not decisions:
+            return
+        report = get_run_report()
+        for decision in decisions:
+            report.increment(f"route_{decision['route']}")
+            report.increment("route_escalated", int(decision['escalated']))
+        report.increment("route_cost_microusd", round(sum(decision['cost'] for decision in decisions) * 1e6))
+        if not self.config.ROUTER_LOG_PATH:
+            return
+        with self._lock, open(self.config.ROUTER_LOG_PATH, 'a') as f:
+            for decision in decisions:
+                f.write(json.dumps({**decision, 'run_id': report.run_id, 'cost': round(decision['cost'], 8)}) + '\n')
+
+
+def get_model_router(gpt_model: str, config: Optional[RouterConfig] = None) -> Optional[ModelRouter]:
+    """
+    Creates the router for a run whose default model is `gpt_model`, or None when
+    ROUTER_STRONG_MODEL is not configured.
+    """
+    config = config or RouterConfig()
+    if not config.ROUTER_STRONG_MODEL:
+        return None
+    return ModelRouter(config.ROUTER_SMALL_MODEL or gpt_model, config.ROUTER_STRONG_MODEL, config)
@@ -0,0 +1,410 @@
+"""
+Semantic review cache: reuses the review of a previously reviewed diff chunk that is nearly
+identical to the current one (the same refactor applied to many files, copy-pasted handlers),
+where the exact content-addressed cache of review.cache misses.
+
+Chunks are embedded, and the nearest stored chunk of the same namespace (model, prompts and
+output format) is looked up in a vector index. Above SEMANTIC_CACHE_THRESHOLD its review is
+reused; structured findings are moved to the current file and shifted by the line offset
+between the two chunks.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from common.instrumentation import get_run_report
+from review.cache import normalize_diff
+from review.diff import file_diff
+from schema.completion.findings import dump_findings, load_findings, render_findings
+from settings.conf import RedisConfig, SemanticCacheConfig
+
+if TYPE_CHECKING:
+    # numpy is imported by the backends on first use, so a disabled semantic cache costs no import time
+    import numpy as np
+
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+FILE_HEADER_PREFIXES = ('diff --git', '--- ', '+++ ', 'new file mode', 'deleted file mode', 'similarity index',
+                        'rename from', 'rename to', 'old mode', 'new mode')
+# Unchanged context lines say less about the change than the added and removed ones
+CONTEXT_LINE_WEIGHT = 0.1
+# Weight of the whole-line feature: chunks sharing a template but not the literal changes stay apart
+LINE_FEATURE_WEIGHT = 6.0
+
+Entry = Dict[str, object]
+
+
+def embedding_text(changes: str) -> str:
+    """
+    The part of a diff chunk that is embedded: hunk bodies without file names, hunk line numbers
+    and index lines, so the same change in another file or at another position looks the same.
+    """
+    lines, in_header = [], True
+    for line in normalize_diff(changes).split('\n'):
+        if in_header and line.startswith(FILE_HEADER_PREFIXES):
+            continue
+        if line.startswith('@@'):
+            in_header = False
+            # Keep the enclosing definition GitHub and git print after the second @@
+            line = '@@' + line.split('@@', 2)[-1] if line.count('@@') >= 2 else '@@'
+        lines.append(line)
+    return '\n'.join(lines).strip('\n')
+
+
+class Embedder(ABC):
+    """Interface of a chunk embedder; rows of the result are L2-normalized float32 vectors."""
+    name: str
+    dimensions: int
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        ...
+
+
+class HashingEmbedder(Embedder):
+    """
+    Local embedder without API calls: signed feature hashing of the token unigrams, bigrams and
+    the whole token sequence of every line, prefixed with the line marker (+, - or context).
+    Near-identical hunks get nearly identical vectors, which is what the cache needs; it does
+    not capture meaning.
+    """
+
+    def __init__(self, dimensions: int):
+        self.name = "hashing"
+        self.dimensions = dimensions
+
+    def _embed_one(self, text: str) -> "np.ndarray":
+        import numpy as np
+
+        buckets, weights = [], []
+        for line in text.split('\n'):
+            marker = line[:1] if line[:1] in '+-' else ' '
+            weight = 1.0 if marker != ' ' else CONTEXT_LINE_WEIGHT
+            tokens = TOKEN_PATTERN.findall(line[1:] if marker != ' ' else line)
+            features = [(marker + token, weight) for token in tokens]
+            features += [(f"{marker}{first} {second}", weight) for first, second in zip(tokens, tokens[1:])]
+            features.append((f"{marker}{' '.join(tokens)}", weight * LINE_FEATURE_WEIGHT))
+            for feature, feature_weight in features:
+                digest = zlib.crc32(feature.encode('utf-8'))
+                buckets.append(digest % self.dimensions)
+                weights.append(feature_weight if digest & 0x80000000 else -feature_weight)
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        np.add.at(vector, np.asarray(buckets, dtype=np.int64), np.asarray(weights, dtype=np.float32))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        import numpy as np
+
+        return np.stack([self._embed_one(text) for text in texts]) if texts \
+            else np.zeros((0, self.dimensions), dtype=np.float32)
+
+
+class OpenAIEmbedder(Embedder):
+    """Embeddings of the OpenAI API (e.g. text-embedding-3-small), shortened to `dimensions`."""
+
+    def __init__(self, client: OpenAI, model: str, dimensions: int):
+        self.client = client
+        self.model = model
+        self.name = f"openai:{model}"
+        self.dimensions = dimensions
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        import numpy as np
+
+        response = self.client.embeddings.create(model=self.model, input=texts, dimensions=self.dimensions)
+        vectors = np.asarray([item.embedding for item in response.data], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class VectorIndex(ABC):
+    """Interface of a vector index backend of the semantic cache."""
+
+    @abstractmethod
+    def search(self, namespace: str, vector: "np.ndarray") -> Optional[Tuple[float, Entry]]:
+        """Returns the cosine similarity and entry of the nearest vector of `namespace`, or None."""
+
+    @abstractmethod
+    def add(self, namespace: str, vector: "np.ndarray", entry: Entry) -> None:
+        ...
+
+    def flush(self) -> None:
+        """Persists the additions (no-op for backends that write through)."""
+
+
+class NumpyVectorIndex(VectorIndex):
+    """
+    In-process index: one float32 matrix searched with a single matrix-vector product.
+
+    Vectors and namespaces are saved to an .npz file and the entries to a JSON file next to it,
+    both replaced atomically by `flush` (without a `path` the index lives in memory only).
+    When the index is full, the oldest tenth is dropped. Thread-safe; processes that share
+    a path keep the entries of the last one to flush.
+    """
+
+    def __init__(self, path: Optional[str], dimensions: int, max_entries: int):
+        import numpy as np
+
+        self.path = path
+        self.entries_path = os.path.splitext(path)[0] + ".json" if path else None
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self._namespaces = np.zeros(0, dtype='S64')
+        self._entries: List[Entry] = []
+        self._size = 0
+        self._dirty = False
+        self._load()
+
+    def _load(self) -> None:
+        import numpy as np
+
+        if not (self.path and os.path.exists(self.path) and os.path.exists(self.entries_path)):
+            return
+        with np.load(self.path) as data:
+            vectors, namespaces = data['vectors'], data['namespaces']
+        with open(self.entries_path) as f:
+            entries = json.load(f)
+        # Files of another embedding size or of an interrupted write are ignored
+        if vectors.shape[1:] != (self.dimensions,) or len(vectors) != len(entries) or len(namespaces) != len(entries):
+            return
+        self._vectors, self._namespaces, self._entries = vectors, namespaces, entries
+        self._size = len(entries)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def search(self, namespace: str, vector: "np.ndarray") -> Optional[Tuple[float, Entry]]:
+        import numpy as np
+
+        with self._lock:
+            if not self._size:
+                return None
+            candidates = np.flatnonzero(self._namespaces[:self._size] == namespace.encode())
+            if not len(candidates):
+                return None
+            scores = self._vectors[candidates] @ vector
+            best = int(np.argmax(scores))
+            return float(scores[best]), self._entries[candidates[best]]
+
+    def add(self, namespace: str, vector: "np.ndarray", entry: Entry) -> None:
+        import numpy as np
+
+        with self._lock:
+            if self._size >= self.max_entries:
+                keep = self._size - max(1, self.max_entries // 10)
+                self._vectors[:keep] = self._vectors[self._size - keep:self._size]
+                self._namespaces[:keep] = self._namespaces[self._size - keep:self._size]
+                self._entries = self._entries[self._size - keep:]
+                self._size = keep
+            if self._size == len(self._vectors):
+                # Capacity doubles, so appends are amortized O(1)
+                capacity = min(max(64, self._size * 2), self.max_entries)
+                vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+                namespaces = np.zeros(capacity, dtype='S64')
+                vectors[:self._size] = self._vectors[:self._size]
+                namespaces[:self._size] = self._namespaces[:self._size]
+                self._vectors, self._namespaces = vectors, namespaces
+            self._vectors[self._size] = vector
+            self._namespaces[self._size] = namespace.encode()
+            self._entries.append(entry)
+            self._size += 1
+            self._dirty = True
+
+    def flush(self) -> None:
+        import numpy as np
+
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            vectors, namespaces = self._vectors[:self._size].copy(), self._namespaces[:self._size].copy()
+            entries = list(self._entries)
+            self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", 'wb') as f:
+            np.savez(f, vectors=vectors, namespaces=namespaces)
+        with open(self.entries_path + ".tmp", 'w') as f:
+            json.dump(entries, f)
+        os.replace(self.path + ".tmp", self.path)
+        os.replace(self.entries_path + ".tmp", self.entries_path)
+
+
+class RedisVectorIndex(VectorIndex):
+    """
+    Index in Redis Stack through redisvl (>= 0.3.2): a FLAT cosine vector field with a namespace
+    tag filter, so several reviewer instances share one index. Entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, redis_config: RedisConfig, index_name: str, dimensions: int, ttl: int):
+        from redisvl.index import SearchIndex
+
+        self.ttl = ttl
+        schema = {
+            "index": {"name": index_name, "prefix": f"{index_name}:", "storage_type": "hash"},
+            "fields": [
+                {"name": "namespace", "type": "tag"},
+                {"name": "embedding", "type": "vector",
+                 "attrs": {"dims": dimensions, "distance_metric": "cosine", "algorithm": "flat", "datatype": "float32"}},
+            ],
+        }
+        self._index = SearchIndex.from_dict(
+            schema,
+            redis_url=f"redis://{redis_config.REDIS_HOST}:{redis_config.REDIS_PORT}/{redis_config.REDIS_DB}"
+        )
+        self._index.create(overwrite=False)
+
+    def search(self, namespace: str, vector: "np.ndarray") -> Optional[Tuple[float, Entry]]:
+        from redisvl.query import VectorQuery
+        from redisvl.query.filter import Tag
+
+        query = VectorQuery(
+            vector=vector.tolist(), vector_field_name="embedding", return_fields=["value", "first_line"],
+            filter_expression=Tag("namespace") == namespace, num_results=1
+        )
+        results = self._index.query(query)
+        if not results:
+            return None
+        # Cosine distance of RediSearch is 1 - similarity
+        return 1.0 - float(results[0]['vector_distance']), {
+            'value': results[0]['value'], 'first_line': int(results[0]['first_line'])
+        }
+
+    def add(self, namespace: str, vector: "np.ndarray", entry: Entry) -> None:
+        import numpy as np
+
+        self._index.load([{
+            'namespace': namespace, 'embedding': vector.astype(np.float32).tobytes(),
+            'value': entry['value'], 'first_line': entry['first_line'],
+        }], ttl=self.ttl)
+
+
+class SemanticCache:
+    """
+    Embedding lookup in front of the completions of review.engine.
+
+    Every piece is embedded once (the vector is kept in piece['embedding'] until the piece is added).
+    Namespaces also include the embedder, so vectors of different embedders are never compared.
+    """
+
+    def __init__(self, embedder: Embedder, index: VectorIndex, threshold: float):
+        self.embedder = embedder
+        self.index = index
+        self.threshold = threshold
+
+    def _namespace(self, namespace: str) -> str:
+        return hashlib.sha256(f"{self.embedder.name}\0{namespace}".encode()).hexdigest()
+
+    def vector(self, piece: Dict) -> "np.ndarray":
+        if 'embedding' not in piece:
+            piece['embedding'] = self.embedder.embed([embedding_text(piece['changes'])])[0]
+        return piece['embedding']
+
+    def lookup(self, namespace: str, piece: Dict) -> Optional[Tuple[float, Entry]]:
+        """Returns the similarity and entry of the nearest reviewed chunk when it passes the threshold."""
+        match = self.index.search(self._namespace(namespace), self.vector(piece))
+        hit = match is not None and match[0] >= self.threshold
+        get_run_report().increment("semantic_hits" if hit else "semantic_misses")
+        return match if hit else None
+
+    def add(self, namespace: str, piece: Dict, value: str) -> None:
+        """Stores the review value (review.chunker.assign_review) of a freshly reviewed piece."""
+        self.index.add(self._namespace(namespace), self.vector(piece), {'value': value, 'first_line': file_diff(piece).first_new_line})
+        piece.pop('embedding', None)
+
+    def flush(self) -> None:
+        self.index.flush()
+
+
+class InFlightReviews:
+    """
+    Pieces of the current run whose review has been requested but may not have arrived yet.
+    A piece similar to one of them waits for that review instead of sending its own request,
+    so the same change repeated across the files of one run costs one completion.
+    """
+
+    def __init__(self, cache: SemanticCache):
+        self.cache = cache
+        self._index = NumpyVectorIndex(None, cache.embedder.dimensions, max_entries=1 << 31)
+        self._pieces: List[Dict] = []
+
+    def leader(self, namespace: str, piece: Dict) -> Optional[Tuple[float, Dict]]:
+        """The similarity and the requested piece most similar to `piece` above the threshold, or None."""
+        match = self._index.search(namespace, self.cache.vector(piece))
+        if match is None or match[0] < self.cache.threshold:
+            return None
+        return match[0], self._pieces[int(match[1]['piece'])]
+
+    def add(self, namespace: str, piece: Dict) -> None:
+        self._index.add(namespace, self.cache.vector(piece), {'piece': len(self._pieces)})
+        self._pieces.append(piece)
+
+
+def review_entry(piece: Dict, structured: bool) -> Entry:
+    """The semantic cache entry of a reviewed piece, as stored by SemanticCache.add."""
+    value = dump_findings(piece['findings']) if structured else piece['comments']
+    return {'value': value, 'first_line': file_diff(piece).first_new_line}
+
+
+def adapt_review(piece: Dict, entry: Entry, structured: bool) -> None:
+    """
+    Assigns a stored review to a similar piece. Structured findings are moved to the piece's
+    file and shifted by the offset between the first hunks of the two chunks.
+    """
+    if not structured:
+        piece['comments'] = entry['value']
+        return
+    shift = file_diff(piece).first_new_line - int(entry['first_line'])
+    findings = load_findings(str(entry['value']))
+    for finding in findings:
+        finding.file = piece['filename']
+        finding.start_line = max(1, finding.start_line + shift)
+        finding.end_line = max(finding.start_line, finding.end_line + shift)
+    piece['findings'], piece['comments'] = findings, render_findings(findings)
+
+
+@lru_cache(maxsize=4)
+def _numpy_index(path: str, dimensions: int, max_entries: int) -> NumpyVectorIndex:
+    # One index per file and process, shared by every review of the process
+    return NumpyVectorIndex(path, dimensions, max_entries)
+
+
+def get_semantic_cache(
+        config: Optional[SemanticCacheConfig] = None,
+        client: Optional[OpenAI] = None
+) -> Optional[SemanticCache]:
+    """
+    Creates the semantic cache selected by SEMANTIC_CACHE_BACKEND, or None when it is disabled.
+
+    Args:
+    - config: Semantic cache settings.
+    - client: OpenAI client of the 'openai' embedder (built from OPENAI_API_KEY by default).
+    """
+    config = config or SemanticCacheConfig()
+    backend = config.SEMANTIC_CACHE_BACKEND.lower()
+    if backend == "numpy":
+        index = _numpy_index(
+            config.SEMANTIC_CACHE_PATH, config.SEMANTIC_CACHE_DIMENSIONS, config.SEMANTIC_CACHE_MAX_ENTRIES
+        )
+    elif backend == "redis":
+        index = RedisVectorIndex(
+            RedisConfig(), config.SEMANTIC_CACHE_INDEX_NAME, config.SEMANTIC_CACHE_DIMENSIONS, config.SEMANTIC_CACHE_TTL
+        )
+    else:
+        return None
+    if config.SEMANTIC_CACHE_EMBEDDER.lower() == "openai":
+        embedder = OpenAIEmbedder(
+            client or OpenAI(api_key=os.getenv("OPENAI_API_KEY")),
+            config.SEMANTIC_CACHE_EMBEDDING_MODEL, config.SEMANTIC_CACHE_DIMENSIONS
+        )
+    else:
+        embedder = HashingEmbedder(config.SEMANTIC_CACHE_DIMENSIONS)
+    return SemanticCache(embedder, index, config.SEMANTIC_CACHE_THRESHOLD)
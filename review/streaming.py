@@ -0,0 +1,259 @@
+"""
+Streaming review mode: reviews are written to the output file while their tokens arrive.
+
+Like review.engine, streaming mode honours the triage tiers (light files go to
+TRIAGE_LIGHT_MODEL), looks pieces up in the review cache before requesting them and stores
+the finished reviews in it, and returns per-file results for the review history.
+
+Features that need a complete review before anything is written are not available here:
+- Requests are not packed.
+- The model cascade (review.router) is not used, because escalation needs the full first-pass review.
+- Reviews are free text; structured findings (REVIEW_STRUCTURED_OUTPUT) are not requested.
+- The semantic cache (review.semantic) is not used.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Callable, Dict, IO, Iterable, List, Optional, Tuple, Union
+
+from openai import AsyncOpenAI, OpenAI
+
+from common.az_logger.global_logger import CustomLogger
+from common.instrumentation import record_cache
+from open_ai.completion import create_completion_stream_async
+from open_ai.prompt.registry import compile_prompt
+from review.cache import ReviewCache, make_cache_key
+from review.chunker import iter_file_pieces, merge_piece_reviews, piece_label, piece_text
+from review.engine import REVIEW_CONF, TRIAGE_CONF, as_async_client
+from review.triage import LIGHT
+
+
+class ReviewCheckpoint:
+    """
+    Append-only JSONL journal of finished piece reviews.
+
+    Every finished piece is appended and fsynced at once, so after a crash a restart replays
+    the finished pieces from the journal and only reviews the unfinished ones.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line may be cut off by the crash
+                        continue
+                    self.entries[entry["key"]] = entry["comments"]
+        self._file: Optional[IO] = None
+
+    def append(self, key: str, comments: str) -> None:
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(json.dumps({"key": key, "comments": comments}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.entries[key] = comments
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class OrderedStreamWriter:
+    """
+    Writes streamed reviews to the output file in file order.
+
+    The review at the head of the order is written to the file as its tokens arrive; the output
+    of reviews running ahead is buffered and flushed as soon as everything before it is finished.
+    """
+
+    def __init__(self, output: IO):
+        self.output = output
+        self._slots: List[Dict] = []
+        self._head = 0
+
+    def open_slot(self, prefix: str, suffix: str) -> int:
+        """
+        Registers the next review in order.
+        `prefix` is written before its first text and `suffix` after it, only when it produced text.
+        """
+        self._slots.append({"prefix": prefix, "suffix": suffix, "buffer": [], "started": False, "finished": False})
+        self._advance()
+        return len(self._slots) - 1
+
+    def write(self, index: int, text: str) -> None:
+        slot = self._slots[index]
+        if not slot["started"]:
+            slot["started"] = True
+            text = slot["prefix"] + text
+        if index == self._head:
+            self.output.write(text)
+            self.output.flush()
+        else:
+            slot["buffer"].append(text)
+
+    def finish(self, index: int) -> None:
+        slot = self._slots[index]
+        if slot["started"]:
+            self.write(index, slot["suffix"])
+        slot["finished"] = True
+        self._advance()
+
+    def _advance(self) -> None:
+        while self._head < len(self._slots):
+            slot = self._slots[self._head]
+            if slot["buffer"]:
+                self.output.write("".join(slot["buffer"]))
+                self.output.flush()
+                slot["buffer"].clear()
+            if not slot["finished"]:
+                return
+            self._head += 1
+
+
+async def stream_review_files_async(
+        files: Iterable[Dict[str, str]],
+        completion_client: Union[OpenAI, AsyncOpenAI],
+        system_prompt: str,
+        user_prompt: str,
+        gpt_model: str,
+        logger: Union[logging.Logger, CustomLogger],
+        output_file: str,
+        checkpoint_file: str,
+        format_header: Callable[[Dict[str, str]], str],
+        concurrency: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        context: Optional[str] = None,
+        cache: Optional[ReviewCache] = None,
+        light_model: Optional[str] = None
+) -> Tuple[bool, List[Dict[str, Optional[str]]]]:
+    """
+    Reviews file diffs with streaming completions and writes every review to `output_file`
+    while its tokens arrive.
+
+    Each piece (a file or a hunk-aligned part of an oversized file) is streamed as its own request,
+    so packing is not used in this mode. Finished pieces are journaled in `checkpoint_file`;
+    a restart replays them and resumes from the first unfinished piece. The checkpoint is removed
+    once every piece has finished.
+
+    Args:
+    - format_header: Builds the header written before the review of a file.
+    - context: Context shared by every request of the run, sent before the diff.
+    - cache: Optional review cache; a hit is written at once instead of being requested.
+      Entries are shared with review.engine's free-text reviews.
+    - light_model: Model for files down-tiered by review.triage (TRIAGE_LIGHT_MODEL by default).
+
+    Returns:
+    - Whether every piece was reviewed, and the per-file results of review.engine.review_files
+      ('findings' is always None).
+    """
+    concurrency = concurrency or REVIEW_CONF.REVIEW_CONCURRENCY
+    max_tokens = max_tokens or REVIEW_CONF.REVIEW_MAX_REQUEST_TOKENS
+    light_model = light_model or TRIAGE_CONF.TRIAGE_LIGHT_MODEL
+    prompt = compile_prompt(system_prompt, user_prompt)
+    semaphore = asyncio.Semaphore(concurrency)
+    checkpoint = ReviewCheckpoint(checkpoint_file)
+    async_client = as_async_client(completion_client)
+    failed = []
+
+    async def worker(piece: Dict, key: str, index: int, model: str) -> None:
+        parts = []
+        try:
+            async for delta in create_completion_stream_async(
+                    async_client, system_prompt=prompt.system_prompt,
+                    user_prompt=prompt.render(piece_text(piece)), gpt_model=model, context=context
+            ):
+                parts.append(delta)
+                writer.write(index, delta)
+            piece['comments'] = "".join(parts)
+            checkpoint.append(key, piece['comments'])
+            if cache is not None:
+                await asyncio.to_thread(cache.set, key, piece['comments'])
+        except Exception as e:
+            logger.error(f"Error during GPT completion for file {piece_label(piece)}: {e}")
+            failed.append(piece)
+            if parts:
+                writer.write(index, f"\n\n[Review interrupted: {e}]")
+        finally:
+            writer.finish(index)
+            semaphore.release()
+
+    def replay(piece: Dict, index: int, comments: str) -> None:
+        piece['comments'], piece['cached'] = comments, True
+        writer.write(index, comments)
+        writer.finish(index)
+
+    piece_iterator = iter_file_pieces(files, max_tokens, gpt_model)
+    pieces, tasks = [], []
+    with open(output_file, 'w') as output:
+        writer = OrderedStreamWriter(output)
+        try:
+            while (piece := await asyncio.to_thread(next, piece_iterator, None)) is not None:
+                pieces.append(piece)
+                piece['comments'], piece['cached'] = None, False
+                prefix = format_header(piece['file']) if piece['part'] == 1 else "\n\n"
+                suffix = "\n\n" if piece['part'] == piece['parts'] else ""
+                index = writer.open_slot(prefix, suffix)
+                model = gpt_model
+                if piece['file'].get('tier') == LIGHT:
+                    model = light_model or gpt_model
+                # The key of review.engine's free-text reviews, so both modes share the review cache
+                key = make_cache_key(model, prompt.system_prompt, prompt.user_template, piece_text(piece))
+                if key in checkpoint.entries:
+                    replay(piece, index, checkpoint.entries[key])
+                    continue
+                if cache is not None:
+                    cached_review = await asyncio.to_thread(cache.get, key)
+                    record_cache(cached_review is not None)
+                    if cached_review is not None:
+                        replay(piece, index, cached_review)
+                        continue
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(worker(piece, key, index, model)))
+            await asyncio.gather(*tasks)
+        finally:
+            checkpoint.close()
+            if async_client is not completion_client:
+                await async_client.close()
+
+    if not failed:
+        checkpoint.remove()
+    return not failed, merge_piece_reviews(pieces)
+
+
+def stream_review_files(
+        files: Iterable[Dict[str, str]],
+        completion_client: Union[OpenAI, AsyncOpenAI],
+        system_prompt: str,
+        user_prompt: str,
+        gpt_model: str,
+        logger: Union[logging.Logger, CustomLogger],
+        output_file: str,
+        checkpoint_file: str,
+        format_header: Callable[[Dict[str, str]], str],
+        concurrency: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        context: Optional[str] = None,
+        cache: Optional[ReviewCache] = None,
+        light_model: Optional[str] = None
+) -> Tuple[bool, List[Dict[str, Optional[str]]]]:
+    """
+    Synchronous entry point for stream_review_files_async.
+    """
+    return asyncio.run(
+        stream_review_files_async(
+            files, completion_client, system_prompt, user_prompt, gpt_model, logger, output_file,
+            checkpoint_file, format_header, concurrency, max_tokens, context, cache, light_model
+        )
+    )
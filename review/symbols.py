@@ -0,0 +1,554 @@
+import ast
+import os
+import posixpath
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from common.instrumentation import get_run_report, stage
+from open_ai.tokens import count_tokens
+from review.diff import file_diff
+
+# Returns the content of a file version by its git blob id
+BlobReader = Callable[[str], bytes]
+
+MAX_SIGNATURE_LENGTH = 300
+CALL_SITES_HEADER = "Call sites of the changed functions:"
+MAX_CALLERS = 5
+
+
+def _module_name(path: str) -> str:
+    module = path[:-len('.py')].replace('/', '.')
+    return module[:-len('.__init__')] if module.endswith('.__init__') else module
+
+
+def _resolve_module(path: str, module: Optional[str], level: int) -> str:
+    """Absolute dotted name of a (possibly relative) `from ... import` of the file at `path`."""
+    if not level:
+        return module or ""
+    package = _module_name(path).split('.')
+    if not path.endswith('__init__.py'):
+        package = package[:-1]
+    package = package[:len(package) - (level - 1)] if level > 1 else package
+    return '.'.join(part for part in package + [module or ""] if part)
+
+
+class _SymbolVisitor(ast.NodeVisitor):
+    def __init__(self, path: str, lines: List[str]):
+        self.path = path
+        self.lines = lines
+        self.definitions: List[Tuple] = []
+        self.imports: List[Tuple[str, str, Optional[str]]] = []
+        self.calls: List[Tuple[str, int]] = []
+        self._scope: List[str] = []
+
+    def _signature(self, node: ast.AST) -> str:
+        start = node.lineno
+        end = node.body[0].lineno - 1 if node.body[0].lineno > start else start
+        signature = " ".join(line.strip() for line in self.lines[start - 1:end])
+        docstring = ast.get_docstring(node, clean=True)
+        if docstring:
+            signature += f"  # {docstring.splitlines()[0]}"
+        return signature[:MAX_SIGNATURE_LENGTH]
+
+    def _definition(self, node: ast.AST, kind: str) -> None:
+        start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+        qualname = '.'.join(self._scope + [node.name])
+        self.definitions.append((node.name, qualname, kind, start, node.end_lineno, self._signature(node)))
+        self._scope.append(node.name)
+        self.generic_visit(node)
+        self._scope.pop()
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        self._definition(node, "class")
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> None:
+        self._definition(node, "function")
+
+    def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef) -> None:
+        self._definition(node, "function")
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            if alias.asname:
+                self.imports.append((alias.asname, alias.name, None))
+            else:
+                self.imports.append((alias.name.split('.')[0], alias.name.split('.')[0], None))
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        module = _resolve_module(self.path, node.module, node.level)
+        for alias in node.names:
+            if alias.name != '*':
+                self.imports.append((alias.asname or alias.name, module, alias.name))
+
+    def visit_Call(self, node: ast.Call) -> None:
+        if isinstance(node.func, ast.Name):
+            self.calls.append((node.func.id, node.lineno))
+        elif isinstance(node.func, ast.Attribute):
+            self.calls.append((node.func.attr, node.lineno))
+        self.generic_visit(node)
+
+
+def extract_symbols(path: str, source: str) -> Optional[Dict[str, List[Tuple]]]:
+    """
+    Extracts the definitions, imports and call sites of a Python module.
+
+    Returns:
+    - Dictionary with 'definitions' (name, qualname, kind, start line, end line, signature),
+      'imports' (bound name, module, imported name) and 'calls' (called name, line),
+      or None when the source does not parse.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    visitor = _SymbolVisitor(path, source.split('\n'))
+    visitor.visit(tree)
+    return {'definitions': visitor.definitions, 'imports': visitor.imports, 'calls': visitor.calls}
+
+
+class SymbolIndex:
+    """
+    SQLite index of the Python definitions, imports and call sites of a repository.
+
+    Symbols are stored per git blob, so a file version is parsed once and shared by every commit
+    that contains it. The `commit_files` table maps the paths of each indexed commit to their blobs.
+    The index keeps the `max_commits` most recently used commits, so reviews of several branches of
+    one repository, also from concurrent processes, each read their own commit. `update` only parses
+    the blobs that are not indexed yet, so consecutive runs on a large repository cost a tree listing
+    and the changed files.
+
+    A lazily updated commit only records its paths; `load` parses the blobs a review needs on
+    demand, so a partial clone fetches a few files instead of every Python file of the repository.
+    Such a commit is `complete` only once all its blobs are parsed.
+
+    An instance reads the commit it last selected or updated.
+    """
+
+    def __init__(self, path: str, max_file_bytes: int, max_commits: int = 8):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_file_bytes = max_file_bytes
+        self.max_commits = max_commits
+        self.commit: Optional[str] = None
+        self.complete = False
+        self._lock = threading.Lock()
+        # Transactions are explicit: writers take the write lock up front with BEGIN IMMEDIATE
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(
+            # Tables of the earlier single-commit layout; their blobs are pruned by the next update
+            "DROP TABLE IF EXISTS meta;"
+            "DROP TABLE IF EXISTS files;"
+            "CREATE TABLE IF NOT EXISTS commits (commit_id TEXT PRIMARY KEY, used REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS commit_files ("
+            "commit_id TEXT NOT NULL, path TEXT NOT NULL, blob TEXT NOT NULL, PRIMARY KEY (commit_id, path));"
+            "CREATE TABLE IF NOT EXISTS blobs (blob TEXT PRIMARY KEY, parsed INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS definitions ("
+            "blob TEXT NOT NULL, name TEXT NOT NULL, qualname TEXT NOT NULL, kind TEXT NOT NULL, "
+            "start_line INTEGER NOT NULL, end_line INTEGER NOT NULL, signature TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS imports (blob TEXT NOT NULL, alias TEXT NOT NULL, "
+            "module TEXT NOT NULL, name TEXT);"
+            "CREATE TABLE IF NOT EXISTS calls (blob TEXT NOT NULL, name TEXT NOT NULL, line INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS commit_files_blob ON commit_files (blob, commit_id);"
+            "CREATE INDEX IF NOT EXISTS definitions_blob ON definitions (blob);"
+            "CREATE INDEX IF NOT EXISTS definitions_name ON definitions (name);"
+            "CREATE INDEX IF NOT EXISTS imports_blob ON imports (blob);"
+            "CREATE INDEX IF NOT EXISTS calls_blob ON calls (blob);"
+            "CREATE INDEX IF NOT EXISTS calls_name ON calls (name);"
+        )
+
+    def select(self, commit: str) -> bool:
+        """
+        Reads `commit` from now on if it is indexed.
+
+        Returns:
+        - False when the commit is not indexed; call `update` then.
+        """
+        with self._lock:
+            found = self._connection.execute(
+                "UPDATE commits SET used = ? WHERE commit_id = ?", (time.time(), commit)
+            ).rowcount > 0
+        if found:
+            self.commit = commit
+            self.complete = self._is_complete(commit)
+        return found
+
+    def _is_complete(self, commit: str) -> bool:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT 1 FROM commit_files LEFT JOIN blobs ON blobs.blob = commit_files.blob "
+                "WHERE commit_files.commit_id = ? AND blobs.blob IS NULL LIMIT 1", (commit,)
+            ).fetchone() is None
+
+    def _parse(self, missing: Dict[str, str], read_blob: BlobReader) -> Dict[str, Optional[Dict[str, List[Tuple]]]]:
+        parsed = {}
+        for blob, path in missing.items():
+            content = read_blob(blob)
+            symbols = None
+            if len(content) <= self.max_file_bytes:
+                symbols = extract_symbols(path, content.decode('utf-8', errors='replace'))
+            parsed[blob] = symbols
+        return parsed
+
+    def _insert_blobs(self, parsed: Dict[str, Optional[Dict[str, List[Tuple]]]]) -> None:
+        self._connection.executemany(
+            "INSERT INTO blobs (blob, parsed) VALUES (?, ?)",
+            ((blob, symbols is not None) for blob, symbols in parsed.items())
+        )
+        for blob, symbols in parsed.items():
+            if symbols is None:
+                continue
+            self._connection.executemany(
+                "INSERT INTO definitions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((blob,) + definition for definition in symbols['definitions'])
+            )
+            self._connection.executemany(
+                "INSERT INTO imports VALUES (?, ?, ?, ?)", ((blob,) + item for item in symbols['imports'])
+            )
+            self._connection.executemany(
+                "INSERT INTO calls VALUES (?, ?, ?)", ((blob,) + call for call in symbols['calls'])
+            )
+
+    def update(
+            self,
+            commit: str,
+            entries: Iterable[Tuple[str, str]],
+            read_blob: BlobReader,
+            prefetch: Optional[Callable[[List[str]], None]] = None,
+            lazy: bool = False
+    ) -> int:
+        """
+        Indexes `commit` and selects it. Commits beyond `max_commits` are evicted, least recently
+        used first, together with the blobs no remaining commit refers to, in the same transaction
+        that adds the commit.
+
+        Args:
+        - commit: Commit id the entries belong to.
+        - entries: (path, blob id) of every Python file of the commit.
+        - read_blob: Reader of the blob contents.
+        - prefetch: Called with the ids of the blobs about to be read, so a partial clone
+          can fetch them in one request instead of one request per blob.
+        - lazy: Only record the paths of the commit; blobs are parsed by `load`.
+
+        Returns:
+        - Number of blobs parsed by this update.
+        """
+        if self.select(commit):
+            return 0
+        entries = dict(entries)
+        with self._lock:
+            known = {blob for blob, in self._connection.execute("SELECT blob FROM blobs")}
+        missing = {} if lazy else {blob: path for path, blob in entries.items() if blob not in known}
+        if prefetch is not None and missing:
+            prefetch(list(missing))
+        parsed = self._parse(missing, read_blob)
+
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have added or pruned blobs since they were listed above
+                known = {blob for blob, in self._connection.execute("SELECT blob FROM blobs")}
+                parsed = {blob: symbols for blob, symbols in parsed.items() if blob not in known}
+                pruned = {} if lazy else {
+                    blob: path for path, blob in entries.items() if blob not in known and blob not in parsed
+                }
+                if pruned:
+                    if prefetch is not None:
+                        prefetch(list(pruned))
+                    parsed.update(self._parse(pruned, read_blob))
+                self._insert_blobs(parsed)
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO commits (commit_id, used) VALUES (?, ?)", (commit, time.time())
+                )
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO commit_files (commit_id, path, blob) VALUES (?, ?, ?)",
+                    ((commit, path, blob) for path, blob in entries.items())
+                )
+                self._connection.execute(
+                    "DELETE FROM commits WHERE commit_id NOT IN "
+                    "(SELECT commit_id FROM commits ORDER BY used DESC LIMIT ?)", (max(self.max_commits, 1),)
+                )
+                self._connection.execute(
+                    "DELETE FROM commit_files WHERE commit_id NOT IN (SELECT commit_id FROM commits)"
+                )
+                for table in ("definitions", "imports", "calls", "blobs"):
+                    self._connection.execute(
+                        f"DELETE FROM {table} WHERE blob NOT IN (SELECT blob FROM commit_files)"
+                    )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        self.commit = commit
+        self.complete = self._is_complete(commit)
+        return len(parsed)
+
+    def load(
+            self,
+            paths: Iterable[str],
+            read_blob: BlobReader,
+            prefetch: Optional[Callable[[List[str]], None]] = None
+    ) -> int:
+        """
+        Parses the blobs of `paths` in the selected commit that are not indexed yet.
+
+        Returns:
+        - Number of blobs parsed.
+        """
+        paths = list(dict.fromkeys(paths))
+        if self.complete or not paths:
+            return 0
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT commit_files.blob, commit_files.path FROM commit_files "
+                "LEFT JOIN blobs ON blobs.blob = commit_files.blob "
+                f"WHERE commit_files.commit_id = ? AND commit_files.path IN ({', '.join('?' * len(paths))}) "
+                "AND blobs.blob IS NULL", (self.commit, *paths)
+            ).fetchall()
+        missing = dict(rows)
+        if not missing:
+            return 0
+        if prefetch is not None:
+            prefetch(list(missing))
+        parsed = self._parse(missing, read_blob)
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                known = {blob for blob, in self._connection.execute(
+                    f"SELECT blob FROM blobs WHERE blob IN ({', '.join('?' * len(parsed))})", tuple(parsed)
+                )}
+                parsed = {blob: symbols for blob, symbols in parsed.items() if blob not in known}
+                self._insert_blobs(parsed)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return len(parsed)
+
+    @staticmethod
+    def _module_filter(module: str) -> Tuple[str, Tuple[str, ...]]:
+        module_path = module.replace('.', '/')
+        return (
+            "(files.path IN (?, ?) OR files.path LIKE ? OR files.path LIKE ?)",
+            (f"{module_path}.py", f"{module_path}/__init__.py", f"%/{module_path}.py", f"%/{module_path}/__init__.py")
+        )
+
+    def module_paths(self, module: str) -> List[str]:
+        """Paths of the selected commit that may define `module` (see find_definitions)."""
+        condition, parameters = self._module_filter(module)
+        with self._lock:
+            return [path for path, in self._connection.execute(
+                f"SELECT path FROM commit_files AS files WHERE files.commit_id = ? AND {condition} "
+                "ORDER BY path LIMIT 10", (self.commit, *parameters)
+            )]
+
+    def blob(self, path: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT blob FROM commit_files WHERE commit_id = ? AND path = ?", (self.commit, path)
+            ).fetchone()
+        return row[0] if row else None
+
+    def definitions(self, blob: str) -> List[Tuple[str, str, str, int, int, str]]:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT name, qualname, kind, start_line, end_line, signature FROM definitions WHERE blob = ?",
+                (blob,)
+            ).fetchall()
+
+    def calls(self, blob: str) -> List[Tuple[str, int]]:
+        with self._lock:
+            return self._connection.execute("SELECT name, line FROM calls WHERE blob = ?", (blob,)).fetchall()
+
+    def imports(self, blob: str) -> Dict[str, Tuple[str, Optional[str]]]:
+        with self._lock:
+            rows = self._connection.execute("SELECT alias, module, name FROM imports WHERE blob = ?", (blob,))
+            return {alias: (module, name) for alias, module, name in rows}
+
+    def find_definitions(self, name: str, module: Optional[str] = None) -> List[Tuple[str, int, str]]:
+        """
+        Definitions named `name` in the selected commit, optionally only those of `module`.
+
+        Returns:
+        - List of (path, start line, signature).
+        """
+        query = (
+            "SELECT files.path, definitions.start_line, definitions.signature FROM definitions "
+            "JOIN commit_files AS files ON files.blob = definitions.blob AND files.commit_id = ? "
+            "WHERE definitions.name = ?"
+        )
+        parameters: Tuple = (self.commit, name)
+        if module:
+            condition, module_parameters = self._module_filter(module)
+            query += f" AND {condition}"
+            parameters += module_parameters
+        with self._lock:
+            return self._connection.execute(query + " ORDER BY files.path LIMIT 10", parameters).fetchall()
+
+    def find_callers(self, name: str, exclude_blob: str) -> List[Tuple[str, int]]:
+        """Call sites of `name` in other files of the selected commit, as (path, line)."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT files.path, calls.line FROM calls "
+                "JOIN commit_files AS files ON files.blob = calls.blob AND files.commit_id = ? "
+                "WHERE calls.name = ? AND calls.blob != ? ORDER BY files.path, calls.line LIMIT ?",
+                (self.commit, name, exclude_blob, MAX_CALLERS)
+            ).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def changed_line_ranges(file_data: Dict[str, str]) -> List[Tuple[int, int]]:
+    """First and last line of every hunk in the new version of the file (deletions point at the next line)."""
+    hunks = file_diff(file_data).hunk_ranges()
+    return [(max(start, 1), max(start, 1) + max(length, 1) - 1) for start, length in hunks]
+
+
+def _innermost(definitions: List[Tuple], first: int, last: int) -> Optional[Tuple]:
+    enclosing = [
+        definition for definition in definitions
+        if definition[2] == "function" and definition[3] <= first and last <= definition[4]
+    ]
+    return max(enclosing, key=lambda definition: definition[3], default=None)
+
+
+def build_symbol_context(
+        index: SymbolIndex,
+        file_data: Dict[str, str],
+        read_blob: BlobReader,
+        max_tokens: int,
+        gpt_model: str,
+        prefetch: Optional[Callable[[List[str]], None]] = None
+) -> Optional[str]:
+    """
+    Collects the code around a file diff that the model needs to review it.
+
+    In order of priority, and while they fit into `max_tokens`: the source of the functions
+    enclosing the changed lines, the signatures of the symbols called in the changed lines,
+    and the call sites of the changed functions in other files.
+
+    When the selected commit is not `complete`, the file and the modules its changed lines call
+    are loaded on demand (`prefetch` fetches the modules in one request). Unqualified names and
+    call sites need the whole repository, so they are left out until the commit is complete.
+
+    Returns:
+    - The context text, or None when the file is not indexed or nothing relevant was found.
+    """
+    filename = file_data['filename']
+    # The diff has already brought the blob of the changed file into a partial clone
+    index.load([filename], read_blob)
+    blob = index.blob(filename)
+    if blob is None:
+        return None
+    ranges = changed_line_ranges(file_data)
+    definitions = index.definitions(blob)
+    sections: List[str] = []
+    used_tokens = 0
+
+    def add(text: str) -> bool:
+        nonlocal used_tokens
+        tokens = count_tokens(text, gpt_model)
+        if used_tokens + tokens > max_tokens:
+            return False
+        sections.append(text)
+        used_tokens += tokens
+        return True
+
+    enclosing = []
+    for first, last in ranges:
+        definition = _innermost(definitions, first, last)
+        if definition is not None and definition not in enclosing:
+            enclosing.append(definition)
+    if enclosing:
+        source_lines = read_blob(blob).decode('utf-8', errors='replace').split('\n')
+        for name, qualname, _, start, end, signature in enclosing:
+            body = '\n'.join(source_lines[start - 1:end])
+            if not add(f"Enclosing `{qualname}` ({filename}, lines {start}-{end}):\n```python\n{body}\n```"):
+                add(f"Enclosing `{qualname}` ({filename}, line {start}): `{signature}`")
+
+    local_names = {definition[0]: definition for definition in definitions}
+    enclosing_names = {definition[0] for definition in enclosing}
+    imports = index.imports(blob)
+    called: List[str] = []
+    for name, line in index.calls(blob):
+        if name in called or name in enclosing_names or not any(first <= line <= last for first, last in ranges):
+            continue
+        called.append(name)
+    if not index.complete:
+        modules = dict.fromkeys(imports[name][0] for name in called if name not in local_names and name in imports)
+        index.load([path for module in modules for path in index.module_paths(module)], read_blob, prefetch)
+    referenced: List[str] = []
+    for name in called:
+        if name in local_names:
+            _, _, _, start, _, signature = local_names[name]
+            referenced.append(f"- {filename}:{start} `{signature}`")
+            continue
+        module, imported_name = imports.get(name, (None, None))
+        if module is None and not index.complete:
+            continue
+        matches = index.find_definitions(imported_name or name, module)
+        # Unqualified names are only resolved when they are unambiguous in the repository
+        if len(matches) == 1 or (module and matches):
+            path, start, signature = matches[0]
+            referenced.append(f"- {path}:{start} `{signature}`")
+    if referenced:
+        header = "Symbols used by the changed lines:"
+        for count in range(len(referenced), 0, -1):
+            if add("\n".join([header] + referenced[:count])):
+                break
+
+    changed_definitions = [
+        definition for definition in definitions
+        if definition[2] == "function" and any(first <= definition[3] <= last for first, last in ranges)
+    ] + enclosing
+    callers = []
+    # Call sites can be in any file of the repository, so a partially loaded commit has none
+    for name in dict.fromkeys(definition[0] for definition in changed_definitions) if index.complete else ():
+        sites = index.find_callers(name, blob)
+        if sites:
+            callers.append(f"- `{name}` is called from " + ", ".join(f"{path}:{line}" for path, line in sites))
+    if callers:
+        add("\n".join([CALL_SITES_HEADER] + callers))
+
+    return "\n\n".join(sections) if sections else None
+
+
+def enrich_files(
+        files: Iterable[Dict[str, str]],
+        index: SymbolIndex,
+        read_blob: BlobReader,
+        max_tokens: int,
+        gpt_model: str,
+        prefetch: Optional[Callable[[List[str]], None]] = None
+) -> Iterator[Dict[str, str]]:
+    """
+    Lazily attaches the related code of every Python file diff as its 'context'
+    (see build_symbol_context); other files are passed on unchanged.
+    """
+    report = get_run_report()
+    for file_data in files:
+        if file_data['filename'].endswith('.py'):
+            with stage("symbol_context"):
+                context = build_symbol_context(index, file_data, read_blob, max_tokens, gpt_model, prefetch)
+            if context:
+                file_data['context'] = context
+                report.increment("symbol_context_files")
+        yield file_data
+
+
+def python_entries(tree_listing: str) -> Iterator[Tuple[str, str]]:
+    """
+    Parses the output of `git ls-tree -r -z <commit>` into (path, blob id) of its Python files.
+    """
+    for entry in tree_listing.split('\0'):
+        if not entry:
+            continue
+        info, path = entry.split('\t', 1)
+        _, object_type, blob = info.split()
+        if object_type == 'blob' and posixpath.splitext(path)[1] == '.py':
+            yield path, blob
@@ -0,0 +1,212 @@
+import ast
+import fnmatch
+import io
+import logging
+import textwrap
+import tokenize
+from collections import Counter
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from common.az_logger.global_logger import CustomLogger
+from common.instrumentation import get_run_report, stage
+from review.diff import file_diff
+from settings.conf import TriageConfig
+
+REVIEW = "review"
+LIGHT = "light"
+SKIP = "skip"
+
+GENERATED_MARKERS = ("@generated", "DO NOT EDIT", "Code generated by", "Autogenerated by", "auto-generated")
+
+# Tokens that only carry layout; NEWLINE is kept because it ends a statement
+LAYOUT_TOKENS = (tokenize.NL, tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER)
+
+# Returns the (base, changed) sources of a file, or None when they are not available
+SourceLoader = Callable[[str], Optional[Tuple[str, str]]]
+
+
+@lru_cache(maxsize=8)
+def parse_globs(globs: str) -> Tuple[str, ...]:
+    return tuple(glob.strip() for glob in globs.split(',') if glob.strip())
+
+
+def matches_any(filename: str, globs: Iterable[str]) -> bool:
+    return any(fnmatch.fnmatchcase(filename, glob) for glob in globs)
+
+
+def _stripped(lines: List[str]) -> List[str]:
+    return [line.strip() for line in lines if line.strip()]
+
+
+def _code_tokens(lines: List[str]) -> Optional[List[Tuple[int, str]]]:
+    """
+    Python tokens of a block of changed lines without layout tokens, string contents included,
+    or None when the block does not tokenize on its own (e.g. half of a multi-line string).
+    """
+    source = "".join(line.lstrip() + "\n" for line in lines)
+    try:
+        return [
+            (token.type, '' if token.type == tokenize.NEWLINE else token.string)
+            for token in tokenize.generate_tokens(io.StringIO(source).readline) if token.type not in LAYOUT_TOKENS
+        ]
+    except (tokenize.TokenError, SyntaxError):
+        return None
+
+
+def _indentation(lines: List[str]) -> List[int]:
+    return [len(line) - len(line.lstrip()) for line in lines if line.strip()]
+
+
+def _import_names(lines: List[str]) -> Optional[Counter]:
+    """Names imported by a block of import statements, or None when the block contains anything else."""
+    source = textwrap.dedent("\n".join(line for line in lines if line.strip()))
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    names = Counter()
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.update((None, 0, alias.name, alias.asname) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            names.update((node.module, node.level, alias.name, alias.asname) for alias in node.names)
+        else:
+            return None
+    return names
+
+
+def _is_comment_only(lines: List[str]) -> bool:
+    return all(not line.strip() or line.lstrip().startswith('#') for line in lines)
+
+
+def _strip_docstrings(tree: ast.AST) -> ast.AST:
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and node.body:
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) \
+                    and isinstance(first.value.value, str):
+                node.body = node.body[1:] or [ast.Pass()]
+    return tree
+
+
+def _compare_ast(before: str, after: str) -> Optional[str]:
+    """
+    Compares two versions of a Python module by their syntax trees.
+
+    Returns:
+    - SKIP when only formatting or comments changed, LIGHT when only docstrings changed,
+      None when the code changed or a version does not parse.
+    """
+    try:
+        before_tree, after_tree = ast.parse(before), ast.parse(after)
+    except (SyntaxError, ValueError):
+        return None
+    if ast.dump(before_tree) == ast.dump(after_tree):
+        return SKIP
+    if ast.dump(_strip_docstrings(before_tree)) == ast.dump(_strip_docstrings(after_tree)):
+        return LIGHT
+    return None
+
+
+def classify_change(
+        file_data: Dict[str, str],
+        config: TriageConfig,
+        load_sources: Optional[SourceLoader] = None
+) -> Tuple[str, str]:
+    """
+    Decides whether a file diff needs a model review.
+
+    Checks path globs, size limits and generated-file markers first, then compares the
+    removed and added lines: whitespace-only changes, reordered imports and comment-only
+    changes are skipped. A change is whitespace-only when the indentation stays the same and
+    the Python tokens (string contents included) or, for other files, the stripped lines are
+    equal, so whitespace that separates words or sits inside strings is always reviewed.
+    When `load_sources` is given, Python files are compared by their syntax trees, so
+    formatting-only changes are skipped and docstring-only changes are down-tiered.
+
+    Args:
+    - file_data: Dictionary with 'filename' and 'changes'.
+    - config: Triage thresholds and globs.
+    - load_sources: Optional loader of the full base and changed sources of a file.
+
+    Returns:
+    - The tier (REVIEW, LIGHT or SKIP) and a short reason.
+    """
+    filename, changes = file_data['filename'], file_data['changes']
+    if matches_any(filename, parse_globs(config.TRIAGE_SKIP_GLOBS)):
+        return SKIP, "path matches a skip pattern"
+
+    diff = file_diff(file_data)
+    header, removed, added, hunks = diff.header_lines(), diff.removed_lines(), diff.added_lines(), diff.hunk_ranges()
+    if any(line.startswith('Binary files') for line in header):
+        return SKIP, "binary file"
+    deleted = hunks and not added and all(start == 0 for start, _ in hunks)
+    if deleted or any(line.startswith('deleted file mode') for line in header):
+        return SKIP, "file deleted"
+    if len(changes.encode('utf-8', errors='replace')) > config.TRIAGE_MAX_DIFF_BYTES:
+        return SKIP, f"diff larger than {config.TRIAGE_MAX_DIFF_BYTES} bytes"
+    if added and sum(len(line) > config.TRIAGE_MAX_LINE_LENGTH for line in added) * 2 >= len(added):
+        return SKIP, f"data blob (lines longer than {config.TRIAGE_MAX_LINE_LENGTH} characters)"
+    if hunks and hunks[0][0] <= 5 and any(marker in line for line in added[:20] for marker in GENERATED_MARKERS):
+        return SKIP, "generated file"
+    if not removed and not added:
+        return SKIP, "no content changes"
+    if filename.endswith('.py'):
+        removed_imports = _import_names(removed)
+        if removed_imports and removed_imports == _import_names(added):
+            return SKIP, "imports reordered"
+    # Indentation is significant in Python (and YAML, Makefiles), so it has to stay the same
+    if _indentation(removed) == _indentation(added):
+        if filename.endswith('.py'):
+            removed_tokens = _code_tokens(removed)
+            whitespace_only = removed_tokens is not None and removed_tokens == _code_tokens(added)
+        else:
+            whitespace_only = _stripped(removed) == _stripped(added)
+        if whitespace_only:
+            return SKIP, "whitespace-only changes"
+
+    if filename.endswith('.py'):
+        if _is_comment_only(removed) and _is_comment_only(added):
+            return SKIP, "comment-only changes"
+        sources = load_sources(filename) if load_sources is not None else None
+        if sources is not None and max(len(source) for source in sources) <= config.TRIAGE_AST_MAX_BYTES:
+            tier = _compare_ast(*sources)
+            if tier == SKIP:
+                return SKIP, "formatting or comment changes only"
+            if tier == LIGHT:
+                return LIGHT, "docstring changes only"
+
+    if matches_any(filename, parse_globs(config.TRIAGE_LIGHT_GLOBS)):
+        return LIGHT, "path matches a light pattern"
+    return REVIEW, "code changes"
+
+
+def triage_files(
+        files: Iterable[Dict[str, str]],
+        logger: Union[logging.Logger, CustomLogger],
+        load_sources: Optional[SourceLoader] = None,
+        config: Optional[TriageConfig] = None
+) -> Iterator[Dict[str, str]]:
+    """
+    Filters file diffs before they are sent to the model.
+
+    Skipped files are logged and dropped; every other file is passed on lazily with its 'tier'
+    (REVIEW or LIGHT) set, so the review engine can send light files to TRIAGE_LIGHT_MODEL.
+    """
+    config = config or TriageConfig()
+    if not config.TRIAGE_ENABLED:
+        yield from files
+        return
+    report = get_run_report()
+    for file_data in files:
+        with stage("triage"):
+            tier, reason = classify_change(file_data, config, load_sources)
+        report.increment(f"triage_{tier}")
+        if tier == SKIP:
+            logger.info(f"Skipping review of {file_data['filename']}: {reason}")
+            continue
+        if tier == LIGHT:
+            logger.debug(f"Light review of {file_data['filename']}: {reason}")
+        file_data['tier'] = tier
+        yield file_data
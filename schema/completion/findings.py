@@ -0,0 +1,90 @@
+from enum import Enum
+from typing import Any, Dict, List
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+
+
+class Severity(str, Enum):
+    CRITICAL = "critical"
+    MAJOR = "major"
+    MINOR = "minor"
+    INFO = "info"
+
+
+class Category(str, Enum):
+    BUG = "bug"
+    SECURITY = "security"
+    PERFORMANCE = "performance"
+    MAINTAINABILITY = "maintainability"
+    STYLE = "style"
+    DOCUMENTATION = "documentation"
+    TESTING = "testing"
+
+
+class ReviewFinding(BaseModel):
+    """One review comment, anchored to a line range of the changed file."""
+    model_config = ConfigDict(extra="forbid")
+
+    file: str = Field(description="File label exactly as given in the request")
+    start_line: int = Field(description="First line of the finding in the new version of the file")
+    end_line: int = Field(description="Last line of the finding in the new version of the file")
+    severity: Severity
+    category: Category
+    title: str = Field(description="One-line summary of the problem")
+    suggestion: str = Field(description="Explanation and the suggested change, code in markdown")
+
+
+class CodeReview(BaseModel):
+    """Structured output of one review request: the findings of every file in the request."""
+    model_config = ConfigDict(extra="forbid")
+
+    findings: List[ReviewFinding]
+
+
+FINDINGS_ADAPTER = TypeAdapter(List[ReviewFinding])
+
+# Built once: the schema is sent with every request and does not change during a run
+REVIEW_RESPONSE_FORMAT: Dict[str, Any] = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "code_review",
+        "strict": True,
+        "schema": CodeReview.model_json_schema(),
+    },
+}
+
+SEVERITY_ORDER = {severity: rank for rank, severity in enumerate(Severity)}
+
+
+def parse_review(content: str) -> CodeReview:
+    """
+    Validates the JSON content of a structured completion in a single pass.
+
+    Raises:
+    - pydantic.ValidationError: When the content does not match the schema.
+    """
+    return CodeReview.model_validate_json(content)
+
+
+def dump_findings(findings: List[ReviewFinding]) -> str:
+    """Compact JSON of findings, used for caching and storage."""
+    return FINDINGS_ADAPTER.dump_json(findings).decode()
+
+
+def load_findings(data: str) -> List[ReviewFinding]:
+    return FINDINGS_ADAPTER.validate_json(data)
+
+
+def render_findings(findings: List[ReviewFinding]) -> str:
+    """Renders findings as markdown for the text output files, most severe first."""
+    if not findings:
+        return "No issues found."
+    lines = []
+    for finding in sorted(findings, key=lambda item: (SEVERITY_ORDER[item.severity], item.start_line)):
+        location = f"line {finding.start_line}" if finding.start_line == finding.end_line \
+            else f"lines {finding.start_line}-{finding.end_line}"
+        lines.append(
+            f"- **{finding.severity.value} / {finding.category.value}** ({location}): {finding.title}\n"
+            f"  {finding.suggestion}"
+        )
+    return "\n".join(lines)
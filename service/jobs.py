@@ -0,0 +1,256 @@
+import asyncio
+import json
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple, Union
+
+from settings.conf import RedisConfig
+
+Job = Dict[str, Union[str, int]]
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at capacity; the webhook answers 503 so the sender can retry."""
+
+
+def pull_request_key(job: Job) -> str:
+    return f"{job['repo_name']}#{job['pr_number']}"
+
+
+class JobQueue(ABC):
+    """
+    Interface of a review job queue, keyed by pull request.
+
+    At most one job per pull request is queued and at most one runs: a job for a PR that is
+    already queued replaces the queued job (so the queue collapses to the newest head SHA), and a
+    job for a PR under review waits until the running job is `done`. Reviews of one PR therefore
+    never overlap and never overwrite each other's review state. A job with the head SHA of the
+    queued or running job of its PR is a duplicate, so redelivered webhooks are ignored.
+    """
+
+    @abstractmethod
+    async def put(self, job: Job) -> bool:
+        """Enqueues a job. Returns False for a duplicate, raises QueueFullError when full."""
+
+    @abstractmethod
+    async def get(self) -> Job:
+        ...
+
+    @abstractmethod
+    async def done(self, job: Job) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemoryJobQueue(JobQueue):
+    """Bounded in-process queue for a single service instance."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # Keys of PRs with a queued job that is not running; the jobs themselves are in _pending
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._pending: Dict[str, Job] = {}
+        self._running: Dict[str, Job] = {}
+
+    async def put(self, job: Job) -> bool:
+        key = pull_request_key(job)
+        if any(
+                other is not None and other['head_sha'] == job['head_sha']
+                for other in (self._pending.get(key), self._running.get(key))
+        ):
+            return False
+        if key in self._pending:
+            self._pending[key] = job
+            return True
+        if len(self._pending) >= self.max_size:
+            raise QueueFullError(f"Job queue is full ({self.max_size} jobs)")
+        self._pending[key] = job
+        if key not in self._running:
+            self._queue.put_nowait(key)
+        return True
+
+    async def get(self) -> Job:
+        key = await self._queue.get()
+        job = self._running[key] = self._pending.pop(key)
+        return job
+
+    async def done(self, job: Job) -> None:
+        key = pull_request_key(job)
+        self._running.pop(key, None)
+        self._queue.task_done()
+        if key in self._pending:
+            self._queue.put_nowait(key)
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Redis list of PR keys shared by several service instances, so workers can scale horizontally.
+    Redis hashes hold the queued and the running job of every PR; the scripts below keep the
+    list and the hashes consistent across instances.
+
+    A running job holds a lease that its instance renews every third of `lease_seconds`. When a
+    worker dies mid-review, its lease expires: the next `put` for the PR, or the reaper that every
+    instance runs while waiting for jobs, frees the PR and requeues its pending job. Lease times
+    come from the Redis clock, so instances need not agree on theirs.
+    """
+    QUEUE_KEY = "review_jobs:queue"
+    PENDING_KEY = "review_jobs:pending"
+    RUNNING_KEY = "review_jobs:running"
+    LEASES_KEY = "review_jobs:leases"
+
+    # Frees the PR ARGV[1] when its lease (KEYS[4]) has expired; a running job without a lease is stale too
+    RECLAIM_FUNCTION = """
+    local function reclaim(key, now)
+        local lease = redis.call('HGET', KEYS[4], key)
+        if lease and tonumber(cjson.decode(lease)['expires']) > now then return false end
+        redis.call('HDEL', KEYS[3], key)
+        redis.call('HDEL', KEYS[4], key)
+        return true
+    end
+    local now = tonumber(redis.call('TIME')[1])
+    """
+    # KEYS: queue, pending, running, leases; ARGV: PR key, job, head SHA, max size
+    PUT_SCRIPT = RECLAIM_FUNCTION + """
+    local pending = redis.call('HGET', KEYS[2], ARGV[1])
+    local running = redis.call('HGET', KEYS[3], ARGV[1])
+    local reclaimed = false
+    if running and reclaim(ARGV[1], now) then
+        running = false
+        reclaimed = true
+    end
+    for _, other in ipairs({pending, running}) do
+        if other and cjson.decode(other)['head_sha'] == ARGV[3] then
+            if reclaimed then redis.call('LPUSH', KEYS[1], ARGV[1]) end
+            return 0
+        end
+    end
+    if pending then
+        redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+        if reclaimed then redis.call('LPUSH', KEYS[1], ARGV[1]) end
+        return 1
+    end
+    if redis.call('HLEN', KEYS[2]) >= tonumber(ARGV[4]) then return -1 end
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+    if not running then redis.call('LPUSH', KEYS[1], ARGV[1]) end
+    return 1
+    """
+    # KEYS: queue, pending, running, leases; returns the number of freed PRs
+    REAP_SCRIPT = RECLAIM_FUNCTION + """
+    local freed = 0
+    for _, key in ipairs(redis.call('HKEYS', KEYS[3])) do
+        if reclaim(key, now) then
+            freed = freed + 1
+            if redis.call('HEXISTS', KEYS[2], key) == 1 then redis.call('LPUSH', KEYS[1], key) end
+        end
+    end
+    return freed
+    """
+    # KEYS: pending, running, leases; ARGV: PR key, lease token, lease seconds
+    START_SCRIPT = """
+    local job = redis.call('HGET', KEYS[1], ARGV[1])
+    if job then
+        local now = tonumber(redis.call('TIME')[1])
+        redis.call('HDEL', KEYS[1], ARGV[1])
+        redis.call('HSET', KEYS[2], ARGV[1], job)
+        redis.call('HSET', KEYS[3], ARGV[1], cjson.encode({token = ARGV[2], expires = now + tonumber(ARGV[3])}))
+    end
+    return job
+    """
+    # KEYS: leases; ARGV: PR key, lease token, lease seconds; returns 0 when the lease was lost
+    RENEW_SCRIPT = """
+    local lease = redis.call('HGET', KEYS[1], ARGV[1])
+    if not lease or cjson.decode(lease)['token'] ~= ARGV[2] then return 0 end
+    local now = tonumber(redis.call('TIME')[1])
+    redis.call('HSET', KEYS[1], ARGV[1], cjson.encode({token = ARGV[2], expires = now + tonumber(ARGV[3])}))
+    return 1
+    """
+    # KEYS: queue, pending, running, leases; ARGV: PR key, lease token
+    # A job whose lease was reclaimed leaves the PR alone: another worker may be reviewing it already
+    DONE_SCRIPT = """
+    local lease = redis.call('HGET', KEYS[4], ARGV[1])
+    if not lease or cjson.decode(lease)['token'] ~= ARGV[2] then return 0 end
+    redis.call('HDEL', KEYS[3], ARGV[1])
+    redis.call('HDEL', KEYS[4], ARGV[1])
+    if redis.call('HEXISTS', KEYS[2], ARGV[1]) == 1 then redis.call('LPUSH', KEYS[1], ARGV[1]) end
+    return 1
+    """
+
+    def __init__(self, redis_config: RedisConfig, max_size: int, lease_seconds: int = 120):
+        import redis.asyncio as redis
+
+        self.max_size = max_size
+        self.lease_seconds = lease_seconds
+        self._client = redis.Redis(
+            host=redis_config.REDIS_HOST,
+            port=int(redis_config.REDIS_PORT),
+            db=int(redis_config.REDIS_DB),
+            decode_responses=True
+        )
+        self._put = self._client.register_script(self.PUT_SCRIPT)
+        self._reap = self._client.register_script(self.REAP_SCRIPT)
+        self._start = self._client.register_script(self.START_SCRIPT)
+        self._renew = self._client.register_script(self.RENEW_SCRIPT)
+        self._done = self._client.register_script(self.DONE_SCRIPT)
+        # Lease token and renewal task of every job running in this instance, by PR key
+        self._leases: Dict[str, Tuple[str, asyncio.Task]] = {}
+
+    @property
+    def _keys(self) -> List[str]:
+        return [self.QUEUE_KEY, self.PENDING_KEY, self.RUNNING_KEY, self.LEASES_KEY]
+
+    async def put(self, job: Job) -> bool:
+        result = await self._put(
+            keys=self._keys, args=[pull_request_key(job), json.dumps(job), job['head_sha'], self.max_size]
+        )
+        if result == -1:
+            raise QueueFullError(f"Job queue is full ({self.max_size} jobs)")
+        return result == 1
+
+    async def reap(self) -> int:
+        """Frees the PRs whose running job lost its lease and requeues their pending jobs."""
+        return await self._reap(keys=self._keys)
+
+    async def _renew_lease(self, key: str, token: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await self._renew(keys=[self.LEASES_KEY], args=[key, token, self.lease_seconds]):
+                return
+
+    async def get(self) -> Job:
+        while True:
+            await self.reap()
+            # The timeout bounds how long a PR of a dead worker waits for the reaper
+            popped = await self._client.brpop(self.QUEUE_KEY, timeout=max(1, self.lease_seconds // 3))
+            if popped is None:
+                continue
+            key, token = popped[1], uuid.uuid4().hex
+            payload = await self._start(
+                keys=[self.PENDING_KEY, self.RUNNING_KEY, self.LEASES_KEY], args=[key, token, self.lease_seconds]
+            )
+            if payload:
+                self._leases[key] = (token, asyncio.create_task(self._renew_lease(key, token)))
+                return json.loads(payload)
+
+    async def done(self, job: Job) -> None:
+        key = pull_request_key(job)
+        token, renewal = self._leases.pop(key)
+        renewal.cancel()
+        await self._done(keys=self._keys, args=[key, token])
+
+    async def close(self) -> None:
+        for _, renewal in self._leases.values():
+            renewal.cancel()
+        await self._client.aclose()
+
+
+def create_job_queue(
+        backend: str,
+        max_size: int,
+        redis_config: Optional[RedisConfig] = None,
+        lease_seconds: int = 120
+) -> JobQueue:
+    if backend.lower() == "redis":
+        return RedisJobQueue(redis_config or RedisConfig(), max_size, lease_seconds)
+    return InMemoryJobQueue(max_size)
@@ -0,0 +1,323 @@
+"""
+Reviews many repositories, branches and pull requests in one run.
+
+    python -m service.orchestrator sweep.json --output-dir reviews/sweep
+
+Git diffs of local targets are collected in a process pool, because diffing, triage and the
+symbol index are CPU-bound. Pull requests are fetched in threads. All completions share one
+event loop, one client and one concurrency budget (ORCHESTRATOR_CONCURRENCY), so the whole
+sweep stays within the rate limits of a single OpenAI organization.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Union
+
+from openai import AsyncOpenAI, OpenAI
+
+from common.az_logger.global_logger import CustomLogger
+from common.instrumentation import configure_tracing, start_run
+from git_hub.gh_client import finish_pull_request_review, prepare_pull_request_review
+from git_local.local_client import (
+    MAIN_BRANCH,
+    build_branch_context,
+    format_review_comments,
+    get_head_sha,
+    iter_review_files,
+    save_review_comments,
+    save_review_findings,
+)
+from git_local.workspace import WorkspaceManager, local_ref_name
+from open_ai.prompt.llm_prompt import SYSTEM, USER
+from review.cache import ReviewCache, get_review_cache
+from review.engine import as_async_client, review_files_async
+from settings.conf import OrchestratorConfig
+from storage.history import local_run, pull_request_run
+from storage.store import ReviewStore, get_review_store
+
+Target = Dict[str, Any]
+
+DEFAULTS = {"model": "gpt-4o-mini", "system_prompt": "code_review_assistant", "user_prompt": "code_review"}
+
+
+def load_manifest(path: str) -> List[Target]:
+    """
+    Reads a sweep manifest and expands it into one target per branch or pull request.
+
+    Manifest (JSON); every target may override the defaults:
+
+        {
+          "defaults": {"model": "gpt-4o-mini", "system_prompt": "code_review_assistant"},
+          "targets": [
+            {"type": "local", "repo_path": "/src/service", "branches": ["feature-a"], "base_branch": "main"},
+            {"type": "local", "repo_url": "https://github.com/owner/lib.git", "branches": ["refs/pull/7/head"]},
+            {"type": "github", "repo_name": "owner/repo", "pull_requests": [12, 15], "incremental": true}
+          ]
+        }
+
+    Local targets with a `repo_url` instead of a `repo_path` are reviewed from a bare partial
+    mirror (git_local.workspace), so remote repositories need no checkout.
+
+    Raises:
+    - ValueError: When a target has an unknown type or misses a required key.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    defaults = {**DEFAULTS, **manifest.get("defaults", {})}
+    targets = []
+    for entry in manifest["targets"]:
+        entry = {**defaults, **entry}
+        if entry.get("type") == "local":
+            if "repo_path" not in entry and "repo_url" not in entry:
+                raise ValueError(f"Local target without repo_path or repo_url: {entry}")
+            repository = entry.get("repo_path") or re.sub(r'\.git$', '', entry["repo_url"].rstrip('/'))
+            for branch in entry.get("branches") or [entry.get("branch")]:
+                if not branch:
+                    raise ValueError(f"Local target without branches: {entry}")
+                targets.append({
+                    **entry, "branch": branch, "base_branch": entry.get("base_branch", MAIN_BRANCH),
+                    "name": f"{os.path.basename(os.path.abspath(repository))}@{branch}",
+                })
+        elif entry.get("type") == "github":
+            if "repo_name" not in entry:
+                raise ValueError(f"GitHub target without repo_name: {entry}")
+            for pr_number in entry.get("pull_requests") or [entry.get("pr_number")]:
+                if pr_number is None:
+                    raise ValueError(f"GitHub target without pull_requests: {entry}")
+                targets.append({
+                    **entry, "pr_number": int(pr_number), "incremental": entry.get("incremental", True),
+                    "name": f"{entry['repo_name']}#{pr_number}",
+                })
+        else:
+            raise ValueError(f"Unknown target type: {entry.get('type')}")
+    # Names are used for the output files, so repositories with the same directory name need distinct ones
+    names = Counter()
+    for target in targets:
+        names[target['name']] += 1
+        if names[target['name']] > 1:
+            target['name'] = f"{target['name']}-{names[target['name']]}"
+    return targets
+
+
+def output_file_for(target: Target, output_dir: str) -> str:
+    return os.path.join(output_dir, re.sub(r'[^A-Za-z0-9._-]+', '__', target['name']) + ".txt")
+
+
+def collect_local_target(target: Target) -> Dict[str, Any]:
+    """
+    Collects the triaged (and enriched) file diffs of a local branch, fetching remote targets
+    into their workspace mirror first. Runs in a worker process.
+
+    Returns:
+    - Dictionary with 'files', the run 'context', the 'head_sha' of the branch and the raw 'stages'
+      and 'counters' of the worker's run report, which the parent merges into the target report.
+    """
+    report = start_run(target['name'])
+    logger = logging.getLogger(__name__)
+    repo_path, branch, base_branch = target.get('repo_path'), target['branch'], target['base_branch']
+    with ExitStack() as stack:
+        if repo_path is None:
+            # The lease keeps other workers from evicting the mirror until the diff is collected
+            repo_path = stack.enter_context(WorkspaceManager().open_mirror(target['repo_url'], [base_branch, branch]))
+            branch, base_branch = local_ref_name(branch), local_ref_name(base_branch)
+        files = list(iter_review_files(repo_path, branch, logger, target['model'], base_branch))
+        return {
+            'files': files,
+            'context': build_branch_context(repo_path, branch, base_branch),
+            'head_sha': get_head_sha(repo_path, branch),
+            'stages': report.stages,
+            'counters': report.counters,
+        }
+
+
+def target_run(target: Target) -> Dict[str, Any]:
+    """Review history record of a target; the head SHA is filled in once the target is fetched."""
+    if target['type'] == 'local':
+        run = local_run(
+            target.get('repo_url') or target['repo_path'], target['branch'], target['base_branch'], None, target['model']
+        )
+    else:
+        run = pull_request_run({**target, 'head_sha': None}, target['model'])
+    return {**run, 'name': target['name']}
+
+
+def summarize_reviews(reviews: List[Dict]) -> Dict[str, Any]:
+    severities = Counter(
+        finding.severity.value for review in reviews for finding in review.get('findings') or []
+    )
+    return {
+        'files': len(reviews),
+        'failed_files': sum(review['comments'] is None for review in reviews),
+        'cached_files': sum(bool(review.get('cached')) for review in reviews),
+        'findings': dict(severities),
+    }
+
+
+async def review_target(
+        target: Target,
+        executor: ProcessPoolExecutor,
+        completion_client: AsyncOpenAI,
+        semaphore: asyncio.Semaphore,
+        cache: Optional[ReviewCache],
+        output_dir: str,
+        logger: Union[logging.Logger, CustomLogger],
+        store: Optional[ReviewStore] = None
+) -> Dict[str, Any]:
+    """
+    Reviews one target and saves its comments and run report (and the run to the review history
+    `store`). Errors are logged and reported in the summary, so one broken target does not stop the sweep.
+    """
+    # Every target runs in its own task, so start_run gives it a separate report
+    report = start_run(target['name'])
+    output_file = output_file_for(target, output_dir)
+    summary = {'target': target['name'], 'type': target['type'], 'output_file': output_file}
+    started = time.perf_counter()
+    reviews: List[Dict] = []
+    run = target_run(target)
+    review_args = (
+        completion_client, SYSTEM[target['system_prompt']], USER[target['user_prompt']], target['model'], logger
+    )
+    try:
+        if target['type'] == 'local':
+            collected = await asyncio.get_running_loop().run_in_executor(executor, collect_local_target, target)
+            report.merge(collected['stages'], collected['counters'])
+            run['head_sha'] = collected['head_sha']
+            reviews = await review_files_async(
+                collected['files'], *review_args, cache=cache, context=collected['context'], semaphore=semaphore
+            )
+            if reviews:
+                await asyncio.to_thread(save_review_comments, format_review_comments(reviews), output_file, logger)
+                await asyncio.to_thread(save_review_findings, reviews, output_file, logger)
+        else:
+            plan = await asyncio.to_thread(
+                prepare_pull_request_review, target['repo_name'], target['pr_number'], logger, target['incremental']
+            )
+            reviews = await review_files_async(
+                plan['files_to_review'], *review_args, cache=cache, context=plan['context'], semaphore=semaphore
+            )
+            await asyncio.to_thread(finish_pull_request_review, plan, reviews, output_file, logger)
+            run['head_sha'] = plan['head_sha']
+        summary.update(summarize_reviews(reviews))
+        summary['status'] = 'reviewed' if reviews else 'no_changes'
+    except Exception as e:
+        logger.error(f"Error reviewing {target['name']}: {e}")
+        summary.update(status='failed', error=str(e))
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    if store is not None:
+        try:
+            summary['run_id'] = await store.save_run(run, reviews, report, summary['status'])
+        except Exception as e:
+            logger.error(f"Error saving the review history of {target['name']}: {e}")
+    report_data = report.to_dict()
+    summary['models'] = report_data['models']
+    summary['counters'] = report_data['counters']
+    report.save(os.path.splitext(output_file)[0] + ".report.json")
+    logger.info(f"{target['name']}: {summary['status']} in {summary['seconds']}s")
+    return summary
+
+
+def aggregate_summaries(summaries: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """Sums the per-target summaries into the totals of the sweep."""
+    statuses, findings, counters = Counter(), Counter(), Counter()
+    models: Dict[str, Counter] = {}
+    for summary in summaries:
+        statuses[summary['status']] += 1
+        findings.update(summary.get('findings', {}))
+        counters.update(summary.get('counters', {}))
+        for model, usage in summary.get('models', {}).items():
+            models.setdefault(model, Counter()).update(
+                {key: value for key, value in usage.items() if key != 'cached_prompt_ratio'}
+            )
+    return {
+        'targets': len(summaries),
+        'statuses': dict(statuses),
+        'files': sum(summary.get('files', 0) for summary in summaries),
+        'failed_files': sum(summary.get('failed_files', 0) for summary in summaries),
+        'findings': dict(findings),
+        'models': {model: dict(usage) for model, usage in models.items()},
+        'counters': dict(counters),
+        'wall_seconds': round(wall_seconds, 3),
+        'results': summaries,
+    }
+
+
+async def run_sweep_async(
+        targets: List[Target],
+        completion_client: Union[OpenAI, AsyncOpenAI],
+        logger: Union[logging.Logger, CustomLogger],
+        output_dir: Optional[str] = None,
+        config: Optional[OrchestratorConfig] = None
+) -> Dict[str, Any]:
+    """
+    Reviews all targets concurrently and writes '<output_dir>/summary.json'.
+
+    Args:
+    - targets: Targets of load_manifest.
+    - completion_client: OpenAI or AsyncOpenAI client shared by every target.
+    - output_dir: Directory of the per-target outputs (ORCHESTRATOR_OUTPUT_DIR by default).
+    - config: Process pool size and global concurrency.
+
+    Returns:
+    - The aggregate summary.
+    """
+    config = config or OrchestratorConfig()
+    output_dir = output_dir or config.ORCHESTRATOR_OUTPUT_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(config.ORCHESTRATOR_CONCURRENCY)
+    async_client = as_async_client(completion_client)
+    cache = get_review_cache()
+    store = get_review_store()
+    # Spawned workers do not inherit the logging threads and open connections of this process
+    executor = ProcessPoolExecutor(max_workers=config.ORCHESTRATOR_PROCESSES or None, mp_context=get_context("spawn"))
+    try:
+        summaries = await asyncio.gather(*(
+            review_target(target, executor, async_client, semaphore, cache, output_dir, logger, store)
+            for target in targets
+        ))
+    finally:
+        executor.shutdown(cancel_futures=True)
+        if async_client is not completion_client:
+            await async_client.close()
+        if store is not None:
+            await store.close()
+
+    summary = aggregate_summaries(list(summaries), time.perf_counter() - started)
+    summary_file = os.path.join(output_dir, "summary.json")
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=2)
+    logger.info(
+        f"Sweep of {summary['targets']} targets finished in {summary['wall_seconds']}s: "
+        f"{summary['statuses']}, summary saved to {summary_file}"
+    )
+    return summary
+
+
+def run_sweep(
+        targets: List[Target],
+        completion_client: Union[OpenAI, AsyncOpenAI],
+        logger: Union[logging.Logger, CustomLogger],
+        output_dir: Optional[str] = None,
+        config: Optional[OrchestratorConfig] = None
+) -> Dict[str, Any]:
+    """Synchronous entry point for run_sweep_async."""
+    return asyncio.run(run_sweep_async(targets, completion_client, logger, output_dir, config))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", help="JSON manifest of the targets")
+    parser.add_argument("--output-dir", help="Directory of the review outputs and summary.json")
+    args = parser.parse_args()
+    configure_tracing()
+    sweep_logger = CustomLogger(azure_connection_string=None, log_level_local="info", log_level_azure="info")
+    run_sweep(load_manifest(args.manifest), OpenAI(api_key=os.getenv("OPENAI_API_KEY")), sweep_logger, args.output_dir)
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+from typing import Optional, Union
+
+from aiohttp import web
+from openai import AsyncOpenAI, OpenAI
+
+from common.az_logger.global_logger import CustomLogger
+from common.instrumentation import configure_tracing, start_run
+from git_hub.gh_client import review_pull_request
+from open_ai.prompt.llm_prompt import SYSTEM, USER
+from service.jobs import Job, JobQueue, QueueFullError, create_job_queue
+from settings.conf import ServiceConfig
+from storage.history import pull_request_run
+from storage.store import ReviewStore, get_review_store
+
+REVIEWED_ACTIONS = {"opened", "reopened", "synchronize", "ready_for_review"}
+
+QUEUE_KEY = web.AppKey("queue", JobQueue)
+CONFIG_KEY = web.AppKey("config", ServiceConfig)
+WORKERS_KEY = web.AppKey("workers", list)
+STORE_KEY = web.AppKey("store", ReviewStore)
+
+
+def verify_signature(secret: Optional[str], body: bytes, signature: Optional[str]) -> bool:
+    """
+    Checks the X-Hub-Signature-256 header. Every request is accepted when no secret is configured,
+    which create_app only allows with SERVICE_ALLOW_UNSIGNED.
+    """
+    if not secret:
+        return True
+    if not signature:
+        return False
+    expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def job_from_event(event: str, payload: dict) -> Optional[Job]:
+    """Builds a review job from a pull_request event, or returns None for events that need no review."""
+    if event != "pull_request" or payload.get("action") not in REVIEWED_ACTIONS:
+        return None
+    pull_request = payload["pull_request"]
+    if pull_request.get("draft"):
+        return None
+    return {
+        "repo_name": payload["repository"]["full_name"],
+        "pr_number": pull_request["number"],
+        "head_sha": pull_request["head"]["sha"],
+    }
+
+
+def output_file_for(job: Job, output_dir: str) -> str:
+    return os.path.join(output_dir, f"{str(job['repo_name']).replace('/', '__')}_pr{job['pr_number']}.txt")
+
+
+async def handle_webhook(request: web.Request) -> web.Response:
+    config = request.app[CONFIG_KEY]
+    body = await request.read()
+    if not verify_signature(config.GITHUB_WEBHOOK_SECRET, body, request.headers.get("X-Hub-Signature-256")):
+        return web.json_response({"error": "invalid signature"}, status=401)
+
+    try:
+        job = job_from_event(request.headers.get("X-GitHub-Event", ""), json.loads(body))
+    except (ValueError, KeyError) as e:
+        return web.json_response({"error": f"invalid payload: {e}"}, status=400)
+    if job is None:
+        return web.json_response({"status": "ignored"})
+
+    try:
+        queued = await request.app[QUEUE_KEY].put(job)
+    except QueueFullError as e:
+        return web.json_response({"error": str(e)}, status=503, headers={"Retry-After": "30"})
+    return web.json_response({"status": "queued" if queued else "duplicate", "job": job}, status=202)
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+async def review_worker(
+        number: int,
+        queue: JobQueue,
+        config: ServiceConfig,
+        logger: Union[logging.Logger, CustomLogger],
+        completion_client: Union[OpenAI, AsyncOpenAI],
+        system_prompt: str,
+        user_prompt: str,
+        store: Optional[ReviewStore] = None
+) -> None:
+    """
+    Takes jobs from the queue one at a time; the queue never hands out two jobs of one PR at once,
+    so workers do not race on its review state or post overlapping reviews. The review itself
+    runs in a thread, because review_pull_request drives its own event loop for the per-file completions.
+    Finished runs are saved to the review history through the shared connection pool of `store`.
+    """
+    while True:
+        job = await queue.get()
+        logger.info(f"Worker {number} reviewing {job['repo_name']} PR #{job['pr_number']} at {job['head_sha']}")
+        output_file = output_file_for(job, config.SERVICE_OUTPUT_DIR)
+        report = start_run(f"{job['repo_name']}#{job['pr_number']}")
+        try:
+            plan, reviews = await asyncio.to_thread(
+                review_pull_request,
+                job['repo_name'], job['pr_number'], output_file, logger,
+                completion_client, system_prompt, user_prompt, config.SERVICE_MODEL_NAME, persist=store is None
+            )
+            if store is not None:
+                await store.save_run(pull_request_run(plan, config.SERVICE_MODEL_NAME), reviews, report)
+        except Exception as e:
+            logger.error(f"Error reviewing {job['repo_name']} PR #{job['pr_number']}: {e}")
+        finally:
+            report.save(os.path.splitext(output_file)[0] + ".report.json")
+            await queue.done(job)
+
+
+def create_app(
+        logger: Union[logging.Logger, CustomLogger],
+        completion_client: Union[OpenAI, AsyncOpenAI],
+        system_prompt: str,
+        user_prompt: str,
+        config: Optional[ServiceConfig] = None,
+        queue: Optional[JobQueue] = None
+) -> web.Application:
+    """
+    Builds the webhook application. Workers are started with the application and cancelled on shutdown.
+
+    Routes:
+    - POST /webhook: GitHub pull_request events.
+    - GET /health: liveness probe.
+
+    Raises:
+    - ValueError: When GITHUB_WEBHOOK_SECRET is not set and SERVICE_ALLOW_UNSIGNED is not enabled.
+    """
+    config = config or ServiceConfig()
+    if not config.GITHUB_WEBHOOK_SECRET and not config.SERVICE_ALLOW_UNSIGNED:
+        raise ValueError(
+            "GITHUB_WEBHOOK_SECRET is not set; set it to the webhook secret, "
+            "or set SERVICE_ALLOW_UNSIGNED=true to accept unsigned requests"
+        )
+    app = web.Application()
+    app[CONFIG_KEY] = config
+    app.router.add_post("/webhook", handle_webhook)
+    app.router.add_get("/health", handle_health)
+
+    async def start_workers(app: web.Application) -> None:
+        os.makedirs(config.SERVICE_OUTPUT_DIR, exist_ok=True)
+        app[QUEUE_KEY] = queue or create_job_queue(
+            config.SERVICE_QUEUE_BACKEND, config.SERVICE_QUEUE_SIZE, lease_seconds=config.SERVICE_JOB_LEASE_SECONDS
+        )
+        store = get_review_store()
+        if store is not None:
+            app[STORE_KEY] = store
+        app[WORKERS_KEY] = [
+            asyncio.create_task(review_worker(
+                number, app[QUEUE_KEY], config, logger, completion_client, system_prompt, user_prompt, store
+            ))
+            for number in range(config.SERVICE_WORKERS)
+        ]
+
+    async def stop_workers(app: web.Application) -> None:
+        for worker in app[WORKERS_KEY]:
+            worker.cancel()
+        await asyncio.gather(*app[WORKERS_KEY], return_exceptions=True)
+        await app[QUEUE_KEY].close()
+        if STORE_KEY in app:
+            await app[STORE_KEY].close()
+
+    app.on_startup.append(start_workers)
+    app.on_cleanup.append(stop_workers)
+    return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    service_config = ServiceConfig()
+    configure_tracing()
+    service_logger = CustomLogger(azure_connection_string=None, log_level_local="info", log_level_azure="info")
+    web.run_app(
+        create_app(
+            service_logger,
+            OpenAI(api_key=os.getenv("OPENAI_API_KEY")),
+            SYSTEM["code_review_assistant"],
+            USER["code_review"],
+            service_config
+        ),
+        host=service_config.SERVICE_HOST,
+        port=service_config.SERVICE_PORT
+    )
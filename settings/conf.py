@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 
 from pydantic import BaseModel
 from dotenv import load_dotenv
@@ -76,3 +77,188 @@ class AppInsightsConfig(BaseModel):
     APPLICATIONINSIGHTS_CONNECTION_STRING: str = os.environ.get(
         "APPLICATIONINSIGHTS_CONNECTION_STRING"
     )
+
+
+class ReviewConfig(BaseModel):
+    # ########## Review engine settings ########## #
+    REVIEW_CONCURRENCY: int = int(os.environ.get("REVIEW_CONCURRENCY", "8"))
+    REVIEW_MAX_REQUEST_TOKENS: int = int(os.environ.get("REVIEW_MAX_REQUEST_TOKENS", "12000"))
+    REVIEW_MAX_FILES_PER_REQUEST: int = int(os.environ.get("REVIEW_MAX_FILES_PER_REQUEST", "10"))
+    REVIEW_STATE_PATH: str = os.environ.get("REVIEW_STATE_PATH", ".review_state")
+    # Request JSON findings (schema.completion.findings) instead of free-text reviews
+    REVIEW_STRUCTURED_OUTPUT: bool = os.environ.get("REVIEW_STRUCTURED_OUTPUT", "true").lower() == "true"
+    # Size limit of the shared run context (branch commits, pull request description) sent before the diffs
+    REVIEW_CONTEXT_MAX_CHARS: int = int(os.environ.get("REVIEW_CONTEXT_MAX_CHARS", "4000"))
+
+
+class ReviewCacheConfig(BaseModel):
+    # ########## Review cache settings ########## #
+    REVIEW_CACHE_BACKEND: str = os.environ.get("REVIEW_CACHE_BACKEND", "disk")  # disk | redis | none
+    REVIEW_CACHE_PATH: str = os.environ.get("REVIEW_CACHE_PATH", ".review_cache/reviews.sqlite3")
+    REVIEW_CACHE_TTL: int = int(os.environ.get("REVIEW_CACHE_TTL", str(7 * 24 * 3600)))
+    REVIEW_CACHE_MAX_BYTES: int = int(os.environ.get("REVIEW_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    REVIEW_CACHE_MAX_ENTRIES: int = int(os.environ.get("REVIEW_CACHE_MAX_ENTRIES", "100000"))
+
+
+class SemanticCacheConfig(BaseModel):
+    # ########## Semantic review cache settings ########## #
+    SEMANTIC_CACHE_BACKEND: str = os.environ.get("SEMANTIC_CACHE_BACKEND", "none")  # numpy | redis | none
+    SEMANTIC_CACHE_PATH: str = os.environ.get("SEMANTIC_CACHE_PATH", ".review_cache/semantic.npz")
+    # Cosine similarity above which the review of the nearest chunk is reused
+    SEMANTIC_CACHE_THRESHOLD: float = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.97"))
+    SEMANTIC_CACHE_EMBEDDER: str = os.environ.get("SEMANTIC_CACHE_EMBEDDER", "hashing")  # hashing | openai
+    SEMANTIC_CACHE_EMBEDDING_MODEL: str = os.environ.get("SEMANTIC_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")
+    SEMANTIC_CACHE_DIMENSIONS: int = int(os.environ.get("SEMANTIC_CACHE_DIMENSIONS", "512"))
+    SEMANTIC_CACHE_MAX_ENTRIES: int = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "50000"))
+    SEMANTIC_CACHE_TTL: int = int(os.environ.get("SEMANTIC_CACHE_TTL", str(7 * 24 * 3600)))
+    SEMANTIC_CACHE_INDEX_NAME: str = os.environ.get("SEMANTIC_CACHE_INDEX_NAME", "codereviewer-reviews")
+
+
+class GitHubConfig(BaseModel):
+    # ########## GitHub API settings ########## #
+    GITHUB_TOKEN: Optional[str] = os.environ.get("GITHUB_TOKEN")
+    GITHUB_API_URL: str = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+    GITHUB_ETAG_CACHE_PATH: str = os.environ.get("GITHUB_ETAG_CACHE_PATH", ".github_cache/etags.sqlite3")
+    GITHUB_ETAG_CACHE_MAX_BYTES: int = int(os.environ.get("GITHUB_ETAG_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    GITHUB_POOL_SIZE: int = int(os.environ.get("GITHUB_POOL_SIZE", "10"))
+    GITHUB_PER_PAGE: int = int(os.environ.get("GITHUB_PER_PAGE", "100"))
+    # Post the findings of every pull request review as inline comments of one GitHub review
+    GITHUB_POST_REVIEW: bool = os.environ.get("GITHUB_POST_REVIEW", "false").lower() == "true"
+    GITHUB_REVIEW_EVENT: str = os.environ.get("GITHUB_REVIEW_EVENT", "COMMENT")  # COMMENT | REQUEST_CHANGES
+    # Inline comments per submitted review; larger reviews are split into several submissions
+    GITHUB_REVIEW_MAX_COMMENTS: int = int(os.environ.get("GITHUB_REVIEW_MAX_COMMENTS", "100"))
+    # Files of a pull request that are reviewed: comma-separated languages (review.diff.LANGUAGE_GLOBS)
+    # and path globs; a file matching any of them is reviewed
+    GITHUB_REVIEW_LANGUAGES: str = os.environ.get("GITHUB_REVIEW_LANGUAGES", "python")
+    GITHUB_REVIEW_GLOBS: str = os.environ.get("GITHUB_REVIEW_GLOBS", "")
+
+
+class OpenAIConfig(BaseModel):
+    # ########## OpenAI rate limit settings ########## #
+    # Initial budgets; they are replaced by the x-ratelimit-* headers of the first response
+    OPENAI_RPM_LIMIT: int = int(os.environ.get("OPENAI_RPM_LIMIT", "500"))
+    OPENAI_TPM_LIMIT: int = int(os.environ.get("OPENAI_TPM_LIMIT", "200000"))
+    OPENAI_EXPECTED_COMPLETION_TOKENS: int = int(os.environ.get("OPENAI_EXPECTED_COMPLETION_TOKENS", "1000"))
+    OPENAI_MAX_ATTEMPTS: int = int(os.environ.get("OPENAI_MAX_ATTEMPTS", "6"))
+    OPENAI_BACKOFF_BASE: float = float(os.environ.get("OPENAI_BACKOFF_BASE", "1"))
+    OPENAI_BACKOFF_MAX: float = float(os.environ.get("OPENAI_BACKOFF_MAX", "60"))
+
+
+class ServiceConfig(BaseModel):
+    # ########## Webhook service settings ########## #
+    SERVICE_HOST: str = os.environ.get("SERVICE_HOST", "0.0.0.0")
+    SERVICE_PORT: int = int(os.environ.get("SERVICE_PORT", "8080"))
+    SERVICE_WORKERS: int = int(os.environ.get("SERVICE_WORKERS", "4"))
+    SERVICE_QUEUE_BACKEND: str = os.environ.get("SERVICE_QUEUE_BACKEND", "memory")  # memory | redis
+    SERVICE_QUEUE_SIZE: int = int(os.environ.get("SERVICE_QUEUE_SIZE", "100"))
+    # A running job of a worker that stopped renewing its lease this long ago is requeued (redis backend)
+    SERVICE_JOB_LEASE_SECONDS: int = int(os.environ.get("SERVICE_JOB_LEASE_SECONDS", "120"))
+    SERVICE_OUTPUT_DIR: str = os.environ.get("SERVICE_OUTPUT_DIR", "reviews")
+    SERVICE_MODEL_NAME: str = os.environ.get("SERVICE_MODEL_NAME", "gpt-4o-mini")
+    GITHUB_WEBHOOK_SECRET: Optional[str] = os.environ.get("GITHUB_WEBHOOK_SECRET")
+    # Accept unsigned webhooks when no secret is set (local testing only)
+    SERVICE_ALLOW_UNSIGNED: bool = os.environ.get("SERVICE_ALLOW_UNSIGNED", "false").lower() == "true"
+
+
+class LoggingConfig(BaseModel):
+    # ########## Logging pipeline settings ########## #
+    LOG_QUEUE_SIZE: int = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+    LOG_OVERFLOW_POLICY: str = os.environ.get("LOG_OVERFLOW_POLICY", "drop_oldest")  # drop_oldest | drop_new | block
+    LOG_MAX_MESSAGE_LENGTH: int = int(os.environ.get("LOG_MAX_MESSAGE_LENGTH", "4096"))
+    AZURE_LOG_EXPORT_INTERVAL: float = float(os.environ.get("AZURE_LOG_EXPORT_INTERVAL", "15"))
+    AZURE_LOG_MAX_BATCH_SIZE: int = int(os.environ.get("AZURE_LOG_MAX_BATCH_SIZE", "100"))
+    AZURE_LOG_QUEUE_CAPACITY: int = int(os.environ.get("AZURE_LOG_QUEUE_CAPACITY", "8192"))
+
+
+class InstrumentationConfig(BaseModel):
+    # ########## Run report and tracing settings ########## #
+    RUN_REPORT_PATH: str = os.environ.get("RUN_REPORT_PATH", "run_report.json")
+    TRACING_ENABLED: bool = os.environ.get("TRACING_ENABLED", "false").lower() == "true"
+    TRACING_SAMPLING_RATE: float = float(os.environ.get("TRACING_SAMPLING_RATE", "1.0"))
+
+
+class TriageConfig(BaseModel):
+    # ########## Pre-LLM triage settings ########## #
+    TRIAGE_ENABLED: bool = os.environ.get("TRIAGE_ENABLED", "true").lower() == "true"
+    # Comma-separated path globs of files that are never sent to the model
+    TRIAGE_SKIP_GLOBS: str = os.environ.get(
+        "TRIAGE_SKIP_GLOBS",
+        "*.lock,*-lock.json,*.lock.json,*.min.js,*.min.css,*.map,*_pb2.py,*_pb2_grpc.py,*.pyi,"
+        "vendor/*,*/vendor/*,third_party/*,*/third_party/*,node_modules/*,*/node_modules/*,"
+        "*.csv,*.tsv,*.parquet,*.svg,*.png,*.jpg,*.gif,*.ico,*.pdf,*.zip"
+    )
+    # Comma-separated path globs of files reviewed by the light model
+    TRIAGE_LIGHT_GLOBS: str = os.environ.get("TRIAGE_LIGHT_GLOBS", "")
+    TRIAGE_LIGHT_MODEL: Optional[str] = os.environ.get("TRIAGE_LIGHT_MODEL")
+    TRIAGE_MAX_DIFF_BYTES: int = int(os.environ.get("TRIAGE_MAX_DIFF_BYTES", "512000"))
+    TRIAGE_MAX_LINE_LENGTH: int = int(os.environ.get("TRIAGE_MAX_LINE_LENGTH", "1000"))
+    TRIAGE_AST_MAX_BYTES: int = int(os.environ.get("TRIAGE_AST_MAX_BYTES", "300000"))
+
+
+class SymbolIndexConfig(BaseModel):
+    # ########## Symbol index (context enrichment) settings ########## #
+    SYMBOL_INDEX_ENABLED: bool = os.environ.get("SYMBOL_INDEX_ENABLED", "true").lower() == "true"
+    # Relative paths are placed inside the .git directory of the reviewed repository
+    SYMBOL_INDEX_PATH: str = os.environ.get("SYMBOL_INDEX_PATH", "codereviewer/symbols.sqlite3")
+    SYMBOL_INDEX_MAX_FILE_BYTES: int = int(os.environ.get("SYMBOL_INDEX_MAX_FILE_BYTES", "1000000"))
+    # Commits kept in the index, so concurrent reviews of several branches do not evict each other
+    SYMBOL_INDEX_MAX_COMMITS: int = int(os.environ.get("SYMBOL_INDEX_MAX_COMMITS", "8"))
+    # Token budget of the related code attached to one file diff
+    SYMBOL_CONTEXT_MAX_TOKENS: int = int(os.environ.get("SYMBOL_CONTEXT_MAX_TOKENS", "1500"))
+
+
+class OrchestratorConfig(BaseModel):
+    # ########## Multi-repository sweep settings ########## #
+    # Processes collecting git diffs; 0 uses one per CPU
+    ORCHESTRATOR_PROCESSES: int = int(os.environ.get("ORCHESTRATOR_PROCESSES", "0"))
+    # Completions in flight across all targets of a sweep
+    ORCHESTRATOR_CONCURRENCY: int = int(os.environ.get("ORCHESTRATOR_CONCURRENCY", "16"))
+    ORCHESTRATOR_OUTPUT_DIR: str = os.environ.get("ORCHESTRATOR_OUTPUT_DIR", "reviews/sweep")
+
+
+class WorkspaceConfig(BaseModel):
+    # ########## Remote repository workspace settings ########## #
+    WORKSPACE_ROOT: str = os.environ.get("WORKSPACE_ROOT", ".workspaces")
+    WORKSPACE_QUOTA_BYTES: int = int(os.environ.get("WORKSPACE_QUOTA_BYTES", str(20 * 1024 ** 3)))
+    # Partial clone filter of the fetches ('' fetches full objects), blob contents are fetched on demand
+    WORKSPACE_FETCH_FILTER: str = os.environ.get("WORKSPACE_FETCH_FILTER", "blob:none")
+    # History depth of the fetched refs, 0 fetches the full history (of commits and trees)
+    WORKSPACE_FETCH_DEPTH: int = int(os.environ.get("WORKSPACE_FETCH_DEPTH", "0"))
+    # Age after which a mirror lock or an unrenewed review lease is considered abandoned by a crashed process
+    WORKSPACE_LOCK_TIMEOUT: float = float(os.environ.get("WORKSPACE_LOCK_TIMEOUT", "600"))
+
+
+class RouterConfig(BaseModel):
+    # ########## Model cascade settings ########## #
+    # Routing is enabled when a strong model is configured
+    ROUTER_STRONG_MODEL: Optional[str] = os.environ.get("ROUTER_STRONG_MODEL")
+    # First-pass model of low-risk chunks, the model passed by the caller by default
+    ROUTER_SMALL_MODEL: Optional[str] = os.environ.get("ROUTER_SMALL_MODEL")
+    # Chunks with a risk score (0..1) at or above this go to the strong model directly
+    ROUTER_STRONG_SCORE: float = float(os.environ.get("ROUTER_STRONG_SCORE", "0.5"))
+    # Severities of first-pass findings that send a chunk to the strong model for a second review
+    ROUTER_ESCALATE_SEVERITIES: str = os.environ.get("ROUTER_ESCALATE_SEVERITIES", "critical,major")
+    # Changed lines at which the size signal saturates
+    ROUTER_SIZE_LINES: int = int(os.environ.get("ROUTER_SIZE_LINES", "200"))
+    ROUTER_RISKY_GLOBS: str = os.environ.get(
+        "ROUTER_RISKY_GLOBS", "*auth*,*security*,*crypto*,*payment*,*billing*,*migrations/*,*settings*,*permissions*"
+    )
+    # USD per million input/output tokens, model=input/output
+    ROUTER_MODEL_PRICES: str = os.environ.get(
+        "ROUTER_MODEL_PRICES", "gpt-4o-mini=0.15/0.60,gpt-4o=2.50/10.00,gpt-4.1-mini=0.40/1.60,gpt-4.1=2.00/8.00"
+    )
+    ROUTER_LOG_PATH: str = os.environ.get("ROUTER_LOG_PATH", "routing_decisions.jsonl")
+
+
+class StorageConfig(BaseModel):
+    # ########## Review history database settings ########## #
+    STORAGE_BACKEND: str = os.environ.get("STORAGE_BACKEND", "none")  # sqlite | mysql | azure | none
+    STORAGE_SQLITE_PATH: str = os.environ.get("STORAGE_SQLITE_PATH", ".review_store/reviews.sqlite3")
+    # Any SQLAlchemy async URL; overrides the URL of the backend
+    STORAGE_DATABASE_URL: Optional[str] = os.environ.get("STORAGE_DATABASE_URL")
+    STORAGE_POOL_SIZE: int = int(os.environ.get("STORAGE_POOL_SIZE", "5"))
+    STORAGE_MAX_OVERFLOW: int = int(os.environ.get("STORAGE_MAX_OVERFLOW", "10"))
+    # Seconds after which pooled connections are reopened (MySQL and Azure SQL close idle connections)
+    STORAGE_POOL_RECYCLE: int = int(os.environ.get("STORAGE_POOL_RECYCLE", "1800"))
+    # Rows per bulk INSERT statement
+    STORAGE_INSERT_BATCH_SIZE: int = int(os.environ.get("STORAGE_INSERT_BATCH_SIZE", "500"))
@@ -0,0 +1,157 @@
+"""
+Review history records: the rows of one review run, and saving them from synchronous code.
+
+SQLAlchemy is imported by storage.store only when a storage backend is configured, so the
+reviewers do not pay for it otherwise.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional, Union
+
+from common.az_logger.global_logger import CustomLogger
+from common.instrumentation import RunReport
+from settings.conf import AzureDatabaseConfig, MysqlDatabaseConfig, StorageConfig
+
+LOCAL = "local"
+GITHUB = "github"
+
+
+def database_url(config: Optional[StorageConfig] = None) -> Optional[str]:
+    """
+    Async SQLAlchemy URL of the configured backend, None when the history is disabled.
+
+    Raises:
+    - ValueError: When STORAGE_BACKEND is unknown.
+    """
+    config = config or StorageConfig()
+    if config.STORAGE_DATABASE_URL:
+        return config.STORAGE_DATABASE_URL
+    backend = config.STORAGE_BACKEND.lower()
+    if backend == "none":
+        return None
+    if backend == "sqlite":
+        os.makedirs(os.path.dirname(os.path.abspath(config.STORAGE_SQLITE_PATH)), exist_ok=True)
+        return f"sqlite+aiosqlite:///{config.STORAGE_SQLITE_PATH}"
+    if backend == "mysql":
+        return MysqlDatabaseConfig().ASYNC_DATABASE_URL
+    if backend == "azure":
+        return AzureDatabaseConfig().SQL_ALCHEMY_ASYNC_CONN_STR
+    raise ValueError(f"Unknown storage backend: {config.STORAGE_BACKEND}")
+
+
+def local_run(
+        repository: str,
+        branch_name: str,
+        base_branch: str,
+        head_sha: Optional[str],
+        gpt_model: str
+) -> Dict[str, Any]:
+    """Review target of a local (or mirrored remote) branch."""
+    return {
+        'kind': LOCAL, 'name': f"{os.path.basename(repository.rstrip('/'))}@{branch_name}",
+        'repository': repository, 'pr_number': None, 'branch': branch_name, 'base_ref': base_branch,
+        'head_sha': head_sha, 'model': gpt_model,
+    }
+
+
+def pull_request_run(plan: Dict, gpt_model: str) -> Dict[str, Any]:
+    """Review target of a pull request plan (git_hub.gh_client.prepare_pull_request_review)."""
+    return {
+        'kind': GITHUB, 'name': f"{plan['repo_name']}#{plan['pr_number']}",
+        'repository': plan['repo_name'], 'pr_number': plan['pr_number'], 'branch': None, 'base_ref': None,
+        'head_sha': plan['head_sha'], 'model': gpt_model,
+    }
+
+
+def build_rows(
+        run: Dict[str, Any],
+        reviews: List[Dict],
+        report: RunReport,
+        status: Optional[str] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Converts a review run into the rows of storage.models, keyed by table name.
+
+    Args:
+    - run: Review target of local_run or pull_request_run.
+    - reviews: Results per file (review.engine.review_files).
+    - report: Run report with the token usage and stage timings of the run.
+    - status: 'reviewed', 'no_changes' or 'failed'; derived from `reviews` by default.
+    """
+    report_data = report.to_dict()
+    target = {'repository': run['repository'], 'pr_number': run['pr_number'], 'head_sha': run['head_sha']}
+    files, findings = [], []
+    for review in reviews:
+        path = review['filename']
+        file_findings = review.get('findings')
+        files.append({
+            'run_id': report.run_id, **target, 'path': path, 'tier': review.get('tier'), 'full': review.get('full'),
+            'cached': bool(review.get('cached')), 'failed': review['comments'] is None,
+            'findings': len(file_findings) if file_findings is not None else None, 'comments': review['comments'],
+        })
+        for finding in file_findings or []:
+            findings.append({
+                'run_id': report.run_id, **target, 'path': path,
+                'start_line': finding.start_line, 'end_line': finding.end_line,
+                'severity': finding.severity.value, 'category': finding.category.value,
+                'title': finding.title, 'suggestion': finding.suggestion,
+            })
+    run_row = {
+        'id': report.run_id, **run, 'status': status or ('reviewed' if reviews else 'no_changes'),
+        'started_at': report.started_at, 'wall_seconds': report_data['wall_seconds'],
+        'files': len(files), 'failed_files': sum(row['failed'] for row in files),
+        'cached_files': sum(row['cached'] for row in files), 'findings': len(findings),
+        'counters': report_data['counters'],
+    }
+    return {
+        'review_runs': [run_row],
+        'review_files': files,
+        'review_findings': findings,
+        'token_usage': [
+            {'run_id': report.run_id, 'model': model, 'requests': usage['requests'],
+             'prompt_tokens': usage['prompt_tokens'], 'cached_prompt_tokens': usage['cached_prompt_tokens'],
+             'completion_tokens': usage['completion_tokens']}
+            for model, usage in report_data['models'].items()
+        ],
+        'stage_timings': [
+            {'run_id': report.run_id, 'stage': stage, **stats} for stage, stats in report_data['stages'].items()
+        ],
+    }
+
+
+def save_review_run(
+        run: Dict[str, Any],
+        reviews: List[Dict],
+        logger: Union[logging.Logger, CustomLogger],
+        status: Optional[str] = None,
+        config: Optional[StorageConfig] = None
+) -> Optional[str]:
+    """
+    Saves a finished run of a synchronous reviewer to the review history, with the report of the
+    current run. Long-running services keep one storage.store.ReviewStore (and its connection
+    pool) instead. Errors are logged and do not fail the review.
+
+    Returns:
+    - The run id, or None when the history is disabled or saving failed.
+    """
+    config = config or StorageConfig()
+    try:
+        url = database_url(config)
+        if url is None:
+            return None
+        from storage.store import ReviewStore
+
+        async def save() -> str:
+            store = ReviewStore(url, config)
+            try:
+                return await store.save_run(run, reviews, status=status)
+            finally:
+                await store.close()
+
+        run_id = asyncio.run(save())
+    except Exception as e:
+        logger.error(f"Error saving the review history of {run['name']}: {e}")
+        return None
+    logger.info(f"Review history of {run['name']} saved as run {run_id}")
+    return run_id
@@ -0,0 +1,111 @@
+"""
+Tables of the review history database.
+
+Every table repeats the review target (repository, pull request, head SHA), so history and
+dashboard queries filter by index without joining review_runs. String lengths keep the
+composite indexes within the key size limits of MySQL (utf8mb4) and Azure SQL.
+"""
+from sqlalchemy import (
+    JSON,
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+)
+
+metadata = MetaData()
+
+REPOSITORY_LENGTH = 255
+PATH_LENGTH = 400
+SHA_LENGTH = 40
+
+
+def _target_columns():
+    return [
+        Column("repository", String(REPOSITORY_LENGTH), nullable=False),
+        Column("pr_number", Integer),
+        Column("head_sha", String(SHA_LENGTH)),
+    ]
+
+
+review_runs = Table(
+    "review_runs", metadata,
+    Column("id", String(32), primary_key=True),
+    Column("name", String(REPOSITORY_LENGTH + 64)),
+    Column("kind", String(16), nullable=False),
+    *_target_columns(),
+    Column("branch", String(255)),
+    Column("base_ref", String(255)),
+    Column("model", String(64)),
+    Column("status", String(16), nullable=False),
+    Column("started_at", DateTime(timezone=True), nullable=False),
+    Column("wall_seconds", Float),
+    Column("files", Integer, nullable=False, default=0),
+    Column("failed_files", Integer, nullable=False, default=0),
+    Column("cached_files", Integer, nullable=False, default=0),
+    Column("findings", Integer, nullable=False, default=0),
+    Column("counters", JSON),
+    Index("ix_review_runs_target", "repository", "pr_number", "head_sha"),
+    Index("ix_review_runs_started_at", "started_at"),
+)
+
+review_files = Table(
+    "review_files", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("run_id", String(32), ForeignKey("review_runs.id", ondelete="CASCADE"), nullable=False),
+    *_target_columns(),
+    Column("path", String(PATH_LENGTH), nullable=False),
+    Column("tier", String(16)),
+    Column("full", Boolean),
+    Column("cached", Boolean, nullable=False, default=False),
+    Column("failed", Boolean, nullable=False, default=False),
+    Column("findings", Integer),
+    Column("comments", Text),
+    Index("ix_review_files_target", "repository", "pr_number", "head_sha", "path"),
+    Index("ix_review_files_run", "run_id"),
+)
+
+review_findings = Table(
+    "review_findings", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("run_id", String(32), ForeignKey("review_runs.id", ondelete="CASCADE"), nullable=False),
+    *_target_columns(),
+    Column("path", String(PATH_LENGTH), nullable=False),
+    Column("start_line", Integer),
+    Column("end_line", Integer),
+    Column("severity", String(16), nullable=False),
+    Column("category", String(32)),
+    Column("title", Text),
+    Column("suggestion", Text),
+    Index("ix_review_findings_target", "repository", "pr_number", "head_sha", "path"),
+    Index("ix_review_findings_run", "run_id"),
+)
+
+token_usage = Table(
+    "token_usage", metadata,
+    Column("run_id", String(32), ForeignKey("review_runs.id", ondelete="CASCADE"), primary_key=True),
+    Column("model", String(64), primary_key=True),
+    Column("requests", Integer, nullable=False),
+    Column("prompt_tokens", Integer, nullable=False),
+    Column("cached_prompt_tokens", Integer, nullable=False),
+    Column("completion_tokens", Integer, nullable=False),
+)
+
+stage_timings = Table(
+    "stage_timings", metadata,
+    Column("run_id", String(32), ForeignKey("review_runs.id", ondelete="CASCADE"), primary_key=True),
+    Column("stage", String(64), primary_key=True),
+    Column("calls", Integer, nullable=False),
+    Column("errors", Integer, nullable=False),
+    Column("total_seconds", Float, nullable=False),
+    Column("mean_seconds", Float),
+    Column("p95_seconds", Float),
+    Column("max_seconds", Float),
+)
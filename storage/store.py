@@ -0,0 +1,247 @@
+"""
+Async review history database.
+
+    python -m storage.store runs --repository owner/repo --pr 12
+    python -m storage.store findings --repository owner/repo --severity critical,major
+
+Runs, files, findings, token usage and stage timings are written in one transaction per run
+with bulk INSERTs, so a run is either stored completely or not at all. Works with MySQL
+(aiomysql), Azure SQL (aioodbc) and SQLite (aiosqlite) for local use.
+"""
+import argparse
+import asyncio
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import Table, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from common.instrumentation import RunReport, get_run_report
+from settings.conf import StorageConfig
+from storage.history import build_rows, database_url
+from storage.models import metadata, review_files, review_findings, review_runs, stage_timings, token_usage
+
+TABLES = (review_runs, review_files, review_findings, token_usage, stage_timings)
+
+
+def _where(table: Table, **values: Any) -> List[Any]:
+    """Equality conditions for the values that are not None."""
+    return [table.c[column] == value for column, value in values.items() if value is not None]
+
+
+def _rows(result: Any) -> List[Dict[str, Any]]:
+    return [dict(row._mapping) for row in result]
+
+
+class ReviewStore:
+    """
+    Review history on a pooled async engine. One store (and pool) is shared by all reviews of a
+    process and must be used from a single event loop; close it on shutdown.
+    """
+
+    def __init__(self, url: str, config: Optional[StorageConfig] = None):
+        self.config = config or StorageConfig()
+        options: Dict[str, Any] = {"pool_pre_ping": True}
+        if not url.startswith("sqlite"):
+            options.update(
+                pool_size=self.config.STORAGE_POOL_SIZE,
+                max_overflow=self.config.STORAGE_MAX_OVERFLOW,
+                pool_recycle=self.config.STORAGE_POOL_RECYCLE,
+            )
+        self.engine: AsyncEngine = create_async_engine(url, **options)
+        self._schema_lock: Optional[asyncio.Lock] = None
+        self._schema_ready = False
+
+    async def create_schema(self) -> None:
+        """Creates the missing tables and indexes."""
+        async with self.engine.begin() as connection:
+            await connection.run_sync(metadata.create_all)
+        self._schema_ready = True
+
+    async def _ensure_schema(self) -> None:
+        if self._schema_ready:
+            return
+        self._schema_lock = self._schema_lock or asyncio.Lock()
+        async with self._schema_lock:
+            if not self._schema_ready:
+                await self.create_schema()
+
+    async def save_run(
+            self,
+            run: Dict[str, Any],
+            reviews: List[Dict],
+            report: Optional[RunReport] = None,
+            status: Optional[str] = None
+    ) -> str:
+        """
+        Stores a finished review run.
+
+        Args:
+        - run: Review target of storage.history.local_run or pull_request_run.
+        - reviews: Results per file (review.engine.review_files).
+        - report: Run report of the run (the report of the current context by default).
+        - status: 'reviewed', 'no_changes' or 'failed'; derived from `reviews` by default.
+
+        Returns:
+        - The run id (the run_id of the report).
+        """
+        await self._ensure_schema()
+        rows = build_rows(run, reviews, report or get_run_report(), status)
+        batch_size = self.config.STORAGE_INSERT_BATCH_SIZE
+        async with self.engine.begin() as connection:
+            for table in TABLES:
+                table_rows = rows[table.name]
+                for start in range(0, len(table_rows), batch_size):
+                    await connection.execute(insert(table), table_rows[start:start + batch_size])
+        return rows['review_runs'][0]['id']
+
+    async def _fetch(self, statement: Any) -> List[Dict[str, Any]]:
+        await self._ensure_schema()
+        async with self.engine.connect() as connection:
+            return _rows(await connection.execute(statement))
+
+    async def runs(
+            self,
+            repository: Optional[str] = None,
+            pr_number: Optional[int] = None,
+            head_sha: Optional[str] = None,
+            status: Optional[str] = None,
+            since: Optional[datetime] = None,
+            limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """Runs of a repository, pull request or commit, newest first."""
+        conditions = _where(review_runs, repository=repository, pr_number=pr_number, head_sha=head_sha, status=status)
+        if since is not None:
+            conditions.append(review_runs.c.started_at >= since)
+        return await self._fetch(
+            select(review_runs).where(*conditions).order_by(review_runs.c.started_at.desc()).limit(limit)
+        )
+
+    async def files(
+            self,
+            run_id: Optional[str] = None,
+            repository: Optional[str] = None,
+            pr_number: Optional[int] = None,
+            head_sha: Optional[str] = None,
+            path: Optional[str] = None,
+            limit: int = 1000
+    ) -> List[Dict[str, Any]]:
+        """Reviewed files of a run, or the review history of a file, newest first."""
+        conditions = _where(
+            review_files, run_id=run_id, repository=repository, pr_number=pr_number, head_sha=head_sha, path=path
+        )
+        return await self._fetch(
+            select(review_files).where(*conditions).order_by(review_files.c.id.desc()).limit(limit)
+        )
+
+    async def findings(
+            self,
+            run_id: Optional[str] = None,
+            repository: Optional[str] = None,
+            pr_number: Optional[int] = None,
+            head_sha: Optional[str] = None,
+            path: Optional[str] = None,
+            severities: Optional[Iterable[str]] = None,
+            limit: int = 1000
+    ) -> List[Dict[str, Any]]:
+        """Structured findings matching the filters, newest first."""
+        conditions = _where(
+            review_findings, run_id=run_id, repository=repository, pr_number=pr_number, head_sha=head_sha, path=path
+        )
+        if severities:
+            conditions.append(review_findings.c.severity.in_(list(severities)))
+        return await self._fetch(
+            select(review_findings).where(*conditions).order_by(review_findings.c.id.desc()).limit(limit)
+        )
+
+    async def usage(
+            self,
+            repository: Optional[str] = None,
+            since: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        """Token usage per model, summed over the matching runs."""
+        conditions = _where(review_runs, repository=repository)
+        if since is not None:
+            conditions.append(review_runs.c.started_at >= since)
+        statement = (
+            select(
+                token_usage.c.model,
+                func.count().label('runs'),
+                func.sum(token_usage.c.requests).label('requests'),
+                func.sum(token_usage.c.prompt_tokens).label('prompt_tokens'),
+                func.sum(token_usage.c.cached_prompt_tokens).label('cached_prompt_tokens'),
+                func.sum(token_usage.c.completion_tokens).label('completion_tokens'),
+            )
+            .join(review_runs, review_runs.c.id == token_usage.c.run_id)
+            .where(*conditions)
+            .group_by(token_usage.c.model)
+        )
+        return await self._fetch(statement)
+
+    async def timings(
+            self,
+            repository: Optional[str] = None,
+            since: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        """Wall time per pipeline stage, summed over the matching runs."""
+        conditions = _where(review_runs, repository=repository)
+        if since is not None:
+            conditions.append(review_runs.c.started_at >= since)
+        statement = (
+            select(
+                stage_timings.c.stage,
+                func.sum(stage_timings.c.calls).label('calls'),
+                func.sum(stage_timings.c.errors).label('errors'),
+                func.sum(stage_timings.c.total_seconds).label('total_seconds'),
+                func.max(stage_timings.c.max_seconds).label('max_seconds'),
+            )
+            .join(review_runs, review_runs.c.id == stage_timings.c.run_id)
+            .where(*conditions)
+            .group_by(stage_timings.c.stage)
+        )
+        return await self._fetch(statement)
+
+    async def close(self) -> None:
+        await self.engine.dispose()
+
+
+def get_review_store(config: Optional[StorageConfig] = None) -> Optional[ReviewStore]:
+    """Creates the store of the configured backend, or None when the review history is disabled."""
+    config = config or StorageConfig()
+    url = database_url(config)
+    return ReviewStore(url, config) if url else None
+
+
+async def _query(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    store = get_review_store()
+    if store is None:
+        raise SystemExit("The review history is disabled, set STORAGE_BACKEND")
+    try:
+        if args.query == "runs":
+            return await store.runs(args.repository, args.pr, args.sha, limit=args.limit)
+        if args.query == "files":
+            return await store.files(args.run, args.repository, args.pr, args.sha, args.path, limit=args.limit)
+        if args.query == "findings":
+            severities = args.severity.split(',') if args.severity else None
+            return await store.findings(
+                args.run, args.repository, args.pr, args.sha, args.path, severities, limit=args.limit
+            )
+        if args.query == "usage":
+            return await store.usage(args.repository)
+        return await store.timings(args.repository)
+    finally:
+        await store.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("query", choices=("runs", "files", "findings", "usage", "timings"))
+    parser.add_argument("--repository", help="Repository name (owner/repo), path or URL")
+    parser.add_argument("--pr", type=int, help="Pull request number")
+    parser.add_argument("--sha", help="Head SHA")
+    parser.add_argument("--path", help="File path")
+    parser.add_argument("--run", help="Run id")
+    parser.add_argument("--severity", help="Comma-separated severities of the findings")
+    parser.add_argument("--limit", type=int, default=100)
+    print(json.dumps(asyncio.run(_query(parser.parse_args())), indent=2, default=str))
@@ -0,0 +1,151 @@
+import pytest
+
+from open_ai.tokens import count_tokens
+from review.chunker import RequestPacker, assign_review, build_request_changes, split_file_diff
+from review.diff import parse_file_diff
+
+MODEL = "gpt-4o-mini"
+HEADER = "diff --git a/app.py b/app.py\n--- a/app.py\n+++ b/app.py\n"
+
+
+def _piece(filename, tokens=10, part=1, parts=1):
+    return {'filename': filename, 'changes': f"@@ -1 +1 @@\n+{filename}\n", 'part': part, 'parts': parts,
+            'tokens': tokens}
+
+
+def _finding(file, line=1):
+    return (
+        f'{{"file": "{file}", "start_line": {line}, "end_line": {line}, "severity": "minor", '
+        f'"category": "style", "title": "Naming", "suggestion": "Rename it."}}'
+    )
+
+
+def test_packer_closes_a_request_at_the_token_limit():
+    packer = RequestPacker(max_tokens=25, max_files=10)
+
+    assert packer.add(_piece("a.py")) == []
+    assert packer.add(_piece("b.py")) == []
+    ready = packer.add(_piece("c.py"))
+
+    assert [[piece['filename'] for piece in request] for request in ready] == [["a.py", "b.py"]]
+    assert [piece['filename'] for request in packer.flush() for piece in request] == ["c.py"]
+    assert packer.flush() == []
+
+
+def test_packer_closes_a_request_at_the_file_limit():
+    packer = RequestPacker(max_tokens=1000, max_files=2)
+
+    ready = [request for name in ("a.py", "b.py", "c.py", "d.py", "e.py") for request in packer.add(_piece(name))]
+    ready += packer.flush()
+
+    assert [len(request) for request in ready] == [2, 2, 1]
+
+
+def test_packer_sends_an_oversized_piece_alone():
+    packer = RequestPacker(max_tokens=25, max_files=10)
+
+    assert packer.add(_piece("big.py", tokens=100)) == []
+    ready = packer.add(_piece("small.py"))
+
+    assert [[piece['filename'] for piece in request] for request in ready] == [["big.py"]]
+
+
+def test_small_diff_is_one_piece():
+    changes = HEADER + "@@ -1,1 +1,1 @@\n-a = 1\n+a = 2\n"
+
+    pieces = split_file_diff({'filename': "app.py", 'changes': changes}, 1000, MODEL)
+
+    assert len(pieces) == 1
+    assert pieces[0]['changes'] is changes
+    assert (pieces[0]['part'], pieces[0]['parts']) == (1, 1)
+
+
+def test_oversized_hunk_parts_get_their_own_hunk_headers():
+    lines = [f" context_{i} = {i}" if i % 3 == 0 else f"+added_{i} = {i}" for i in range(60)]
+    old_length = sum(line.startswith(' ') for line in lines)
+    changes = HEADER + f"@@ -5,{old_length} +5,{len(lines)} @@ def main():\n" + "\n".join(lines) + "\n"
+    original = parse_file_diff(changes)
+    max_tokens = count_tokens(changes, MODEL) // 3
+
+    pieces = split_file_diff({'filename': "app.py", 'changes': changes}, max_tokens, MODEL)
+
+    assert len(pieces) > 1
+    assert [piece['part'] for piece in pieces] == list(range(1, len(pieces) + 1))
+    new_lines = []
+    for piece in pieces:
+        assert piece['changes'].startswith(HEADER)
+        part = parse_file_diff(piece['changes'])
+        assert len(part.hunks) == 1
+        assert part.line(0).endswith("@@ def main():")
+        # The header of every part states the new-file line numbers of its own lines
+        new_lines += list(part.new_lines)
+        assert part.hunks[0].new_start == part.new_lines[0]
+        assert part.hunks[0].new_length == len(part.new_lines)
+    assert new_lines == list(original.new_lines)
+
+
+def test_packed_request_labels_every_piece():
+    pieces = [_piece("a.py"), _piece("b.py", part=2, parts=3)]
+
+    text = build_request_changes(pieces)
+
+    assert "### File: a.py\n" in text
+    assert "### File: b.py (part 2/3)\n" in text
+
+
+def test_single_piece_gets_the_whole_review():
+    pieces = [_piece("a.py")]
+
+    assert assign_review(pieces, "Looks good.", structured=False) == ["Looks good."]
+    assert pieces[0]['comments'] == "Looks good."
+
+
+def test_packed_review_is_split_by_file_headers():
+    pieces = [_piece("a.py"), _piece("b.py", part=2, parts=3)]
+    review = "### Review for `a.py`:\nRename x.\n\n### Review for b.py (part 2/3)\nNo issues."
+
+    values = assign_review(pieces, review, structured=False)
+
+    assert values == ["Rename x.", "No issues."]
+    assert [piece['comments'] for piece in pieces] == values
+
+
+def test_unattributed_pieces_are_left_for_a_retry():
+    pieces = [_piece("a.py"), _piece("b.py")]
+
+    values = assign_review(pieces, "### Review for a.py\nRename x.", structured=False)
+
+    assert values == ["Rename x.", None]
+    assert pieces[0]['comments'] == "Rename x."
+    assert 'comments' not in pieces[1]
+
+
+def test_review_without_file_headers_is_not_attributed():
+    pieces = [_piece("a.py"), _piece("b.py")]
+
+    assert assign_review(pieces, "Everything looks fine.", structured=False) == [None, None]
+    assert all('comments' not in piece for piece in pieces)
+
+
+def test_structured_findings_are_attributed_by_label():
+    pieces = [_piece("a.py"), _piece("b.py", part=2, parts=3)]
+    review = f'{{"findings": [{_finding("b.py (part 2/3)", 7)}, {_finding("a.py")}]}}'
+
+    values = assign_review(pieces, review, structured=True)
+
+    assert all(value is not None for value in values)
+    assert [[finding.file for finding in piece['findings']] for piece in pieces] == [["a.py"], ["b.py"]]
+    assert pieces[1]['findings'][0].start_line == 7
+
+
+def test_structured_finding_with_unknown_label_is_not_attributed():
+    pieces = [_piece("a.py"), _piece("b.py")]
+    review = f'{{"findings": [{_finding("a.py")}, {_finding("c.py")}]}}'
+
+    assert assign_review(pieces, review, structured=True) == [None, None]
+    assert all('findings' not in piece for piece in pieces)
+
+
+def test_invalid_structured_review_raises():
+    with pytest.raises(ValueError):
+        assign_review([_piece("a.py")], "not json", structured=True)
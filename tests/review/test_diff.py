@@ -0,0 +1,115 @@
+import pickle
+
+from review.diff import ADDED, CONTEXT, HUNK, NO_NEWLINE, REMOVED, file_diff, parse_file_diff
+
+GIT_FILE_DIFF = (
+    "diff --git a/pkg/x.py b/pkg/x.py\n"
+    "index 1111111..2222222 100644\n"
+    "--- a/pkg/x.py\n"
+    "+++ b/pkg/x.py\n"
+    "@@ -1,4 +1,5 @@ def f():\n"
+    " one\n"
+    "-two\n"
+    "+TWO\n"
+    "+three\n"
+    "\n"
+    " four\n"
+    "\\ No newline at end of file\n"
+)
+
+TWO_HUNK_PATCH = (
+    "@@ -1,2 +1,2 @@\n"
+    "-a\n"
+    "+A\n"
+    " b\n"
+    "@@ -10,2 +10,3 @@ class C:\n"
+    " x\n"
+    "+y\n"
+    " z"
+)
+
+
+def test_git_file_diff_header_and_path():
+    diff = parse_file_diff(GIT_FILE_DIFF)
+
+    assert diff.path == "pkg/x.py"
+    assert diff.header_lines() == [
+        "diff --git a/pkg/x.py b/pkg/x.py", "index 1111111..2222222 100644", "--- a/pkg/x.py", "+++ b/pkg/x.py"
+    ]
+    assert diff.changes is GIT_FILE_DIFF
+
+
+def test_lines_are_numbered_from_the_first_hunk_header():
+    diff = parse_file_diff(GIT_FILE_DIFF)
+
+    assert list(diff.kinds) == [HUNK, CONTEXT, REMOVED, ADDED, ADDED, CONTEXT, CONTEXT, NO_NEWLINE]
+    assert diff.line(0) == "@@ -1,4 +1,5 @@ def f():"
+    assert diff.line(3) == "+TWO"
+    assert diff.line(7) == "\\ No newline at end of file"
+    assert diff.hunk_ranges() == [(1, 5)]
+    assert diff.first_new_line == 1
+
+
+def test_added_and_removed_lines():
+    diff = parse_file_diff(GIT_FILE_DIFF)
+
+    assert diff.added_lines() == ["TWO", "three"]
+    assert diff.removed_lines() == ["two"]
+
+
+def test_position_of_context_and_added_lines():
+    diff = parse_file_diff(GIT_FILE_DIFF)
+
+    # The hunk header is position 0, so the first line of the hunk is position 1
+    assert diff.position(1, 1) == 1
+    assert diff.position(2, 2) == 3
+    assert diff.position(2, 3) == 4
+    # An empty line is a context line whose leading space was stripped
+    assert diff.position(4, 4) == 5
+    # "\ No newline at end of file" is not a line of the new file
+    assert diff.position(5, 5) == 6
+    assert diff.position(6, 6) is None
+    assert diff.position(0, 0) is None
+
+
+def test_position_counts_later_hunk_headers():
+    diff = parse_file_diff(TWO_HUNK_PATCH, path="pkg/c.py")
+
+    assert diff.path == "pkg/c.py"
+    assert diff.header_lines() == []
+    assert diff.hunk_ranges() == [(1, 2), (10, 3)]
+    assert diff.position(1, 1) == 2
+    assert diff.position(11, 11) == 6
+    assert diff.position(12, 12) == 7
+    # Lines between the hunks are not in the diff
+    assert diff.position(5, 5) is None
+    # A range ending between hunks anchors to its last line inside the diff
+    assert diff.position(2, 5) == 3
+
+
+def test_slice_keeps_the_text_of_the_lines():
+    diff = parse_file_diff(TWO_HUNK_PATCH)
+
+    first, second = diff.hunks
+    assert diff.slice(first.first, first.last) == "@@ -1,2 +1,2 @@\n-a\n+A\n b"
+    assert diff.slice(second.first, second.last) == "@@ -10,2 +10,3 @@ class C:\n x\n+y\n z"
+
+
+def test_file_diff_reparses_replaced_changes():
+    file_data = {'filename': "pkg/c.py", 'changes': TWO_HUNK_PATCH}
+    diff = file_diff(file_data)
+    assert file_diff(file_data) is diff
+
+    copied = {**file_data, 'changes': GIT_FILE_DIFF}
+    assert file_diff(copied) is not diff
+    assert file_diff(copied).hunk_ranges() == [(1, 5)]
+
+
+def test_pickled_diff_keeps_its_lines():
+    diff = parse_file_diff(GIT_FILE_DIFF)
+
+    restored = pickle.loads(pickle.dumps(diff))
+
+    assert restored.path == diff.path
+    assert list(restored.kinds) == list(diff.kinds)
+    assert restored.position(4, 4) == 5
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import re
+
+from openai import AsyncOpenAI
+
+import review.engine
+from review.cache import ReviewCache
+from review.engine import review_files_async
+
+MODEL = "gpt-4o-mini"
+
+
+class DictReviewCache(ReviewCache):
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+
+def _files(*names):
+    return [
+        {'filename': name, 'changes': f"diff --git a/{name} b/{name}\n@@ -1 +1 @@\n-old\n+new_{index}\n"}
+        for index, name in enumerate(names)
+    ]
+
+
+def _review(files, monkeypatch, answer, cache=None):
+    requests = []
+
+    async def fake_completion(client, *, user_prompt, **kwargs):
+        requests.append(re.findall(r'^### File: (.+)$', user_prompt, re.MULTILINE))
+        return answer(requests[-1])
+
+    monkeypatch.setattr(review.engine, "create_completion_async", fake_completion)
+    reviews = asyncio.run(review_files_async(
+        files, AsyncOpenAI(api_key="test"), "system", "Review:\n{}", MODEL, logging.getLogger(__name__),
+        concurrency=2, cache=cache, max_tokens=10000, structured=False, router=None, semantic=None
+    ))
+    return reviews, requests
+
+
+def test_packed_review_is_mapped_to_every_file(monkeypatch):
+    def answer(labels):
+        return "\n\n".join(f"### Review for {label}\nReview of {label}." for label in labels)
+
+    reviews, requests = _review(_files("a.py", "b.py", "c.py"), monkeypatch, answer)
+
+    assert requests == [["a.py", "b.py", "c.py"]]
+    assert [review['comments'] for review in reviews] == ["Review of a.py.", "Review of b.py.", "Review of c.py."]
+
+
+def test_unattributed_pieces_are_reviewed_alone_and_cached_only_after(monkeypatch):
+    cache = DictReviewCache()
+
+    def answer(labels):
+        # Packed replies only cover the first file; a single piece gets the whole reply
+        return f"### Review for {labels[0]}\nPacked review." if labels else "Single review."
+
+    reviews, requests = _review(_files("a.py", "b.py", "c.py"), monkeypatch, answer, cache)
+
+    assert requests[0] == ["a.py", "b.py", "c.py"]
+    assert sorted(requests[1:]) == [[], []]
+    assert [review['comments'] for review in reviews] == ["Packed review.", "Single review.", "Single review."]
+    # Every file is cached with its own review, never with the packed reply of another file
+    assert sorted(cache.values.values()) == ["Packed review.", "Single review.", "Single review."]
+
+    cached_reviews, cached_requests = _review(_files("a.py", "b.py", "c.py"), monkeypatch, answer, cache)
+
+    assert cached_requests == []
+    assert [review['cached'] for review in cached_reviews] == [True, True, True]